@@ -0,0 +1,102 @@
+'''
+Benchmark - packet decoding (DataHandler)
+
+Compares the legacy per-sample hexadecimal decoder against the vectorized
+binary decoder for one full acquisition (NUM_SAMPLES = 1024, 342 packets).
+
+Usage: python bench_decode.py [repeats]
+'''
+
+import sys
+import timeit
+from binascii import hexlify
+import numpy as np
+from gateway.DataHandler import DataHandler, DataMath
+
+
+NUM_SAMPLES = 1024
+
+
+#####################################################################
+# SYNTHETIC ACQUISITION
+#####################################################################
+def makePackets(numSamples=NUM_SAMPLES):
+    '''
+    Build notifications in the endpoint format: 3 samples per packet
+    (18 bytes) + '\\r\\n', the last packet carries the remaining sample
+    '''
+    counts  = np.random.randint(-32768, 32767, size=(numSamples, 3)).astype('>i2')
+    payload = counts.tobytes()
+    return [payload[i:i+18] + b'\r\n' for i in range(0, len(payload), 18)]
+
+
+def legacyExtractData(rawData, scaleFactor=16384):
+    '''
+    Decoder used before the vectorized path (one int(hex,16) per value)
+    '''
+    math    = DataMath()
+    accels  = dict()
+    rawData = [line[:-4] for line in rawData]
+    rawData = [[line[0:12], line[12:24], line[24:36]] for line in rawData]
+    flatRawData = [item for sublist in rawData for item in sublist]
+    rawData = list(filter(None, flatRawData))
+    accels['x'] = [math.twos_complement(value[0:4], 16) / scaleFactor for value in rawData]
+    accels['y'] = [math.twos_complement(value[4:8], 16) / scaleFactor for value in rawData]
+    accels['z'] = [math.twos_complement(value[8:12],16) / scaleFactor for value in rawData]
+    return accels
+
+
+#####################################################################
+# BENCHMARK
+#####################################################################
+def run(repeats):
+    packets     = makePackets()
+    hexPackets  = [hexlify(p).decode('utf-8') for p in packets]
+
+    # INGEST: work done per notification (PeriphDelegate -> savePacket)
+    # DECODE: work done once per acquisition (processRawData)
+    legacyRaw = []
+    def legacyIngest():
+        legacyRaw.clear()
+        for p in packets: legacyRaw.append(hexlify(p).decode('utf-8'))
+    def legacyDecode():
+        legacyExtractData(legacyRaw)
+
+    hexHandler = DataHandler(rawMode='HEX')
+    def compatIngest():
+        hexHandler.clearPackets()
+        for p in packets: hexHandler.savePacket(hexlify(p).decode('utf-8'))
+    def compatDecode():
+        hexHandler.extractSamples()
+
+    binHandler = DataHandler(rawMode='BIN')
+    def binaryIngest():
+        binHandler.clearPackets()
+        for p in packets: binHandler.savePacket(p)
+    def binaryDecode():
+        binHandler.extractSamples()
+
+    # sanity check: every decoder must agree
+    reference = np.array(list(legacyExtractData(hexPackets).values())).T
+    binaryIngest()
+    assert np.array_equal(reference, binHandler.extractSamples())
+
+    cases = (('legacy HEX', legacyIngest, legacyDecode),
+             ('compat HEX', compatIngest, compatDecode),
+             ('binary',     binaryIngest, binaryDecode))
+
+    results = {}
+    print(f"{'':<12} {'ingest':>10} {'decode':>10} {'total':>10}  (ms/acquisition)")
+    for (name, ingest, decode) in cases:
+        ingest()
+        tIngest = min(timeit.repeat(ingest, number=1, repeat=repeats))
+        tDecode = min(timeit.repeat(decode, number=1, repeat=repeats))
+        results[name] = (tDecode, tIngest + tDecode)
+        print(f"{name:<12} {tIngest*1e3:10.3f} {tDecode*1e3:10.3f} {(tIngest+tDecode)*1e3:10.3f}")
+
+    (legacyDec, legacyTotal) = results['legacy HEX']
+    (binaryDec, binaryTotal) = results['binary']
+    print(f"speedup: decode {legacyDec/binaryDec:.1f}x | total {legacyTotal/binaryTotal:.1f}x")
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
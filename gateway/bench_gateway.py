@@ -0,0 +1,158 @@
+'''
+Benchmark - end-to-end gateway without hardware
+
+Replays simulated endpoints (gateway.Simulator) through the Scheduler
+(PeriphDelegate + DataHandler) and the Uploader (Cloud) against a local
+HTTP stand-in of the webservice. Reports acquisitions/second, per-stage
+latency and memory.
+
+Usage: python bench_gateway.py --endpoints 4 --acquisitions 20 --connections 2
+'''
+
+import argparse
+import json
+import resource
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from gateway.Cloud import Cloud, Uploader
+from gateway.Scheduler import Scheduler, Endpoint
+from gateway.Simulator import SimBLE, SimEndpoint, makeAcquisition
+
+
+#####################################################################
+# WEBSERVICE STAND-IN
+#####################################################################
+class StandIn(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # headers and body are written separately
+    received = []   # (receive time, payload)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        now  = time.monotonic()
+        for payload in (body if isinstance(body, list) else [body]):
+            StandIn.received.append((now, payload))
+
+        response = b'{"OK": 200}'
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+
+#####################################################################
+# INSTRUMENTED SCHEDULER
+#####################################################################
+class TimedScheduler(Scheduler):
+    '''
+    Scheduler recording the duration of each stage
+    '''
+    def __init__(self, *args, **kwargs):
+        Scheduler.__init__(self, *args, **kwargs)
+        self.stages = {'ble': [], 'process': []}
+
+    def acquire(self, endpoint):
+        start = time.monotonic()
+        Scheduler.acquire(self, endpoint)
+        self.stages['ble'].append(time.monotonic() - start)
+
+    def process(self, endpoint, frame):
+        start = time.monotonic()
+        Scheduler.process(self, endpoint, frame)
+        self.stages['process'].append(time.monotonic() - start)
+
+
+
+def percentiles(values):
+    if not values:
+        return "n/a"
+    values = np.array(values) * 1e3
+    return f"p50 {np.percentile(values, 50):8.2f} | p95 {np.percentile(values, 95):8.2f} | max {values.max():8.2f} ms"
+
+
+#####################################################################
+# BENCHMARK
+#####################################################################
+def run(args):
+    tracemalloc.start()
+    outbox = tempfile.mkdtemp(prefix='outbox')
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    sim = SimBLE(scanTime=args.scan_time)
+    for i in range(args.endpoints):
+        sim.addEndpoint(SimEndpoint(f'aa:bb:cc:00:00:{i:02x}',
+                                    acquisitions=[makeAcquisition(seed=i)],
+                                    packetInterval=args.packet_interval,
+                                    dropRate=args.drop, disconnectRate=args.disconnect,
+                                    connectTime=args.connect_time, seed=i))
+
+    uploader = Uploader(Cloud('127.0.0.1', server.server_port), outbox,
+                        batchSize=args.batch)
+    uploader.start()
+
+    queued = dict()
+    def onAcquisition(endpoint, response):
+        response['seq'] = len(queued)
+        queued[response['seq']] = time.monotonic()
+        uploader.send(f"/v1/endpoints/{response['endpointID']}/acquisition", response)
+
+    scheduler = TimedScheduler('24:f5:aa:66:10:6e', onAcquisition,
+                               maxConnections=args.connections, scanTime=args.scan_time,
+                               scanner=sim.scanner, peripheral=sim.peripheral,
+                               workers=args.workers)
+    for mac in sim.endpoints:
+        scheduler.register(Endpoint(mac, 'MT01'))
+
+    start = time.monotonic()
+    while len(StandIn.received) < args.acquisitions and time.monotonic() - start < args.timeout:
+        scheduler.runOnce()
+
+    # stop acquiring and wait for every queued upload
+    scheduler.shutdown()
+    uploader.stop()
+    elapsed = time.monotonic() - start
+    server.shutdown()
+    shutil.rmtree(outbox, ignore_errors=True)
+    (current, peak) = tracemalloc.get_traced_memory()
+
+    upload = [t - queued[p['seq']] for (t, p) in StandIn.received if p.get('seq') in queued]
+    attempts = sum(ep.sent for ep in sim.endpoints.values())
+    print(f"endpoints {args.endpoints} | connections {args.connections} | workers {args.workers}")
+    print(f"acquisitions   {len(StandIn.received)} received / {attempts} attempted in {elapsed:.2f} s")
+    print(f"throughput     {len(StandIn.received)/elapsed:.2f} acquisitions/s")
+    print(f"ble transfer   {percentiles(scheduler.stages['ble'])}")
+    print(f"processing     {percentiles(scheduler.stages['process'])}")
+    print(f"upload         {percentiles(upload)}")
+    print(f"memory         peak traced {peak/1024:.0f} KiB | max RSS "
+          f"{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024:.1f} MiB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--endpoints',       type=int,   default=4)
+    parser.add_argument('--acquisitions',    type=int,   default=20)
+    parser.add_argument('--connections',     type=int,   default=1)
+    parser.add_argument('--workers',         type=int,   default=1)
+    parser.add_argument('--batch',           type=int,   default=20)
+    parser.add_argument('--packet-interval', type=float, default=0.0,
+                        help='seconds between notifications (0.005 = real HC09 rate)')
+    parser.add_argument('--scan-time',       type=float, default=0.0)
+    parser.add_argument('--connect-time',    type=float, default=0.0)
+    parser.add_argument('--drop',            type=float, default=0.0,
+                        help='probability of losing each packet')
+    parser.add_argument('--disconnect',      type=float, default=0.0,
+                        help='probability of a disconnection per acquisition')
+    parser.add_argument('--timeout',         type=float, default=120)
+    run(parser.parse_args())
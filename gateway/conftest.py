@@ -0,0 +1,44 @@
+'''
+Tests of the gateway (the gateway package is imported from this directory)
+'''
+import importlib.util
+import sys
+import types
+
+
+#####################################################################
+# BLUEPY STUB
+#####################################################################
+# bluepy only builds on Linux with BlueZ: without it, BLE, Scheduler and
+# Simulator are imported against these placeholders (the tests drive them
+# with the Simulator, never with a real adapter)
+if importlib.util.find_spec('bluepy') is None:
+    class DefaultDelegate():
+        def __init__(self):
+            pass
+
+    class Peripheral():
+        def __init__(self, deviceAddr=None, *args, **kwargs):
+            raise BTLEDisconnectError(f"bluepy is not installed ({deviceAddr})")
+
+    class Scanner():
+        def withDelegate(self, delegate):
+            return self
+
+        def scan(self, timeout=10):
+            return []
+
+    class UUID():
+        def __init__(self, val):
+            self.val = val
+
+    class BTLEDisconnectError(Exception):
+        pass
+
+    btle = types.ModuleType('bluepy.btle')
+    for cls in (DefaultDelegate, Peripheral, Scanner, UUID, BTLEDisconnectError):
+        setattr(btle, cls.__name__, cls)
+    bluepy = types.ModuleType('bluepy')
+    bluepy.btle = btle
+    sys.modules['bluepy'] = bluepy
+    sys.modules['bluepy.btle'] = btle
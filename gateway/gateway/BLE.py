@@ -1,16 +1,26 @@
-from bluepy.btle import DefaultDelegate
+from bluepy.btle import DefaultDelegate, Peripheral, UUID
 from binascii import hexlify
+import queue
+import threading
+import time
+
+
+UART_UUID   = UUID(0xFFE1)  # HC09 UART characteristic
+UART_HANDLE = 0x0025        # its value handle on the HC09 (CCCD: handle + 1)
 
 
 #####################################################################
 # SCAN_DELEGATE
 #####################################################################
 class ScanDelegate(DefaultDelegate):
-    def __init__(self):
+    def __init__(self, verbose=False):
         DefaultDelegate.__init__(self)
+        self.verbose = verbose
 
 
     def handleDiscovery(self, dev, isNewDev, isNewData):
+        if not self.verbose:
+            return
         if isNewDev:
             print(f"Discovered dev: {dev.addr}")
         elif isNewData: 
@@ -33,6 +43,128 @@ class PeriphDelegate(DefaultDelegate):
 
 
     def handleNotification(self, cHandle, data):
-        rawPacket = hexlify(data).decode('utf-8')
-        self.dataHandler.savePacket(rawPacket)
-        print(f"Notify from hnd {hex(cHandle)}: {rawPacket}")
\ No newline at end of file
+        # hot path (200 packets/s): only copy the packet, no logging
+        if self.dataHandler.rawMode == 'HEX':
+            self.dataHandler.savePacket(hexlify(data).decode('utf-8'))
+        else:
+            self.dataHandler.savePacket(data)
+
+
+
+#####################################################################
+# FRAME_RING
+#####################################################################
+class FrameRing():
+    '''
+    Preallocated ring of acquisition frames.
+    A connection writes its notifications into a free frame, which is
+    handed to the processing worker and released after decoding; the BLE
+    link never waits for the processing of previous acquisitions.
+    '''
+    def __init__(self, numFrames, frameSize):
+        self.frameSize  = frameSize
+        self.buffer     = bytearray(numFrames * frameSize)
+        self.view       = memoryview(self.buffer)
+        self.free       = queue.Queue()
+        for frame in range(numFrames):
+            self.free.put(frame)
+
+
+    def acquire(self, timeout=None):
+        '''
+        Take a free frame (blocks while every frame is being processed)
+        '''
+        return self.free.get(timeout=timeout)
+
+
+    def frameView(self, frame):
+        start = frame * self.frameSize
+        return self.view[start:start + self.frameSize]
+
+
+    def release(self, frame):
+        self.free.put(frame)
+
+
+
+#####################################################################
+# CONNECTION_MANAGER
+#####################################################################
+class ConnectionManager():
+    '''
+    This class connects to registered endpoints directly by MAC, without
+    scanning, and caches the UART characteristic handles of each one.
+    After a failed connection the endpoint is retried with exponential
+    backoff; after scanAfter consecutive failures it is only connected
+    again once a scan sees it advertising.
+    '''
+    def __init__(self, peripheral=Peripheral, backoff=5, maxBackoff=300, scanAfter=3):
+        '''
+        @peripheral: bluepy Peripheral class (or a compatible factory)
+        @backoff: seconds to wait after the first failure (doubled each time)
+        @maxBackoff: max seconds between attempts
+        @scanAfter: consecutive failures before requiring a scan
+        '''
+        self.peripheral = peripheral
+        self.backoff    = backoff
+        self.maxBackoff = maxBackoff
+        self.scanAfter  = scanAfter
+        self.handles    = dict()    # mac -> UART value handle
+        self.failures   = dict()    # mac -> consecutive failures
+        self.retryAt    = dict()    # mac -> monotonic time of the next attempt
+        self.lock       = threading.Lock()
+
+
+    def canConnect(self, mac, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            return now >= self.retryAt.get(mac, 0)
+
+
+    def needsScan(self, mac):
+        with self.lock:
+            return self.failures.get(mac, 0) >= self.scanAfter
+
+
+    def connect(self, mac, delegate):
+        '''
+        Connect and return (peripheral, UART value handle)
+        '''
+        cDev = self.peripheral(mac)
+        cDev.setDelegate(delegate)
+        handle = self.handles.get(mac)
+        if handle is None:
+            handle = self.discover(cDev)
+            self.handles[mac] = handle
+        return (cDev, handle)
+
+
+    def discover(self, cDev):
+        # only on the first connection of each endpoint
+        try:
+            return cDev.getCharacteristics(uuid=UART_UUID)[0].getHandle()
+        except Exception:
+            return UART_HANDLE
+
+
+    def success(self, mac):
+        with self.lock:
+            self.failures[mac] = 0
+            self.retryAt[mac]  = 0
+
+
+    def failure(self, mac):
+        with self.lock:
+            failures = self.failures.get(mac, 0) + 1
+            self.failures[mac] = failures
+            self.retryAt[mac]  = time.monotonic() + min(self.backoff * 2**(failures - 1), self.maxBackoff)
+            # a stale handle may be the cause: discover it again next time
+            self.handles.pop(mac, None)
+
+
+    def seen(self, mac):
+        '''
+        Endpoint advertising in a scan: try it again right away
+        '''
+        with self.lock:
+            self.retryAt[mac] = 0
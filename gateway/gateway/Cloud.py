@@ -1,5 +1,9 @@
 import http.client
 import json
+import os
+import queue
+import threading
+import time
 
 
 #####################################################################
@@ -8,6 +12,7 @@ import json
 class Cloud():
     '''
     This class connects to cloud and sends data to the webservice.
+    The HTTP connection is kept alive and reused between requests.
     '''
     def __init__(self, cHost, cPort):
         self.host = cHost
@@ -20,18 +25,322 @@ class Cloud():
 
 
     def disconnect(self):
-        self.connection.close()
-        #self.connection = None
+        if self.connection is not None:
+            self.connection.close()
+        self.connection = None
 
 
-    def sendToCLoud(self, cURL, dataDict):
-        self.connect()
+    def request(self, method, cURL, body=None, headers=None):
+        '''
+        Send a request over the keep-alive connection.
+        Returns (response, response body); reconnects once if the server
+        closed the connection.
+        '''
+        for attempt in (1, 2):
+            if self.connection is None:
+                self.connect()
+            try:
+                self.connection.request(method, cURL, body, headers or {})
+                response = self.connection.getresponse()
+                data     = response.read()
+                if response.will_close:
+                    self.disconnect()
+                return (response, data)
+
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                # stale keep-alive connection: retry once on a new one
+                self.disconnect()
+                if attempt == 2:
+                    raise
+            except Exception:
+                self.disconnect()
+                raise
+
+
+    def post(self, cURL, data):
+        '''
+        POST compact JSON, returns the response
+        '''
+        return self.postJSON(cURL, data)[0]
+
+
+    def postJSON(self, cURL, data):
+        '''
+        POST compact JSON, returns (response, response body)
+        '''
         headers = {'Content-type': 'application/json'}
-        dataJson = json.dumps(dataDict, indent = 4)
-        self.connection.request("POST", cURL, dataJson, headers)
+        # bytes body: http.client sends it with the headers in one segment
+        # (a str body goes in a second write and stalls on delayed ACKs)
+        body    = json.dumps(data, separators=(',', ':')).encode('utf-8')
+        return self.request("POST", cURL, body, headers)
 
-        response = self.connection.getresponse()
-        self.disconnect()
+
+    def get(self, cURL, headers=None):
+        '''
+        GET a resource, returns (response, response body)
+        '''
+        return self.request("GET", cURL, headers=headers)
+
+
+    def sendToCLoud(self, cURL, dataDict):
+        response = self.post(cURL, dataDict)
         print(f"Sendind data to cloud: {cURL}")
         print(f"Status: {response.status} - reason: {response.reason}")
+        return response
+
+
+
+#####################################################################
+# UPLOADER
+#####################################################################
+class Uploader(threading.Thread):
+    '''
+    This class uploads acquisitions in background.
+    Every payload is first appended to an on-disk outbox (JSON lines) and
+    only leaves it after the webservice accepts it, so acquisitions survive
+    network failures and gateway restarts. The outbox is drained in batches
+    with exponential backoff while the cloud is unreachable.
+    '''
+    def __init__(self, cloud, path, batchSize=20, batchURL=None, maxBackoff=300):
+        '''
+        @cloud: Cloud instance
+        @path: directory of the outbox files
+        @batchSize: max acquisitions per drain step
+        @batchURL: bulk URL accepting a list of payloads; when None each
+        payload is posted to its own URL over the same connection
+        @maxBackoff: max seconds between retries
+        '''
+        threading.Thread.__init__(self, daemon=True)
+        self.cloud      = cloud
+        self.batchSize  = batchSize
+        self.batchURL   = batchURL
+        self.maxBackoff = maxBackoff
+        self.backoff    = 0
+        self.retryAt    = 0
+        self.retryAfter = None
+        self.requeued   = 0
+        self.queue      = queue.Queue()
+        self.outboxFile = os.path.join(path, 'outbox.jsonl')
+        self.offsetFile = os.path.join(path, 'outbox.offset')
+        os.makedirs(path, exist_ok=True)
+        self.offset     = self.readOffset()
+
+
+    def send(self, cURL, dataDict):
+        '''
+        Queue a payload to upload (never blocks the caller)
+        '''
+        self.queue.put((cURL, dataDict))
+
+
+    def stop(self):
+        self.queue.put(None)
+        self.join()
+
+
+    #################################################################
+    # OUTBOX
+    #################################################################
+    def readOffset(self):
+        try:
+            with open(self.offsetFile) as f:
+                return int(f.read() or 0)
+        except (OSError, ValueError):
+            return 0
+
+
+    def writeOffset(self, offset):
+        # atomic replace: a crash never leaves a half written offset
+        tmpFile = self.offsetFile + '.tmp'
+        with open(tmpFile, 'w') as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpFile, self.offsetFile)
+        self.offset = offset
+
+
+    def append(self, items):
+        lines = ''.join(json.dumps({'url': url, 'data': data}, separators=(',', ':')) + '\n'
+                        for (url, data) in items)
+        with open(self.outboxFile, 'ab+') as f:
+            # a record cut by a crash is closed: never glued to the next one
+            end = f.seek(0, os.SEEK_END)
+            if end:
+                f.seek(end - 1)
+                if f.read(1) != b'\n':
+                    lines = '\n' + lines
+            f.write(lines.encode())
+            f.flush()
+            os.fsync(f.fileno())
+
+
+    def pending(self):
+        '''
+        Read up to batchSize unsent records: list of (endOffset, url, data)
+        '''
+        records = []
+        try:
+            with open(self.outboxFile, 'rb') as f:
+                f.seek(self.offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break   # partially written record
+                    try:
+                        record = json.loads(line)
+                        records.append((f.tell(), record['url'], record['data']))
+                    except (ValueError, KeyError, TypeError):
+                        # cut by a crash: skipped, passed with the next records sent
+                        print(f"Skipping a corrupt outbox record: {line[:80]!r}")
+                    if len(records) == self.batchSize:
+                        break
+        except FileNotFoundError:
+            pass
+        return records
+
+
+    def compact(self):
+        # everything was sent: start a fresh outbox. Offset 0 first: a
+        # crash in between resends the sent records, never skips new ones
+        self.writeOffset(0)
+        with open(self.outboxFile, 'w'):
+            pass
+
+
+    #################################################################
+    # UPLOAD
+    #################################################################
+    def accepted(self, response):
+        '''
+        True: sent | False: retry later | raise: rejected by the webservice
+        '''
+        if 200 <= response.status < 300:
+            return True
+        if response.status >= 500 or response.status == 429:
+            retryAfter = response.getheader('Retry-After')
+            if retryAfter and retryAfter.isdigit():
+                self.retryAfter = min(int(retryAfter), self.maxBackoff)
+            return False
+        raise ValueError(f"rejected ({response.status} - {response.reason})")
+
+
+    def itemStatus(self, body, count):
+        '''
+        Status of each acquisition of a bulk response ({"status": [...]}),
+        None when the body has none
+        '''
+        try:
+            status = json.loads(body)['status']
+        except (ValueError, TypeError, KeyError):
+            return None
+        if not isinstance(status, list) or len(status) != count:
+            return None
+        return status
+
+
+    def upload(self, records):
+        '''
+        Send records in order, returns the outbox offset after the last
+        record accepted or rejected for good
+        '''
+        if not self.batchURL:
+            return self.uploadEach(records)
+
+        batch = [data for (end, url, data) in records]
+        (response, body) = self.cloud.postJSON(self.batchURL, batch)
+        try:
+            if not self.accepted(response):
+                return self.offset
+        except ValueError as ex:
+            # the batch itself was refused: each record judged on its own URL
+            print(f"Batch refused, sending one by one: {ex}")
+            return self.uploadEach(records)
+
+        # per-item status: failed items are queued again at the end of the
+        # outbox (before the offset moves past them) and retried later
+        status = self.itemStatus(body, len(records)) or [response.status] * len(records)
+        retry  = []
+        for ((end, url, data), code) in zip(records, status):
+            if code >= 500 or code == 429:
+                retry.append((url, data))
+            elif not 200 <= code < 300:
+                print(f"Dropping {url}: rejected ({code})")
+        if retry:
+            self.append(retry)
+            self.requeued = len(retry)
+        return records[-1][0]
+
+
+    def uploadEach(self, records):
+        '''
+        Send records one by one to their own URL
+        '''
+        offset = self.offset
+        for (end, url, data) in records:
+            try:
+                if not self.accepted(self.cloud.post(url, data)):
+                    break
+            except ValueError as ex:
+                print(f"Dropping {url}: {ex}")
+            offset = end
+        return offset
+
+
+    def drain(self):
+        '''
+        Upload pending records, returns False when the cloud failed
+        '''
+        while True:
+            records = self.pending()
+            if not records:
+                if self.offset:
+                    self.compact()
+                return True
+
+            self.requeued = 0
+            try:
+                offset = self.upload(records)
+            except Exception as ex:
+                print(f"Upload failed: {ex}")
+                offset = self.offset
+
+            if offset == self.offset:
+                return False
+            self.writeOffset(offset)
+            sent = sum(1 for (end, url, data) in records if end <= offset) - self.requeued
+            print(f"Sent {sent} acquisition(s) to cloud")
+            if self.requeued:
+                # back off before sending the failed ones again
+                return False
+
+
+    def run(self):
+        running = True
+        while True:
+            # drain the outbox unless backing off from a failure
+            if time.monotonic() >= self.retryAt:
+                if self.drain():
+                    self.backoff = 0
+                else:
+                    self.backoff = self.retryAfter or min(max(2 * self.backoff, 1), self.maxBackoff)
+                    self.retryAt = time.monotonic() + self.backoff
+                self.retryAfter = None
+
+            if not running:
+                break
+
+            # wait for new payloads (or for the next retry)
+            timeout = max(self.retryAt - time.monotonic(), 0) if self.backoff else None
+            items   = []
+            try:
+                items.append(self.queue.get(timeout=timeout))
+                while True:
+                    items.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
 
+            if None in items:
+                running = False
+                items   = [item for item in items if item is not None]
+            if items:
+                self.append(items)
@@ -1,6 +1,22 @@
 import numpy as np
 from datetime import datetime
 import json
+import time
+from gateway.WaveformStore import WaveformStore
+
+
+PACKET_END      = b'\r\n'
+PAYLOAD_SIZE    = 18    # 3 samples * 3 axis * 2 bytes (see ble_send_data)
+NUM_SAMPLES     = 1024  # match with NUM_SAMPLES from endpoint/main.c
+SAMPLE_RATE     = 1000  # Hz, endpoint acquisition timer (1 ms)
+AXES            = ('x','y','z')
+
+
+def packetsFor(numSamples):
+    # ble_send_data: 3 samples per packet, the last one with the remainder
+    return -(-numSamples // 3)
+
+NUM_PACKETS     = packetsFor(NUM_SAMPLES)   # 342
 
 
 ##################################################################
@@ -18,23 +34,170 @@ class DataMath():
         return value
 
 
+    def decodeSamples(self, payload):
+        '''
+        Decode a payload of big-endian int16 (Ax, Ay, Az) samples at once.
+        Returns an (N,3) int16 array of raw accelerometer counts.
+        '''
+        counts = np.frombuffer(payload, dtype='>i2')
+        counts = counts[:counts.size - counts.size % 3]
+        return counts.reshape(-1, 3)
+
+
+    def hexToPayload(self, rawData):
+        '''
+        Join hexlified packets (with '0d0a' terminators) into a single payload
+        '''
+        return bytes.fromhex(''.join([line[:-4] for line in rawData]))
+
+
     def removeMean(self, accel_values):
-        return (accel_values - np.mean(accel_values))
+        return (accel_values - np.mean(accel_values, axis=0))
 
 
     def rms(self, accel_values):
-        return np.sqrt(np.mean(accel_values**2))
+        return np.sqrt(np.mean(accel_values**2, axis=0))
 
 
     def crestFactor(aself, accel_values, rms_value):
-        return np.max(np.abs(accel_values))/rms_value
+        return np.max(np.abs(accel_values), axis=0)/rms_value
 
 
     def calculateFeatures(self, axis_values):
+        '''
+        RMS and crest factor of one axis (N,) or of every column of (N,3)
+        '''
         features        = dict()
         axis_values     = self.removeMean(axis_values)
-        features["rms"] = round(self.rms(axis_values), 6)
-        features["cf"]  = round(self.crestFactor(axis_values, features["rms"]), 6)
+        features["rms"] = np.round(self.rms(axis_values), 6)
+        features["cf"]  = np.round(self.crestFactor(axis_values, features["rms"]), 6)
+        return features
+
+
+    def spectrum(self, samples, sampleRate):
+        '''
+        One real FFT over every column of (N,3) samples (mean removed).
+        Returns (freqs, amplitudes) with single-sided amplitudes (N/2+1, 3)
+        '''
+        n       = samples.shape[0]
+        freqs   = np.fft.rfftfreq(n, d=1/sampleRate)
+        amps    = np.abs(np.fft.rfft(self.removeMean(samples), axis=0)) * 2 / n
+        amps[0] /= 2
+        if n % 2 == 0:
+            amps[-1] /= 2
+        return (freqs, amps)
+
+
+    def bandEnergies(self, freqs, amps, bands, numSamples):
+        '''
+        Mean-square acceleration (g^2) inside each (low, high) Hz band.
+        @numSamples: samples of the spectrum (see spectrum)
+        Returns a (numBands, 3) array
+        '''
+        # power of each bin: a sine of amplitude A has mean square A^2/2,
+        # DC and Nyquist (even N) components have mean square A^2
+        power   = amps**2 / 2
+        power[0] *= 2
+        if numSamples % 2 == 0:
+            power[-1] *= 2
+        cumPower = np.vstack((np.zeros((1, amps.shape[1])), np.cumsum(power, axis=0)))
+
+        bands   = np.asarray(bands, dtype=float).reshape(-1, 2)
+        lo      = np.searchsorted(freqs, bands[:,0], side='left')
+        hi      = np.searchsorted(freqs, bands[:,1], side='right')
+        return cumPower[hi] - cumPower[lo]
+
+
+    def welchPSD(self, samples, sampleRate, nperseg=256):
+        '''
+        Welch PSD (Hann window, 50% overlap) of every column of (N,3) samples.
+        Returns (freqs, psd) with psd in g^2/Hz (nperseg/2+1, 3)
+        '''
+        nperseg = min(nperseg, samples.shape[0])
+        step    = nperseg // 2
+        # periodic Hann (as scipy.signal.welch), not the symmetric np.hanning
+        window  = np.hanning(nperseg + 1)[:-1]
+
+        # segments: (numSegments, 3, nperseg) views over samples
+        segments = np.lib.stride_tricks.sliding_window_view(samples, nperseg, axis=0)[::step]
+        segments = segments - np.mean(segments, axis=-1, keepdims=True)
+        spectra  = np.fft.rfft(segments * window, axis=-1)
+
+        psd = np.mean(np.abs(spectra)**2, axis=0).T / (sampleRate * np.sum(window**2))
+        # single-sided: double every bin but DC (and Nyquist, if present)
+        if nperseg % 2:
+            psd[1:] *= 2
+        else:
+            psd[1:-1] *= 2
+        return (np.fft.rfftfreq(nperseg, d=1/sampleRate), psd)
+
+
+    def spectralFeatures(self, samples, sampleRate=SAMPLE_RATE, bands=None):
+        '''
+        Dominant frequency and amplitude (DC excluded) of every column of
+        (N,3) samples and, optionally, the energy inside each band
+        '''
+        (freqs, amps) = self.spectrum(samples, sampleRate)
+        features    = dict()
+        peak        = np.argmax(amps[1:], axis=0) + 1
+        features["freq"] = np.round(freqs[peak], 6)
+        features["amp"]  = np.round(amps[peak, np.arange(amps.shape[1])], 6)
+        if bands:
+            features["bands"] = np.round(self.bandEnergies(freqs, amps, bands, samples.shape[0]), 9)
+        return features
+
+
+
+#####################################################################
+# RUNNING_STATS
+#####################################################################
+class RunningStats():
+    '''
+    Per-axis running statistics of an acquisition, updated packet by packet
+    (Welford/Chan merge): count, mean, M2, min, max and sum of squares.
+    '''
+    def __init__(self, numAxes=3):
+        self.numAxes = numAxes
+        self.clear()
+
+
+    def clear(self):
+        self.n      = 0
+        self.mean   = np.zeros(self.numAxes)
+        self.m2     = np.zeros(self.numAxes)
+        self.min    = np.full(self.numAxes, np.inf)
+        self.max    = np.full(self.numAxes, -np.inf)
+        self.sumSq  = np.zeros(self.numAxes)
+
+
+    def update(self, values):
+        '''
+        Merge an (n,3) block of samples into the statistics
+        '''
+        n = values.shape[0]
+        if n == 0:
+            return
+        values  = values.astype(float)
+        mean    = values.mean(axis=0)
+        total   = self.n + n
+        delta   = mean - self.mean
+        self.m2    += ((values - mean)**2).sum(axis=0) + delta**2 * self.n * n / total
+        self.mean  += delta * n / total
+        self.n      = total
+        self.sumSq += (values**2).sum(axis=0)
+        np.minimum(self.min, values.min(axis=0), out=self.min)
+        np.maximum(self.max, values.max(axis=0), out=self.max)
+
+
+    def features(self, scale=1):
+        '''
+        RMS and crest factor (mean removed) of every axis
+        '''
+        features        = dict()
+        rms             = np.sqrt(self.m2 / self.n)
+        peak            = np.maximum(self.max - self.mean, self.mean - self.min)
+        features["rms"] = np.round(rms / scale, 6)
+        features["cf"]  = np.round(peak / rms, 6)
         return features
 
 
@@ -45,25 +208,53 @@ class DataMath():
 class DataHandler(DataMath):
     '''
     This class groups data from BLE notifications, applies some math functions 
-    and transforms it to JSON or CSV files.
+    and transforms it to JSON or CSV files, or to a binary WaveformStore.
     DataHandler retains data even if the Peripheral is disconnected.
     It also keeps information about specific endpoint, station and equipment.
     '''
 
-    def __init__(self, saveFile=False, dFormat='CSV',  path='/', sFactor=0):
+    def __init__(self, saveFile=False, dFormat='CSV',  path='/', sFactor=0,
+                 numPackets=NUM_PACKETS, rawMode='BIN', sampleRate=SAMPLE_RATE,
+                 bands=None, welch=False, store=None, spectral=True, streaming=False):
         '''
         @saveFile: save raw samples to File
-        @dFormat: Choose between JSON or CSV files to save
+        @dFormat: Choose between JSON, CSV or BIN (WaveformStore) to save
+        @numPackets: expected packets per acquisition (preallocates the buffer)
+        @rawMode: 'BIN' keeps raw notification bytes, 'HEX' keeps hexlified
+        strings (compatibility mode)
+        @sampleRate: endpoint sample rate in Hz
+        @bands: list of (low, high) Hz bands to compute energies, eg. [(0, 50)]
+        @welch: keep a Welch PSD of the last acquisition in self.psd
+        @store: WaveformStore shared between handlers (BIN format); when
+        None one is created at path
+        @spectral: compute freq/amp (and bands) features from the waveform
+        @streaming: update RMS/crest factor statistics as packets arrive;
+        raw packets are only kept when saveFile or spectral need them
         '''
         self.info           = dict.fromkeys(['endpointID','equipID','macStationID','timeStamp'], None)
         self.features       = dict.fromkeys(['x','y','z'], None)
         self.scaleFactor    = self.setScaleFactor(sFactor)
         self.rawData        = list()
+        self.rawMode        = rawMode
+        self.packetBuffer   = bytearray(numPackets * PAYLOAD_SIZE + len(PACKET_END))
+        self.bufferView     = memoryview(self.packetBuffer)
+        self.bufferLen      = 0
         self.newAcquisition = False
         self.acq_counter    = 0
         self.saveFile       = saveFile
         self.dFormat        = dFormat
         self.path           = path
+        self.sampleRate     = sampleRate
+        self.bands          = bands
+        self.welch          = welch
+        self.psd            = None
+        self.store          = store
+        if (saveFile and dFormat == 'BIN' and store is None):
+            self.store = WaveformStore(path)
+        self.spectral       = spectral
+        self.streaming      = streaming
+        self.keepRaw        = (not streaming) or saveFile or spectral or welch
+        self.stats          = RunningStats()
 
 
     def checkNewAcquisition(self):
@@ -99,7 +290,56 @@ class DataHandler(DataMath):
 
 
     def savePacket(self, rawPacket):
-        self.rawData.append(rawPacket)
+        if self.streaming:
+            self.stats.update(self.decodePacket(rawPacket))
+            if not self.keepRaw:
+                return
+
+        if self.rawMode == 'HEX':
+            self.rawData.append(rawPacket)
+            return
+
+        # copy the whole packet and step back over '\r\n': the next packet
+        # overwrites the terminator, leaving only payloads in the buffer
+        start = self.bufferLen
+        end   = start + len(rawPacket)
+        if end > len(self.bufferView):
+            self.growBuffer(end)
+        self.bufferView[start:end] = rawPacket
+        self.bufferLen = end - 2 if rawPacket[-1] == PACKET_END[-1] else end
+
+
+    def growBuffer(self, size):
+        # more packets than expected: move to a bigger buffer of our own
+        buffer = bytearray(size)
+        buffer[:self.bufferLen] = self.bufferView[:self.bufferLen]
+        self.packetBuffer = buffer
+        self.bufferView   = memoryview(buffer)
+
+
+    def attachBuffer(self, view):
+        '''
+        Receive the next acquisition into an external buffer (eg. FrameRing)
+        '''
+        self.bufferView = view
+        self.bufferLen  = 0
+
+
+    def decodePacket(self, rawPacket):
+        '''
+        (n,3) raw counts of a single packet (streaming mode)
+        '''
+        if self.rawMode == 'HEX':
+            return self.decodeSamples(bytes.fromhex(rawPacket[:-4]))
+        if rawPacket[-1] == PACKET_END[-1]:
+            return self.decodeSamples(memoryview(rawPacket)[:-len(PACKET_END)])
+        return self.decodeSamples(rawPacket)
+
+
+    def clearPackets(self):
+        self.rawData.clear()
+        self.bufferLen = 0
+        self.stats.clear()
 
     
     def saveJSON(self, accels):
@@ -120,43 +360,80 @@ class DataHandler(DataMath):
         accel_values = np.stack((accels['x'], accels['y'], accels['z'])).T
         np.savetxt(f'{self.path}/vibration{self.acq_counter}.csv', accel_values, fmt='%3.5f', delimiter=',')
 
+
+
+    def saveBIN(self, counts):
+        '''
+        Append raw counts to the binary waveform store, at the time of the
+        acquisition (info timeStamp)
+        '''
+        if self.info['timeStamp']:
+            timestamp = datetime.strptime(self.info['timeStamp'], '%Y-%m-%d %H:%M:%S').timestamp()
+        else:
+            timestamp = time.time()
+        self.store.append(self.info['endpointID'] or '', timestamp, counts, self.scaleFactor)
+
     
     def extractData(self, rawData):
         '''
         It extracts raw hexadecimal data and converts to G acceleration force.
         Default (sensitivity) scale factor: 16384 (2g)
         '''
-        accels = dict()
+        samples = self.decodeSamples(self.hexToPayload(rawData)) / self.scaleFactor
+        return {'x': samples[:,0], 'y': samples[:,1], 'z': samples[:,2]}
 
-        # delete '0d0a' of each packet
-        rawData = [line[:-4] for line in rawData]
 
-        # divide each line into a list with samples
-        rawData = [[line[0:12], line[12:24], line[24:36]] for line in rawData]
-        flatRawData = [item for sublist in rawData for item in sublist]
+    def extractCounts(self):
+        '''
+        Decode every sample of the current acquisition at once.
+        Returns an (N,3) array of raw accelerometer counts (x, y, z columns)
+        '''
+        if self.rawMode == 'HEX':
+            payload = self.hexToPayload(self.rawData)
+        else:
+            payload = self.bufferView[:self.bufferLen]
+        return self.decodeSamples(payload)
 
-        # delete empty spaces from list
-        rawData = list(filter(None, flatRawData))
-        
-        # splits and convert each sample line to the respective acceleration axis
-        accels['x'] = [self.twos_complement(value[0:4], 16) / self.scaleFactor for value in rawData]
-        accels['y'] = [self.twos_complement(value[4:8], 16) / self.scaleFactor for value in rawData]
-        accels['z'] = [self.twos_complement(value[8:12],16) / self.scaleFactor for value in rawData]
-        return accels
+
+    def extractSamples(self):
+        '''
+        Returns an (N,3) array of G acceleration force (x, y, z columns)
+        '''
+        return self.extractCounts() / self.scaleFactor
 
 
     def processRawData(self):
-        accels = self.extractData(self.rawData)
-        for (axis, axis_values) in accels.items():
-            accels[axis] = np.array(axis_values) # convert to numpy array
-            self.features[axis] = self.calculateFeatures(accels[axis])
+        # all axes at once: each feature is an array with one value per axis
+        features = dict()
+        if self.streaming:
+            features.update(self.stats.features(self.scaleFactor))
+
+        if self.keepRaw:
+            counts  = self.extractCounts()
+            samples = counts / self.scaleFactor
+            accels  = {'x': samples[:,0], 'y': samples[:,1], 'z': samples[:,2]}
+            if not self.streaming:
+                features.update(self.calculateFeatures(samples))
+            if self.spectral:
+                features.update(self.spectralFeatures(samples, self.sampleRate, self.bands))
+            if self.welch:
+                self.psd = self.welchPSD(samples, self.sampleRate)
+
+        if not self.spectral:
+            # no waveform features: sent as null
+            features["freq"] = features["amp"] = np.full(len(AXES), None)
+
+        for (i, axis) in enumerate(AXES):
+            self.features[axis] = {name: values[..., i].tolist() for (name, values) in features.items()}
 
         # saving raw samples        
         if (self.saveFile and self.dFormat == 'JSON'):
             self.saveJSON(accels)
         elif (self.saveFile and self.dFormat == 'CSV'):
             self.saveCSV(accels)
+        elif (self.saveFile and self.dFormat == 'BIN'):
+            self.saveBIN(counts)
 
-        # Clear list to new acquisition
-        self.rawData.clear()
-        self.newAcquisition = True
\ No newline at end of file
+        # Clear buffers to new acquisition
+        self.clearPackets()
+        self.newAcquisition = True
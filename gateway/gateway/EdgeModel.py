@@ -0,0 +1,193 @@
+import json
+import os
+import threading
+import time
+import numpy as np
+
+
+AXES            = ('x','y','z')
+VERDICT_FIELDS  = ('rms', 'cf', 'freq', 'amp')  # features stored by the webservice
+
+
+#####################################################################
+# SVM MODEL
+#####################################################################
+class SVMModel():
+    '''
+    One-class SVM of one axis from the parameters exported by the
+    webservice (RBF kernel): plain numbers, nothing is executed
+    '''
+    def __init__(self, params):
+        '''
+        @params: {'kernel', 'gamma', 'supportVectors', 'dualCoef', 'intercept'}
+        '''
+        if params.get('kernel') != 'rbf':
+            raise ValueError(f"Unsupported kernel: {params.get('kernel')}")
+        self.params         = params
+        self.gamma          = float(params['gamma'])
+        self.supportVectors = np.asarray(params['supportVectors'], dtype=float).reshape(-1, 2)
+        self.dualCoef       = np.asarray(params['dualCoef'], dtype=float).reshape(-1)
+        self.intercept      = float(params['intercept'])
+        if len(self.dualCoef) != len(self.supportVectors):
+            raise ValueError("Support vectors and coefficients do not match")
+
+
+    def decision(self, values):
+        '''
+        Decision values of (N,2) features, as OneClassSVM.decision_function:
+        sum(dualCoef * exp(-gamma * |sv - x|^2)) + intercept (negative: outlier)
+        '''
+        values = np.asarray(values, dtype=float).reshape(-1, 2)
+        dist   = ((values[:, None, :] - self.supportVectors[None, :, :]) ** 2).sum(axis=2)
+        return np.exp(-self.gamma * dist) @ self.dualCoef + self.intercept
+
+
+
+#####################################################################
+# EDGE_MODEL
+#####################################################################
+class EdgeModel():
+    '''
+    This class scores acquisitions at the gateway with the models trained
+    by the webservice (one OneClassSVM per axis and equipment).
+    Models are pulled from GET /v1/equipments/<ID>/model as plain SVM
+    parameters (see SVMModel), cached on disk as JSON and refreshed with
+    conditional requests (ETag).
+    '''
+    def __init__(self, cloud, path, refresh=3600):
+        '''
+        @cloud: Cloud instance used only for models (not shared with uploads)
+        @path: directory of the cached models
+        @refresh: seconds between checks for a new model version
+        '''
+        self.cloud      = cloud
+        self.path       = path
+        self.refresh    = refresh
+        self.models     = dict()    # equipID -> (version, {axis: SVMModel})
+        self.checked    = dict()    # equipID -> last check (monotonic)
+        self.lock       = threading.Lock()  # models, checked
+        self.fetchLock  = threading.Lock()  # the cloud connection
+        os.makedirs(path, exist_ok=True)
+
+
+    #################################################################
+    # MODEL CACHE
+    #################################################################
+    def cacheFile(self, equipID):
+        return os.path.join(self.path, f'{equipID}.json')
+
+
+    def parse(self, data):
+        '''
+        {'version', 'models': {axis: params}} -> (version, {axis: SVMModel})
+        '''
+        return (data['version'], {axis: SVMModel(data['models'][axis]) for axis in AXES})
+
+
+    def loadCached(self, equipID):
+        try:
+            with open(self.cacheFile(equipID)) as f:
+                return self.parse(json.load(f))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+
+    def saveCached(self, equipID, entry):
+        data    = {'version': entry[0], 'models': {axis: entry[1][axis].params for axis in AXES}}
+        tmpFile = self.cacheFile(equipID) + '.tmp'
+        with open(tmpFile, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmpFile, self.cacheFile(equipID))
+
+
+    def fetch(self, equipID, version=None):
+        '''
+        Pull the models of an equipment from the webservice.
+        Returns (version, {axis: SVMModel}), None when unchanged,
+        or False when the equipment has no model.
+        '''
+        headers = {'If-None-Match': f'"{version}"'} if version else None
+        with self.fetchLock:
+            (response, data) = self.cloud.get(f'/v1/equipments/{equipID}/model', headers)
+        if response.status == 304:
+            return None
+        if response.status == 404:
+            return False
+        if response.status != 200:
+            raise ConnectionError(f"{response.status} - {response.reason}")
+        return self.parse(json.loads(data))
+
+
+    def getModels(self, equipID):
+        '''
+        Cached models of an equipment, refreshed every self.refresh seconds
+        (fetched out of the lock: scoring of other equipments goes on).
+        Returns {axis: SVMModel} or None when there is no model.
+        '''
+        now = time.monotonic()
+        with self.lock:
+            if equipID not in self.models:
+                self.models[equipID] = self.loadCached(equipID)
+            entry = self.models[equipID]
+            due   = now - self.checked.get(equipID, -self.refresh) >= self.refresh
+            if due:
+                self.checked[equipID] = now
+
+        if due:
+            try:
+                fetched = self.fetch(equipID, entry[0] if entry else None)
+                if fetched is False:
+                    entry = None
+                elif fetched is not None:
+                    entry = fetched
+                    self.saveCached(equipID, entry)
+                with self.lock:
+                    self.models[equipID] = entry
+
+            # offline: keep scoring with the cached models
+            except Exception as ex:
+                print(f"Model update failed ({equipID}): {ex}")
+
+        return entry[1] if entry else None
+
+
+    #################################################################
+    # SCORING
+    #################################################################
+    def score(self, equipID, features):
+        '''
+        Anomaly verdict of an acquisition: True, False or None (no model).
+        The system is considered healthy if at least one axis is normal (1)
+        '''
+        models = self.getModels(equipID)
+        if models is None:
+            return None
+
+        healthy = []
+        for axis in AXES:
+            values = [features[axis]['rms'], features[axis]['cf']]
+            healthy.append(models[axis].decision(values)[0] > 0)
+        return not any(healthy)
+
+
+    def apply(self, equipID, response, mode='verdict', psd=None):
+        '''
+        Score an acquisition (DataHandler.checkNewAcquisition) and shape
+        the payload to upload:
+        'full': every feature | 'verdict': anomaly + stored features only |
+        'anomalies': full detail (plus the PSD) only for anomalies
+        '''
+        anomaly = self.score(equipID, response)
+        if anomaly is None:
+            return response
+
+        response['anomaly'] = anomaly
+        if mode == 'full' or (mode == 'anomalies' and anomaly):
+            if psd is not None:
+                response['psd'] = {'freq': psd[0].tolist(),
+                                   **{axis: psd[1][:, i].tolist() for (i, axis) in enumerate(AXES)}}
+            return response
+
+        for axis in AXES:
+            response[axis] = {field: response[axis][field] for field in VERDICT_FIELDS}
+        return response
@@ -0,0 +1,234 @@
+from bluepy.btle import Scanner, Peripheral
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from gateway.BLE import ScanDelegate, PeriphDelegate, FrameRing, ConnectionManager
+from gateway.DataHandler import DataHandler, NUM_SAMPLES, NUM_PACKETS, PAYLOAD_SIZE, PACKET_END, packetsFor
+
+
+FRAME_SIZE  = NUM_PACKETS * PAYLOAD_SIZE + len(PACKET_END)
+
+
+#####################################################################
+# ENDPOINT
+#####################################################################
+class Endpoint():
+    '''
+    Registered endpoint (acquisition device) and its acquisition state.
+    Each endpoint owns its DataHandler and PeriphDelegate.
+    '''
+    def __init__(self, mac, equipID, numSamples=NUM_SAMPLES, sFactor=0, interval=0, **handlerArgs):
+        '''
+        @mac: endpoint BLE MAC address
+        @equipID: equipment monitored by the endpoint
+        @numSamples: NUM_SAMPLES of the endpoint firmware (3 samples/packet)
+        @sFactor: accelerometer scale factor (see DataHandler.setScaleFactor)
+        @interval: minimum seconds between two acquisitions of this endpoint
+        @handlerArgs: extra DataHandler arguments (saveFile, dFormat, path...)
+        '''
+        self.mac            = mac.lower()
+        self.equipID        = equipID
+        self.numPackets     = packetsFor(numSamples)
+        self.interval       = interval
+        self.dataHandler    = DataHandler(sFactor=sFactor, numPackets=self.numPackets, **handlerArgs)
+        self.delegate       = PeriphDelegate().setDataHandler(self.dataHandler)
+        self.nextRun        = 0
+        self.busy           = False
+
+
+    def isDue(self, now):
+        return (not self.busy) and (now >= self.nextRun)
+
+
+
+#####################################################################
+# SCHEDULER
+#####################################################################
+class Scheduler():
+    '''
+    This class schedules acquisitions of several endpoints.
+    Due endpoints are connected directly (ConnectionManager), or after being
+    found by a scan when direct connections keep failing. Acquisitions run
+    in parallel, up to maxConnections at a time (BLE adapter limit); the
+    others are queued.
+    Notifications land in a FrameRing and completed acquisitions are
+    decoded/processed by worker threads, after the BLE link is released.
+    '''
+    def __init__(self, gatewayMac, onAcquisition, maxConnections=1, scanTime=2.0,
+                 scanner=None, peripheral=Peripheral, workers=1, frames=None, connections=None):
+        '''
+        @gatewayMac: MAC of this gateway (station)
+        @onAcquisition: callback(endpoint, data) called after each acquisition
+        @maxConnections: simultaneous BLE connections allowed by the adapter
+        @scanTime: seconds of each BLE scan
+        @scanner, peripheral: bluepy Scanner instance and Peripheral class
+        @workers: threads processing completed acquisitions
+        @frames: acquisition frames in the ring (default 2 * maxConnections)
+        @connections: ConnectionManager (default: one using peripheral)
+        '''
+        self.gatewayMac     = gatewayMac
+        self.onAcquisition  = onAcquisition
+        self.maxConnections = maxConnections
+        self.scanTime       = scanTime
+        self.scanner        = scanner or Scanner().withDelegate(ScanDelegate())
+        self.connections    = connections or ConnectionManager(peripheral)
+        self.endpoints      = dict()
+        self.active         = 0
+        self.lock           = threading.Lock()
+        self.wakeup         = threading.Event()
+        self.executor       = ThreadPoolExecutor(max_workers=maxConnections)
+        self.worker         = ThreadPoolExecutor(max_workers=workers)
+        self.ring           = FrameRing(frames or 2 * maxConnections, FRAME_SIZE)
+
+
+    def register(self, endpoint):
+        self.endpoints[endpoint.mac] = endpoint
+        return endpoint
+
+
+    def dueEndpoints(self):
+        now = time.monotonic()
+        with self.lock:
+            return [ep for ep in self.endpoints.values() if ep.isDue(now)]
+
+
+    def submit(self, endpoint):
+        with self.lock:
+            endpoint.busy = True
+            self.active  += 1
+        self.executor.submit(self.acquire, endpoint)
+
+
+    def releaseLink(self):
+        with self.lock:
+            self.active -= 1
+        self.wakeup.set()
+
+
+    def release(self, endpoint):
+        with self.lock:
+            endpoint.busy    = False
+            endpoint.nextRun = time.monotonic() + endpoint.interval
+        self.wakeup.set()
+
+
+    def acquire(self, endpoint):
+        '''
+        Connect to the endpoint and receive all notifications into a frame
+        '''
+        dataMan  = endpoint.dataHandler
+        frame    = self.ring.acquire()
+        complete = False
+        dataMan.attachBuffer(self.ring.frameView(frame))
+        try:
+            (cDev, uartHnd) = self.connections.connect(endpoint.mac, endpoint.delegate)
+
+            # Turn notifications on (the endpoint powers its BLE module off
+            # between acquisitions, so the CCCD is written every time)
+            cDev.writeCharacteristic(uartHnd + 1, b"\x01\x00")
+
+            # Tells the sensor to send accelerometer data
+            cDev.writeCharacteristic(uartHnd, b"\x31")
+
+            notificationsCounter = 0
+            while True:
+                try:
+                    if cDev.waitForNotifications(2.0):
+                        notificationsCounter += 1
+
+                        if (notificationsCounter == endpoint.numPackets):
+                            # After send all data, the sensor needs to receive x30 to go to standby
+                            cDev.writeCharacteristic(uartHnd, b"\x30")
+                            cDev.disconnect()
+                            dataMan.setInfo(endpoint.mac, endpoint.equipID, self.gatewayMac)
+                            complete = True
+                            break
+                    else:
+                        # endpoint stopped sending: drop the partial acquisition
+                        cDev.disconnect()
+                        break
+
+                # handles a unexpected disconnection from Peripheral
+                except Exception as ex:
+                    print(f"{endpoint.mac}: {ex}")
+                    break
+
+        except Exception as ex:
+            print(f"{endpoint.mac}: {ex}")
+
+        finally:
+            self.releaseLink()
+            if complete:
+                self.connections.success(endpoint.mac)
+            else:
+                self.connections.failure(endpoint.mac)
+
+            if complete:
+                self.worker.submit(self.process, endpoint, frame)
+            else:
+                dataMan.clearPackets()
+                self.ring.release(frame)
+                self.release(endpoint)
+
+
+    def process(self, endpoint, frame):
+        '''
+        Decode, compute features and store a completed acquisition (worker)
+        '''
+        dataMan  = endpoint.dataHandler
+        response = False
+        try:
+            dataMan.processRawData()
+            response = dataMan.checkNewAcquisition()
+
+        except Exception as ex:
+            print(f"{endpoint.mac}: {ex}")
+
+        finally:
+            dataMan.clearPackets()
+            self.ring.release(frame)
+            self.release(endpoint)
+
+        if response is not False:
+            self.onAcquisition(endpoint, response)
+
+
+    def runOnce(self):
+        '''
+        Dispatch due endpoints: directly, or after a scan for the ones whose
+        direct connections keep failing
+        '''
+        now = time.monotonic()
+        due = [ep for ep in self.dueEndpoints() if self.connections.canConnect(ep.mac, now)]
+        if not due or self.active >= self.maxConnections:
+            # wait until a link or an endpoint is released
+            self.wakeup.wait(0.5)
+            self.wakeup.clear()
+            return
+
+        toScan = []
+        for endpoint in due:
+            if self.connections.needsScan(endpoint.mac):
+                toScan.append(endpoint)
+            else:
+                self.submit(endpoint)
+
+        if toScan and self.active < self.maxConnections:
+            devices = self.scanner.scan(self.scanTime)
+            found   = {dev.addr.lower() for dev in devices}
+            for endpoint in toScan:
+                if endpoint.mac in found:
+                    self.connections.seen(endpoint.mac)
+                    self.submit(endpoint)
+                else:
+                    self.connections.failure(endpoint.mac)
+
+
+    def run(self):
+        while True:
+            self.runOnce()
+
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+        self.worker.shutdown(wait=True)
@@ -0,0 +1,212 @@
+from bluepy.btle import BTLEDisconnectError
+import numpy as np
+import random
+import threading
+import time
+from gateway.DataHandler import NUM_SAMPLES, SAMPLE_RATE, PACKET_END
+from gateway.BLE import UART_HANDLE, UART_UUID
+
+
+#####################################################################
+# NOTIFICATION STREAMS
+#####################################################################
+def makeAcquisition(numSamples=NUM_SAMPLES, sampleRate=SAMPLE_RATE, freqs=(60, 120, 250),
+                    amplitude=0.5, noise=0.05, sFactor=16384, seed=None):
+    '''
+    Synthetic acquisition: one sine per axis plus gaussian noise.
+    Returns an (N,3) int16 array of raw accelerometer counts
+    '''
+    rng     = np.random.default_rng(seed)
+    t       = np.arange(numSamples)[:, None] / sampleRate
+    accel   = amplitude * np.sin(2 * np.pi * np.asarray(freqs) * t)
+    accel  += rng.normal(0, noise, accel.shape)
+    return np.clip(np.round(accel * sFactor), -32768, 32767).astype(np.int16)
+
+
+def loadCSV(filename, sFactor=16384):
+    '''
+    Acquisition recorded by DataHandler.saveCSV (G values) -> raw counts
+    '''
+    accel = np.loadtxt(filename, delimiter=',')
+    return np.round(accel * sFactor).astype(np.int16)
+
+
+def makePackets(counts):
+    '''
+    Split raw counts as ble_send_data (endpoint/main.c) does: 3 samples per
+    packet (18 bytes) + '\\r\\n', the last packet with the remaining sample
+    '''
+    payload = np.asarray(counts, dtype='>i2').tobytes()
+    return [payload[i:i + 18] + PACKET_END for i in range(0, len(payload), 18)]
+
+
+
+#####################################################################
+# SIMULATED ENDPOINT
+#####################################################################
+class SimEndpoint():
+    '''
+    Behaviour of one simulated endpoint: the acquisitions it replays and
+    the faults it injects
+    '''
+    def __init__(self, mac, acquisitions=None, packetInterval=0.005, dropRate=0.0,
+                 disconnectRate=0.0, connectTime=0.0, seed=None):
+        '''
+        @mac: endpoint BLE MAC address
+        @acquisitions: list of (N,3) raw counts replayed in turn
+        (default: one synthetic acquisition)
+        @packetInterval: seconds between notifications (200 Hz on the HC09)
+        @dropRate: probability of losing each packet
+        @disconnectRate: probability of a disconnection during an acquisition
+        @connectTime: seconds taken by each connection
+        '''
+        self.mac            = mac.lower()
+        self.acquisitions   = acquisitions or [makeAcquisition(seed=seed)]
+        self.packetInterval = packetInterval
+        self.dropRate       = dropRate
+        self.disconnectRate = disconnectRate
+        self.connectTime    = connectTime
+        self.random         = random.Random(seed)
+        self.sent           = 0
+        self.lock           = threading.Lock()
+
+
+    def nextStream(self):
+        '''
+        Packets of the next acquisition, with the injected faults applied.
+        Returns (packets, index of the disconnection or None)
+        '''
+        with self.lock:
+            counts = self.acquisitions[self.sent % len(self.acquisitions)]
+            self.sent += 1
+            packets = [p for p in makePackets(counts) if self.random.random() >= self.dropRate]
+            disconnectAt = None
+            if self.random.random() < self.disconnectRate:
+                disconnectAt = self.random.randrange(len(packets))
+        return (packets, disconnectAt)
+
+
+
+#####################################################################
+# SIMULATED BLUEPY API
+#####################################################################
+class SimScanEntry():
+    def __init__(self, addr):
+        self.addr       = addr
+        self.addrType   = 'public'
+
+
+class SimCharacteristic():
+    def __init__(self, uuid, handle):
+        self.uuid       = uuid
+        self.handle     = handle
+
+    def getHandle(self):
+        return self.handle
+
+
+class SimPeripheral():
+    '''
+    Replaces bluepy Peripheral: replays a SimEndpoint through the delegate
+    '''
+    def __init__(self, endpoint):
+        if endpoint.connectTime:
+            time.sleep(endpoint.connectTime)
+        self.endpoint       = endpoint
+        self.delegate       = None
+        self.packets        = []
+        self.disconnectAt   = None
+        self.connected      = True
+
+
+    def setDelegate(self, delegate):
+        self.delegate = delegate
+        return self
+
+
+    def withDelegate(self, delegate):
+        return self.setDelegate(delegate)
+
+
+    def getCharacteristics(self, startHnd=1, endHnd=0xFFFF, uuid=None):
+        self.checkConnected()
+        return [SimCharacteristic(UART_UUID, UART_HANDLE)]
+
+
+    def writeCharacteristic(self, handle, val, withResponse=False):
+        self.checkConnected()
+        if handle == UART_HANDLE and val == b"\x31":
+            (self.packets, self.disconnectAt) = self.endpoint.nextStream()
+            self.packets.reverse()
+
+
+    def waitForNotifications(self, timeout):
+        self.checkConnected()
+        if not self.packets:
+            if self.endpoint.packetInterval:
+                time.sleep(timeout)
+            return False
+
+        if self.disconnectAt is not None and len(self.packets) == self.disconnectAt:
+            self.connected = False
+            raise BTLEDisconnectError("Simulated disconnection")
+
+        if self.endpoint.packetInterval:
+            time.sleep(self.endpoint.packetInterval)
+        self.delegate.handleNotification(UART_HANDLE, self.packets.pop())
+        return True
+
+
+    def checkConnected(self):
+        if not self.connected:
+            raise BTLEDisconnectError("Device disconnected")
+
+
+    def disconnect(self):
+        self.connected = False
+
+
+
+class SimScanner():
+    '''
+    Replaces bluepy Scanner: every registered endpoint is advertising
+    '''
+    def __init__(self, endpoints, scanTime=None):
+        '''
+        @endpoints: dict MAC -> SimEndpoint
+        @scanTime: seconds of each scan (default: the requested timeout)
+        '''
+        self.endpoints  = endpoints
+        self.scanTime   = scanTime
+
+
+    def withDelegate(self, delegate):
+        return self
+
+
+    def scan(self, timeout=10):
+        time.sleep(timeout if self.scanTime is None else self.scanTime)
+        return [SimScanEntry(mac) for mac in self.endpoints]
+
+
+
+class SimBLE():
+    '''
+    Simulated BLE environment: gives a scanner instance and a peripheral
+    factory to use in place of bluepy's (see Scheduler)
+    '''
+    def __init__(self, scanTime=None):
+        self.endpoints  = dict()
+        self.scanner    = SimScanner(self.endpoints, scanTime)
+
+
+    def addEndpoint(self, endpoint):
+        self.endpoints[endpoint.mac] = endpoint
+        return endpoint
+
+
+    def peripheral(self, deviceAddr, *args, **kwargs):
+        endpoint = self.endpoints.get(deviceAddr.lower())
+        if endpoint is None:
+            raise BTLEDisconnectError(f"Failed to connect to peripheral {deviceAddr}")
+        return SimPeripheral(endpoint)
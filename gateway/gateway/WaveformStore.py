@@ -0,0 +1,120 @@
+import numpy as np
+import os
+import threading
+
+
+# index record: where each acquisition lives inside the segment files
+INDEX_DTYPE = np.dtype([('endpoint',  'S12'),   # simplified MAC (C8DF8434ADC0)
+                        ('timestamp', '<f8'),   # unix time of the acquisition
+                        ('segment',   '<u4'),   # segment file number
+                        ('offset',    '<u8'),   # byte offset inside the segment
+                        ('samples',   '<u4'),   # number of (x, y, z) samples
+                        ('scale',     '<f4')])  # counts per G (scale factor)
+SAMPLE_DTYPE = np.dtype('<i2')                  # raw accelerometer counts
+
+
+#####################################################################
+# WAVEFORM_STORE
+#####################################################################
+class WaveformStore():
+    '''
+    This class appends raw acquisitions (int16 counts, x y z per sample) to
+    binary segment files and keeps a fixed-layout index of them.
+    Reads are memory-mapped: scanning the history never loads it whole.
+    One instance should be shared by every DataHandler writing to a path.
+    '''
+    def __init__(self, path, segmentSize=64 * 1024 * 1024):
+        '''
+        @path: directory of the segment and index files
+        @segmentSize: a new segment file is started after this many bytes
+        '''
+        self.path           = path
+        self.segmentSize    = segmentSize
+        self.indexFile      = os.path.join(path, 'index.bin')
+        self.lock           = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+        # continue the last segment after a restart
+        index = self.index()
+        self.segment = int(index['segment'][-1]) if index.size else 0
+
+
+    def segmentFile(self, segment):
+        return os.path.join(self.path, f'segment{segment:06d}.bin')
+
+
+    def append(self, endpoint, timestamp, counts, scale):
+        '''
+        Append an (N,3) array of raw counts, returns its index record
+        '''
+        data = np.ascontiguousarray(counts, dtype=SAMPLE_DTYPE)
+        with self.lock:
+            filename = self.segmentFile(self.segment)
+            offset   = os.path.getsize(filename) if os.path.exists(filename) else 0
+            while offset and offset + data.nbytes > self.segmentSize:
+                # the next segment may exist already (written before a crash,
+                # never indexed): appended after its bytes
+                self.segment += 1
+                filename = self.segmentFile(self.segment)
+                offset   = os.path.getsize(filename) if os.path.exists(filename) else 0
+
+            # data first: a crash never leaves an index record without samples
+            with open(filename, 'ab') as f:
+                f.write(data.tobytes())
+
+            record = np.array([(endpoint, timestamp, self.segment, offset,
+                                data.shape[0], scale)], dtype=INDEX_DTYPE)
+            with open(self.indexFile, 'ab') as f:
+                f.write(record.tobytes())
+        return record[0]
+
+
+    def index(self):
+        '''
+        Memory-mapped index of every stored acquisition
+        '''
+        if not os.path.exists(self.indexFile):
+            return np.empty(0, dtype=INDEX_DTYPE)
+        size = os.path.getsize(self.indexFile) // INDEX_DTYPE.itemsize
+        if size == 0:
+            return np.empty(0, dtype=INDEX_DTYPE)
+        return np.memmap(self.indexFile, dtype=INDEX_DTYPE, mode='r', shape=(size,))
+
+
+    def find(self, endpoint=None, start=None, end=None):
+        '''
+        Index records of an endpoint between start and end (unix time)
+        '''
+        index = self.index()
+        mask  = np.ones(index.size, dtype=bool)
+        if endpoint is not None:
+            mask &= index['endpoint'] == endpoint.encode()
+        if start is not None:
+            mask &= index['timestamp'] >= start
+        if end is not None:
+            mask &= index['timestamp'] < end
+        return index[mask]
+
+
+    def read(self, record):
+        '''
+        Memory-mapped (N,3) raw counts of an index record
+        '''
+        return np.memmap(self.segmentFile(int(record['segment'])), dtype=SAMPLE_DTYPE,
+                         mode='r', offset=int(record['offset']),
+                         shape=(int(record['samples']), 3))
+
+
+    def readAccel(self, record):
+        '''
+        (N,3) acceleration in G of an index record
+        '''
+        return self.read(record) / record['scale']
+
+
+    def scan(self, endpoint=None, start=None, end=None):
+        '''
+        Iterate over (record, accel) of the matching acquisitions
+        '''
+        for record in self.find(endpoint, start, end):
+            yield (record, self.readAccel(record))
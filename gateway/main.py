@@ -10,84 +10,52 @@ tratamento eh enviado a nuvem, por meio de uma requisicao HTTP POST.
 - Handle - UART service: 0x0025
 '''
 
-from bluepy.btle import Scanner, Peripheral, UUID
-from gateway.BLE import ScanDelegate, PeriphDelegate
-from gateway.DataHandler import DataHandler
-from gateway.Cloud import Cloud
+from gateway.Scheduler import Scheduler, Endpoint
+from gateway.Cloud import Cloud, Uploader
+from gateway.EdgeModel import EdgeModel
+from gateway.WaveformStore import WaveformStore
 
 
 #####################################################################
 # SETUP GATEWAY
 #####################################################################
-endpointMac = "c8:df:84:34:ad:c0" 
 gatewayMac  = "24:f5:aa:66:10:6e"
-equipmentID = "MT01" 
-numPackets  = 342 # match with number of packets from acquisition device
-scanner     = Scanner().withDelegate(ScanDelegate())
-dataMan     = DataHandler(True, 'CSV', 'webService/data')
-cloud       = Cloud('ec2-URL.compute-1.amazonaws.com', 80)
-
+cloudHost   = 'ec2-URL.compute-1.amazonaws.com'
+cloud       = Cloud(cloudHost, 80)
+edgeModel   = EdgeModel(Cloud(cloudHost, 80), 'models') # per-equipment models cache
+uploader    = Uploader(cloud, 'outbox', batchURL='/v1/acquisitions') # unsent acquisitions are kept on disk
+store       = WaveformStore('webService/data') # raw waveforms of every endpoint
+
+# registered endpoints: one DataHandler/PeriphDelegate per endpoint
+# numSamples: match with NUM_SAMPLES of the acquisition device (default 1024)
+# interval: minimum seconds between acquisitions of the same endpoint
+ENDPOINTS = [
+    {'mac': "c8:df:84:34:ad:c0", 'equipID': "MT01", 'numSamples': 1024, 'sFactor': 0, 'interval': 0},
+]
+MAX_CONNECTIONS = 1 # simultaneous BLE connections supported by the adapter
+UPLOAD_MODE     = 'verdict' # 'full' | 'verdict' | 'anomalies' (full detail for anomalies only)
 
 
 #####################################################################
-# BLUETOOH LOW ENERGY SCANNER - LOOP
+# CLOUD CONNECTION
 #####################################################################
-while True:
-    devices = scanner.scan(2.0)
-    for dev in devices:
-        print(f"Dev: {dev.addr} ({dev.addrType})")
-
-        if (dev.addr == endpointMac):
-            try:
-                # setup current Device
-                cDev = Peripheral(dev.addr)
-                cDelegate = PeriphDelegate().setDataHandler(dataMan)
-                cDev.setDelegate(cDelegate)
-                uartCharHnd = int('0x0025', 0)
-
-                #cDev.writeCharacteristic(uartCharHnd, b"\x30") # ONLY FOR UNBLOCK SENSOR WHEN BLOCKED
-
-                # Turn notifications on
-                cDev.writeCharacteristic(uartCharHnd + 1, b"\x01\x00")
-                
-                # Tells the sensor to send accelerometer data
-                cDev.writeCharacteristic(uartCharHnd, b"\x31")
+def sendAcquisition(endpoint, response):
+    # edge scoring: the webservice stores the gateway verdict
+    response = edgeModel.apply(endpoint.equipID, response, UPLOAD_MODE, endpoint.dataHandler.psd)
 
-                notificationsCounter = 0
-                while True:
-                    try:
-                        if cDev.waitForNotifications(2.0):
-                            notificationsCounter += 1
+    # queued: uploads never block the BLE loop
+    print(response)
+    endID = response['endpointID']
+    uploader.send(f'/v1/endpoints/{endID}/acquisition', response)
 
-                            if (notificationsCounter == numPackets):
-                                # After send all data, the sensor needs to receive x30 to go to standby
-                                cDev.writeCharacteristic(uartCharHnd, b"\x30")
-                                cDev.disconnect()
-                                dataMan.processRawData()
-                                dataMan.setInfo(endpointMac, equipmentID, gatewayMac)
-                                break
 
-                    # handles a unexpected disconnection from Peripheral   
-                    except Exception as ex:
-                        print(str(ex))
-                        break
-            
-            except Exception as ex:
-                        print(str(ex))
-
-    ###################################################################
-    # CLOUD CONNECTION
-    ###################################################################
+#####################################################################
+# BLUETOOH LOW ENERGY SCHEDULER - LOOP
+#####################################################################
+uploader.start()
+scheduler = Scheduler(gatewayMac, sendAcquisition, maxConnections=MAX_CONNECTIONS)
+for config in ENDPOINTS:
+    scheduler.register(Endpoint(**config, saveFile=True, dFormat='BIN', store=store))
 
-    response = dataMan.checkNewAcquisition()
-    if response is False:
-        print("Nothing to send! [Scanning again...]")
-    else:
-        try:
-            print(response)
-            endID = dataMan.info['endpointID'] #improve
-            cloud.sendToCLoud(f'/v1/endpoints/{endID}/acquisition', response)
-        
-        except Exception as ex:
-            print(str(ex))
+scheduler.run()
 #####################################################################
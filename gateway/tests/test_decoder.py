@@ -0,0 +1,84 @@
+import queue
+import numpy as np
+import pytest
+from binascii import hexlify
+from bench_decode import legacyExtractData
+from gateway.BLE import FrameRing, PeriphDelegate
+from gateway.DataHandler import DataHandler, DataMath, NUM_PACKETS, PAYLOAD_SIZE
+from gateway.Simulator import makeAcquisition, makePackets
+
+
+@pytest.fixture
+def counts():
+    # synthetic sines plus the int16 limits and -1 (sign handling)
+    counts = makeAcquisition(seed=0)
+    counts[:3] = [[-32768, 32767, -1], [32767, -32768, 0], [-1, 1, -2]]
+    return counts
+
+
+def legacy(packets, scaleFactor=16384):
+    accels = legacyExtractData([hexlify(p).decode('utf-8') for p in packets], scaleFactor)
+    return np.array([accels['x'], accels['y'], accels['z']]).T
+
+
+def ingest(handler, packets):
+    delegate = PeriphDelegate().setDataHandler(handler)
+    for packet in packets:
+        delegate.handleNotification(0x25, packet)
+    return handler
+
+
+def test_decode_samples(counts):
+    math    = DataMath()
+    payload = counts.astype('>i2').tobytes()
+    assert np.array_equal(math.decodeSamples(payload), counts)
+    # an incomplete trailing sample is dropped
+    assert np.array_equal(math.decodeSamples(payload[:-2]), counts[:-1])
+
+    hexPackets = [hexlify(p).decode('utf-8') for p in makePackets(counts)]
+    assert math.hexToPayload(hexPackets) == payload
+
+
+def test_twos_complement():
+    math = DataMath()
+    assert [math.twos_complement(h, 16) for h in ('0000', '7fff', '8000', 'ffff')] == [0, 32767, -32768, -1]
+
+
+@pytest.mark.parametrize('rawMode', ['BIN', 'HEX'])
+def test_formats_match_legacy_decoder(counts, rawMode):
+    packets = makePackets(counts)
+    assert len(packets) == NUM_PACKETS
+
+    handler = ingest(DataHandler(rawMode=rawMode), packets)
+    assert np.array_equal(handler.extractCounts(), counts)
+    assert np.array_equal(handler.extractSamples(), legacy(packets))
+
+    # the next acquisition starts from an empty buffer
+    handler.clearPackets()
+    ingest(handler, packets[:10])
+    assert np.array_equal(handler.extractCounts(), counts[:30])
+
+
+def test_more_packets_than_expected(counts):
+    packets = makePackets(counts)
+    handler = ingest(DataHandler(numPackets=10), packets)
+    assert np.array_equal(handler.extractSamples(), legacy(packets))
+
+
+def test_frame_ring(counts):
+    ring = FrameRing(2, NUM_PACKETS * PAYLOAD_SIZE + 2)
+    (first, second) = (ring.acquire(), ring.acquire())
+    assert first != second
+    with pytest.raises(queue.Empty):
+        ring.acquire(timeout=0.01)
+
+    # two acquisitions in flight, each decoded from its own frame
+    handlers = [DataHandler(), DataHandler()]
+    for (handler, frame, values) in zip(handlers, (first, second), (counts, -counts)):
+        handler.attachBuffer(ring.frameView(frame))
+        ingest(handler, makePackets(values))
+    assert np.array_equal(handlers[0].extractCounts(), counts)
+    assert np.array_equal(handlers[1].extractCounts(), -counts)
+
+    ring.release(first)
+    assert ring.acquire(timeout=0.01) == first
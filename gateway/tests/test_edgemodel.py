@@ -0,0 +1,72 @@
+import json
+import numpy as np
+import pytest
+from gateway.EdgeModel import EdgeModel, SVMModel
+
+svm = pytest.importorskip('sklearn.svm')
+
+
+def exported(model):
+    # as ML.ModelHandler.exportModel
+    return {'kernel': 'rbf', 'gamma': float(model._gamma),
+            'supportVectors': model.support_vectors_.tolist(),
+            'dualCoef': model.dual_coef_[0].tolist(),
+            'intercept': float(model.intercept_[0])}
+
+
+@pytest.fixture
+def params():
+    rng   = np.random.default_rng(0)
+    model = svm.OneClassSVM(nu=0.1, gamma=5.0).fit(rng.normal([0.35, 1.41], 0.05, (200, 2)))
+    return (model, exported(model))
+
+
+class FakeResponse():
+    def __init__(self, status):
+        self.status = status
+        self.reason = 'fake'
+
+
+class FakeCloud():
+    def __init__(self, models, version='1'):
+        self.models     = models
+        self.version    = version
+        self.requests   = 0
+
+    def get(self, cURL, headers=None):
+        self.requests += 1
+        if self.models is None:
+            raise ConnectionError("offline")
+        if headers and headers.get('If-None-Match') == f'"{self.version}"':
+            return (FakeResponse(304), b'')
+        body = {'version': self.version, 'models': {axis: self.models for axis in 'xyz'}}
+        return (FakeResponse(200), json.dumps(body).encode())
+
+
+def features(rms, cf):
+    return {axis: {'rms': rms, 'cf': cf} for axis in 'xyz'}
+
+
+def test_decision_matches_the_trained_model(params):
+    (model, exportedParams) = params
+    values = np.random.default_rng(1).normal([0.35, 1.41], 0.2, (50, 2))
+    assert np.allclose(SVMModel(exportedParams).decision(values), model.decision_function(values))
+
+
+def test_models_are_json_not_code(tmp_path, params):
+    edge = EdgeModel(FakeCloud(params[1]), str(tmp_path))
+    assert edge.score('MT01', features(0.35, 1.41)) is False
+    assert edge.score('MT01', features(0.9, 3.0)) is True
+    with open(tmp_path / 'MT01.json') as f:
+        assert json.load(f)['version'] == '1'
+
+
+def test_cached_models_used_offline(tmp_path, params):
+    EdgeModel(FakeCloud(params[1]), str(tmp_path)).getModels('MT01')
+    edge = EdgeModel(FakeCloud(None), str(tmp_path))
+    assert edge.score('MT01', features(0.9, 3.0)) is True
+
+
+def test_unsupported_model_rejected(tmp_path, params):
+    edge = EdgeModel(FakeCloud(dict(params[1], kernel='poly')), str(tmp_path))
+    assert edge.score('MT01', features(0.35, 1.41)) is None
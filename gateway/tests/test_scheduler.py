@@ -0,0 +1,95 @@
+import time
+import pytest
+from gateway.BLE import ConnectionManager
+from gateway.Scheduler import Endpoint, Scheduler
+from gateway.Simulator import SimBLE, SimEndpoint
+
+GATEWAY = 'b8:27:eb:00:00:01'
+MACS    = ['aa:00:00:00:00:01', 'aa:00:00:00:00:02']
+MISSING = 'aa:00:00:00:00:99'
+
+
+@pytest.fixture
+def ble():
+    ble = SimBLE(scanTime=0)
+    for (i, mac) in enumerate(MACS):
+        ble.addEndpoint(SimEndpoint(mac, packetInterval=0, seed=i))
+    return ble
+
+
+@pytest.fixture
+def scheduler(ble):
+    acquisitions = []
+    connections  = ConnectionManager(ble.peripheral, backoff=60, scanAfter=2)
+    scheduler = Scheduler(GATEWAY, lambda ep, data: acquisitions.append(data), maxConnections=2,
+                          scanner=ble.scanner, connections=connections)
+    scheduler.acquisitions = acquisitions
+    yield scheduler
+    scheduler.shutdown()
+
+
+def waitIdle(scheduler, timeout=5):
+    deadline = time.monotonic() + timeout
+    while scheduler.active or any(ep.busy for ep in scheduler.endpoints.values()):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_due_endpoints_are_acquired(scheduler):
+    endpoints = [scheduler.register(Endpoint(mac, 'EQ01', interval=60)) for mac in MACS]
+    assert scheduler.dueEndpoints() == endpoints
+
+    scheduler.runOnce()
+    waitIdle(scheduler)
+    assert sorted(data['endpointID'] for data in scheduler.acquisitions) == ['AA0000000001', 'AA0000000002']
+    assert all(data['x']['rms'] > 0 for data in scheduler.acquisitions)
+
+    # not due again before their interval
+    assert scheduler.dueEndpoints() == []
+    endpoints[0].nextRun = 0
+    assert scheduler.dueEndpoints() == [endpoints[0]]
+    endpoints[0].busy = True
+    assert scheduler.dueEndpoints() == []
+
+
+def test_failed_endpoint_backs_off(scheduler):
+    endpoint    = scheduler.register(Endpoint(MISSING, 'EQ01'))
+    connections = scheduler.connections
+
+    scheduler.runOnce()
+    waitIdle(scheduler)
+    assert connections.failures[MISSING] == 1
+    assert not connections.canConnect(MISSING)
+    assert connections.retryAt[MISSING] - time.monotonic() > 50
+
+    # still due, but backed off: not submitted
+    assert scheduler.dueEndpoints() == [endpoint]
+    scheduler.runOnce()
+    assert not endpoint.busy and connections.failures[MISSING] == 1
+
+    # backoff over: one more direct attempt, then the backoff doubles
+    connections.retryAt[MISSING] = 0
+    scheduler.runOnce()
+    waitIdle(scheduler)
+    assert connections.failures[MISSING] == 2
+    assert connections.retryAt[MISSING] - time.monotonic() > 110
+    assert scheduler.acquisitions == []
+
+
+def test_endpoint_needing_a_scan(scheduler):
+    (found, missing) = (scheduler.register(Endpoint(MACS[0], 'EQ01')), scheduler.register(Endpoint(MISSING, 'EQ01')))
+    connections = scheduler.connections
+    for mac in (found.mac, missing.mac):
+        for _ in range(connections.scanAfter):
+            connections.failure(mac)
+        connections.retryAt[mac] = 0
+        assert connections.needsScan(mac)
+
+    scheduler.runOnce()
+    waitIdle(scheduler)
+    # advertising: connected and reset
+    assert [data['endpointID'] for data in scheduler.acquisitions] == ['AA0000000001']
+    assert connections.failures[found.mac] == 0
+    # not seen: backed off again without a connection attempt
+    assert connections.failures[missing.mac] == connections.scanAfter + 1
+    assert not connections.canConnect(missing.mac)
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from gateway.DataHandler import DataHandler, DataMath, NUM_SAMPLES, SAMPLE_RATE
+from gateway.Simulator import makeAcquisition, makePackets
+
+BANDS = [(0, 50), (50, 100), (100, 500)]
+
+
+def tones(freqs, amps, offset=0.0):
+    t = np.arange(NUM_SAMPLES)[:, None] / SAMPLE_RATE
+    return offset + np.asarray(amps) * np.sin(2 * np.pi * np.asarray(freqs) * t)
+
+
+def test_pure_tone_features():
+    # bin-centred tones (k * 1000/1024 Hz), one per axis, with a DC offset
+    freqs   = np.array([32, 64, 256]) * SAMPLE_RATE / NUM_SAMPLES
+    amps    = [0.5, 0.25, 1.0]
+    math    = DataMath()
+    features = math.spectralFeatures(tones(freqs, amps, offset=1.0), SAMPLE_RATE, BANDS)
+
+    assert np.allclose(features['freq'], freqs)
+    assert np.allclose(features['amp'], amps)
+    # the whole energy of each tone (A^2/2) lands in its band, none from DC
+    expected = np.zeros((len(BANDS), 3))
+    expected[[0, 1, 2], [0, 1, 2]] = np.square(amps) / 2
+    assert np.allclose(features['bands'], expected, atol=1e-9)
+
+
+def test_band_energies_sum_to_variance():
+    samples = makeAcquisition(seed=1) / 16384
+    math    = DataMath()
+    (freqs, amps) = math.spectrum(samples, SAMPLE_RATE)
+    energies = math.bandEnergies(freqs, amps, [(0, SAMPLE_RATE / 2)], NUM_SAMPLES)
+    assert np.allclose(energies[0], np.var(samples, axis=0), rtol=1e-12)
+
+    # a Nyquist tone (+A, -A, ...) has mean square A^2
+    nyquist = np.tile([[0.5], [-0.5]], (NUM_SAMPLES // 2, 3))
+    (freqs, amps) = math.spectrum(nyquist, SAMPLE_RATE)
+    assert np.allclose(math.bandEnergies(freqs, amps, BANDS, NUM_SAMPLES)[2], 0.25)
+
+
+@pytest.mark.parametrize('numSamples', [NUM_SAMPLES, 1000])
+def test_welch_matches_scipy(numSamples):
+    signal  = pytest.importorskip('scipy.signal')
+    samples = np.random.default_rng(0).normal(0.1, 0.5, (numSamples, 3))
+
+    (freqs, psd) = DataMath().welchPSD(samples, SAMPLE_RATE)
+    (expFreqs, expPsd) = signal.welch(samples, SAMPLE_RATE, window='hann', nperseg=256,
+                                      noverlap=128, axis=0)
+    assert np.allclose(freqs, expFreqs)
+    assert np.allclose(psd, expPsd, rtol=1e-9, atol=0)
+
+
+def test_processed_acquisition():
+    counts  = makeAcquisition(freqs=(60, 120, 250), noise=0.0, seed=0)
+    handler = DataHandler(bands=BANDS, welch=True)
+    for packet in makePackets(counts):
+        handler.savePacket(packet)
+    handler.processRawData()
+
+    # tones between bins: the peaks are within one bin of them
+    tones = np.array([60, 120, 250])
+    peaks = np.array([handler.features[axis]['freq'] for axis in 'xyz'])
+    assert (np.abs(peaks - tones) <= SAMPLE_RATE / NUM_SAMPLES).all()
+    bands = np.array([handler.features[axis]['bands'] for axis in 'xyz']).T
+    assert np.argmax(bands, axis=0).tolist() == [1, 2, 2]
+    (freqs, psd) = handler.psd
+    assert (np.abs(freqs[np.argmax(psd, axis=0)] - tones) <= SAMPLE_RATE / 256).all()
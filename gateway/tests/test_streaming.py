@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from binascii import hexlify
+from gateway.DataHandler import DataHandler, RunningStats
+from gateway.Simulator import makeAcquisition, makePackets
+
+
+@pytest.mark.parametrize('rawMode', ['BIN', 'HEX'])
+@pytest.mark.parametrize('spectral', [True, False])
+def test_streaming_features_match_batch(rawMode, spectral):
+    packets = makePackets(makeAcquisition(seed=3))
+    if rawMode == 'HEX':
+        packets = [hexlify(p).decode('utf-8') for p in packets]
+
+    results = []
+    for streaming in (False, True):
+        handler = DataHandler(rawMode=rawMode, spectral=spectral, streaming=streaming)
+        for packet in packets:
+            handler.savePacket(packet)
+        handler.processRawData()
+        results.append(handler.features)
+
+    (batch, stream) = results
+    for axis in 'xyz':
+        assert stream[axis]['rms'] == pytest.approx(batch[axis]['rms'], abs=1e-6)
+        # batch divides by the rounded rms: last digit may differ
+        assert stream[axis]['cf'] == pytest.approx(batch[axis]['cf'], rel=1e-6)
+        assert stream[axis]['freq'] == batch[axis]['freq']
+
+
+def test_streaming_keeps_no_packets():
+    handler = DataHandler(spectral=False, streaming=True)
+    for packet in makePackets(makeAcquisition(seed=3)):
+        handler.savePacket(packet)
+    assert handler.bufferLen == 0 and handler.stats.n == 1024
+
+
+def test_chan_merge_matches_numpy():
+    rng     = np.random.default_rng(0)
+    values  = rng.normal(3.0, 2.0, (1000, 3))
+    stats   = RunningStats()
+    # uneven blocks, including empty ones and single samples
+    for block in np.split(values, [0, 1, 1, 7, 300, 301, 640]):
+        stats.update(block)
+
+    assert stats.n == len(values)
+    assert np.allclose(stats.mean, values.mean(axis=0))
+    assert np.allclose(stats.m2 / stats.n, values.var(axis=0))
+    assert np.allclose(stats.sumSq, (values**2).sum(axis=0))
+    assert (stats.min == values.min(axis=0)).all()
+    assert (stats.max == values.max(axis=0)).all()
+
+    stats.clear()
+    stats.update(values[:10])
+    assert np.allclose(stats.mean, values[:10].mean(axis=0))
@@ -0,0 +1,137 @@
+import json
+import pytest
+from gateway.Cloud import Uploader
+
+
+class FakeResponse():
+    def __init__(self, status, headers=None):
+        self.status     = status
+        self.reason     = 'fake'
+        self.headers    = headers or {}
+
+    def getheader(self, name):
+        return self.headers.get(name)
+
+
+class FakeCloud():
+    '''
+    Cloud replaying scripted responses: (status, body) per request
+    '''
+    def __init__(self, responses):
+        self.responses  = list(responses)
+        self.requests   = []
+
+    def postJSON(self, cURL, data):
+        self.requests.append((cURL, data))
+        (status, body) = self.responses.pop(0)
+        return (FakeResponse(status), json.dumps(body).encode())
+
+    def post(self, cURL, data):
+        return self.postJSON(cURL, data)[0]
+
+
+def outbox(uploader):
+    return [data['n'] for (end, url, data) in uploader.pending()]
+
+
+def uploaderWith(tmp_path, responses, records=3):
+    uploader = Uploader(FakeCloud(responses), str(tmp_path), batchURL='/v1/acquisitions')
+    uploader.append([(f'/v1/endpoints/EP{n}/acquisition', {'n': n}) for n in range(records)])
+    return uploader
+
+
+def test_batch_accepted(tmp_path):
+    uploader = uploaderWith(tmp_path, [(200, {'status': [200, 200, 200]})])
+    assert uploader.drain()
+    assert outbox(uploader) == []
+
+
+def test_failed_items_are_queued_again(tmp_path):
+    uploader = uploaderWith(tmp_path, [(200, {'status': [200, 500, 400]}),
+                                       (200, {'status': [200]})])
+    # the 500 comes back at the end of the outbox, the 400 is dropped
+    assert not uploader.drain()
+    assert outbox(uploader) == [1]
+
+    assert uploader.drain()
+    assert uploader.cloud.requests[1][1] == [{'n': 1}]
+    assert outbox(uploader) == []
+
+
+def test_batch_kept_while_the_webservice_fails(tmp_path):
+    uploader = uploaderWith(tmp_path, [(503, {}), (500, {})])
+    assert not uploader.drain()
+    assert not uploader.drain()
+    assert outbox(uploader) == [0, 1, 2]
+
+
+def test_refused_batch_sent_one_by_one(tmp_path):
+    uploader = uploaderWith(tmp_path, [(404, {}), (200, {}), (400, {}), (503, {})])
+    assert not uploader.drain()
+    # first accepted, second rejected for good, third kept
+    assert [url for (url, data) in uploader.cloud.requests[1:4]] == \
+           ['/v1/endpoints/EP0/acquisition', '/v1/endpoints/EP1/acquisition', '/v1/endpoints/EP2/acquisition']
+    assert outbox(uploader) == [2]
+
+
+def test_restart_resumes_at_the_offset(tmp_path):
+    uploader = uploaderWith(tmp_path, [(200, {'status': [200, 200]}), (503, {})], records=5)
+    uploader.batchSize = 2
+    assert not uploader.drain()
+    assert outbox(uploader) == [2, 3]
+
+    # gateway restarted: the accepted records are not sent again
+    restarted = Uploader(FakeCloud([(200, {'status': [200, 200]}), (200, {'status': [200]})]),
+                         str(tmp_path), batchSize=2, batchURL='/v1/acquisitions')
+    assert outbox(restarted) == [2, 3]
+    assert restarted.drain()
+    assert [[d['n'] for d in data] for (url, data) in restarted.cloud.requests] == [[2, 3], [4]]
+
+    # everything sent: fresh outbox
+    assert (tmp_path / 'outbox.jsonl').read_text() == ''
+    assert Uploader(FakeCloud([]), str(tmp_path)).offset == 0
+
+
+def test_partially_written_record_ignored(tmp_path):
+    uploader = uploaderWith(tmp_path, [], records=2)
+    with open(tmp_path / 'outbox.jsonl', 'a') as f:
+        f.write('{"url":"/v1/endpoints/EP2/acq')     # crash while appending
+    assert outbox(uploader) == [0, 1]
+
+
+def test_unreadable_offset_sends_everything_again(tmp_path):
+    uploaderWith(tmp_path, [], records=2)
+    (tmp_path / 'outbox.offset').write_text('garbage')
+    assert outbox(Uploader(FakeCloud([]), str(tmp_path))) == [0, 1]
+
+
+def test_records_appended_after_a_crash(tmp_path):
+    uploader = uploaderWith(tmp_path, [(200, {'status': [200, 200]})], records=1)
+    with open(tmp_path / 'outbox.jsonl', 'a') as f:
+        f.write('{"url":"/v1/endpoints/EP1/acq')     # crash while appending
+    uploader.append([('/v1/endpoints/EP2/acquisition', {'n': 2})])
+
+    assert outbox(uploader) == [0, 2]
+    assert uploader.drain()
+    assert outbox(uploader) == []
+
+
+def test_crash_while_compacting(tmp_path, monkeypatch):
+    uploader = uploaderWith(tmp_path, [(200, {'status': [200, 200, 200]})])
+
+    def crash(*args):
+        raise OSError("crash")
+    # dies after the offset is reset, before the outbox is truncated
+    import builtins
+    realOpen = builtins.open
+    monkeypatch.setattr(builtins, 'open', lambda path, mode='r', *args, **kwargs:
+                        crash() if str(path).endswith('outbox.jsonl') and mode == 'w'
+                        else realOpen(path, mode, *args, **kwargs))
+    with pytest.raises(OSError):
+        uploader.drain()
+    monkeypatch.undo()
+
+    # restarted: new records are read, the sent ones are sent again
+    restarted = Uploader(FakeCloud([]), str(tmp_path), batchURL='/v1/acquisitions')
+    restarted.append([('/v1/endpoints/EP3/acquisition', {'n': 3})])
+    assert outbox(restarted) == [0, 1, 2, 3]
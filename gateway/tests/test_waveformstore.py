@@ -0,0 +1,46 @@
+import numpy as np
+from datetime import datetime
+from gateway.DataHandler import DataHandler
+from gateway.WaveformStore import WaveformStore
+
+
+def counts(n, value):
+    return np.full((n, 3), value, dtype=np.int16)
+
+
+def test_append_and_read(tmp_path):
+    store = WaveformStore(str(tmp_path))
+    store.append('EP01', 10.0, counts(4, 1), 16384)
+    store.append('EP02', 20.0, counts(2, 2), 8192)
+
+    assert [r['endpoint'] for r in store.find()] == [b'EP01', b'EP02']
+    (record, ) = store.find('EP02')
+    assert (store.read(record) == 2).all()
+    assert np.allclose(store.readAccel(record), 2 / 8192)
+    assert len(store.find(start=15.0)) == 1
+
+
+def test_rollover_onto_a_segment_written_before_a_crash(tmp_path):
+    store = WaveformStore(str(tmp_path), segmentSize=100)
+    store.append('EP01', 10.0, counts(10, 1), 16384)     # 60 bytes
+    # samples of an acquisition that never got its index record
+    with open(store.segmentFile(1), 'wb') as f:
+        f.write(b'\x07' * 20)
+
+    record = store.append('EP01', 20.0, counts(10, 2), 16384)
+    assert (record['segment'], record['offset']) == (1, 20)
+    assert (store.read(record) == 2).all()
+
+    # restarted: continues the last indexed segment
+    record = WaveformStore(str(tmp_path), segmentSize=100).append('EP01', 30.0, counts(1, 3), 16384)
+    assert (record['segment'], record['offset']) == (1, 80)
+
+
+def test_stored_at_the_acquisition_time(tmp_path):
+    handler = DataHandler(saveFile=True, dFormat='BIN', path=str(tmp_path))
+    handler.setInfo('c8:df:84:34:ad:c0', 'MT01', 'gw')
+    handler.info['timeStamp'] = '2021-08-10 12:00:00'
+    handler.saveBIN(counts(4, 1))
+
+    (record, ) = handler.store.find('C8DF8434ADC0')
+    assert record['timestamp'] == datetime(2021, 8, 10, 12).timestamp()
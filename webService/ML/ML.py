@@ -1,19 +1,53 @@
 import os
 import pickle
+import tempfile
+import threading
+import time
 import pandas as pd
 import numpy as np
-from random import randrange
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from statistics import mean
 from sklearn.svm import OneClassSVM
 
 
 DIR = 'ML/models/'
+MODEL_CACHE_SIZE    = 32    # equipments whose models are kept in memory
+MODEL_CHECK         = 5     # seconds between checks of the model files
+FEATURES            = ['xrms', 'xcf', 'yrms', 'ycf', 'zrms', 'zcf']
+FEATURE_INDEX       = [3, 4, 7, 8, 11, 12]  # FEATURES in the extractJsonAcq values
+TRAINING_WORKERS    = int(os.environ.get('VIBRANIUM_TRAINING_WORKERS', 2))  # concurrent training jobs
+# fit processes per training job: the jobs share the cores
+FIT_WORKERS         = int(os.environ.get('VIBRANIUM_FIT_WORKERS',
+                                         max(1, (os.cpu_count() or 1) // max(1, TRAINING_WORKERS))))
+FIT_REPEATS         = 5     # hyperparams searches averaged per axis
+FIT_SEED            = os.environ.get('VIBRANIUM_FIT_SEED')  # reproducible training when set
+FIT_SEED            = int(FIT_SEED) if FIT_SEED else None
 
 ####################################################################
 # GENERAL FUNCTIONS # improve
 ####################################################################
-def splitDataSet(rawData, features, frac):
-    trainX = rawData[features].sample(frac=frac)
+def featureMatrix(rows):
+    '''
+    (N,6) matrix of the modeled features (FEATURES) of acquisition
+    values lists (see db.extractJsonAcq)
+    '''
+    return np.array([[row[i] for i in FEATURE_INDEX] for row in rows], dtype=float).reshape(-1, len(FEATURES))
+
+
+######################################################################
+def scorable(features):
+    '''
+    Mask of the feature matrix rows that can be scored: no missing
+    feature (NULL values are NaN)
+    '''
+    return ~np.isnan(features).any(axis=1)
+
+
+######################################################################
+def splitDataSet(rawData, features, frac, seed=None):
+    trainX = rawData[features].sample(frac=frac, random_state=seed)
     crossX = rawData[features].drop(trainX.index)
     return (trainX, crossX)
 
@@ -35,17 +69,62 @@ def fit_predict(dTrain, dCV, nParams, gParams):
     Fit and predict OCSVM model
     Return training and CV errors for each pair of hyperparams
     '''
-    results = []
-    for nuP in nParams:
-        for gP in gParams:
-            model = OneClassSVM(kernel='rbf',nu=nuP,gamma=gP)
-            model.fit(dTrain)
-            errorT  = errorPerc(model, dTrain, -1)
-            errorCV = errorPerc(model, dCV, -1)  
-            results.append((nuP, gP, errorT, errorCV))
+    return fit_predict_many([(dTrain, dCV)], [(nParams, gParams)])[0]
+
+
+######################################################################
+def fitPair(dTrain, dCV, nuP, gP):
+    '''
+    Fit and predict OCSVM model for one pair of hyperparams
+    '''
+    model = OneClassSVM(kernel='rbf',nu=nuP,gamma=gP)
+    model.fit(dTrain)
+    errorT  = errorPerc(model, dTrain, -1)
+    errorCV = errorPerc(model, dCV, -1)  
+    return (nuP, gP, errorT, errorCV)
+
+
+######################################################################
+def fit_predict_many(splits, grids, mapper=map):
+    '''
+    fit_predict of each (dTrain, dCV) split with its (nParams, gParams)
+    grid: every pair of every split is mapped at once (see fitMapper)
+    '''
+    tasks = [(i, nuP, gP) for (i, (nParams, gParams)) in enumerate(grids)
+                          for nuP in nParams for gP in gParams]
+    data  = [(np.asarray(dTrain), np.asarray(dCV)) for (dTrain, dCV) in splits]
+
+    results = [[] for split in splits]
+    output  = mapper(fitPair, [data[i][0] for (i, nuP, gP) in tasks],
+                              [data[i][1] for (i, nuP, gP) in tasks],
+                              [nuP for (i, nuP, gP) in tasks],
+                              [gP for (i, nuP, gP) in tasks])
+    for ((i, nuP, gP), result) in zip(tasks, output):
+        results[i].append(result)
     return results
 
 
+######################################################################
+@contextmanager
+def fitMapper(workers=FIT_WORKERS):
+    '''
+    with fitMapper(workers) as mapper: map-like function running the fits
+    on a process pool (the builtin map when workers <= 1)
+    '''
+    if workers <= 1:
+        yield map
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield lambda fn, *iterables: executor.map(fn, *iterables, chunksize=4)
+
+
+######################################################################
+def fitModel(trainX, nu, gamma):
+    model = OneClassSVM(kernel='rbf',nu=nu,gamma=gamma)
+    model.fit(trainX)
+    return model
+
+
 ######################################################################
 def findMinimum(array):
     '''
@@ -89,99 +168,243 @@ def createNewParams(pairOfParams):
     return(nParams, gParams)
 
 ####################################################################
+# MODEL CACHE
 ####################################################################
+class ModelCache():
+    '''
+    Process-level LRU cache of the loaded models of each equipment (one
+    per axis). Model files are stat'ed at most every checkInterval seconds
+    and reloaded when their mtime changes (models written by another
+    process); models trained here are swapped in directly
+    '''
+    def __init__(self, maxSize=MODEL_CACHE_SIZE, checkInterval=MODEL_CHECK):
+        self.maxSize        = maxSize
+        self.checkInterval  = checkInterval
+        self.entries        = OrderedDict() # modelName -> (checked, version, {axis: model} or None)
+        self.lock           = threading.Lock()
 
 
-class ModelHandler():
+    def version(self, modelName):
+        '''
+        mtimes of the model files, None if a file is missing
+        '''
+        try:
+            return tuple(os.stat(DIR + modelName + axis).st_mtime_ns for axis in ('x','y','z'))
+        except OSError:
+            return None
+
+
+    def load(self, modelName):
+        models = dict()
+        for axis in ('x','y','z'):
+            with open(DIR + modelName + axis, 'rb') as f:
+                models[axis] = pickle.load(f)
+        return models
+
+
+    def get(self, modelName):
+        '''
+        {axis: model} of an equipment, None when it has no model
+        '''
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(modelName)
+            if entry is not None:
+                self.entries.move_to_end(modelName)
+                if now - entry[0] < self.checkInterval:
+                    return entry[2]
+
+        version = self.version(modelName)
+        if entry is not None and version == entry[1]:
+            models = entry[2]
+        elif version is None:
+            models = None
+        else:
+            try:
+                models = self.load(modelName)
+            except (OSError, pickle.UnpicklingError, EOFError) as e:
+                print(e)
+                (version, models) = (None, None)
 
-    def __init__(self):
-        self.model = None
-        self.dataSetSize = 0
+        self.set(modelName, version, models, now)
+        return models
+
+
+    def set(self, modelName, version, models, checked=None):
+        '''
+        Swap the models of an equipment (all axes at once)
+        '''
+        with self.lock:
+            self.entries[modelName] = (checked or time.monotonic(), version, models)
+            self.entries.move_to_end(modelName)
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
 
-    def incrementDataSetSize(self):
-        self.dataSetSize += 1
 
+    def invalidate(self, modelName=None):
+        with self.lock:
+            if modelName is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(modelName, None)
 
-    def clearDataSetSize(self):
-        self.dataSetSize = 0
+
+_modelCache = ModelCache()
+
+####################################################################
+####################################################################
+
+
+class ModelHandler():
+
+    def __init__(self):
+        self.model = None
 
 
     def lookFor(self, modelName):
-        if os.path.isfile(DIR + modelName + 'x'):
+        if _modelCache.get(modelName) is not None:
             self.model = modelName
             return True  
         else:
             return False
 
 
-    def getModel(self, axis):
-        # open binary model in specific axis
-        filename = DIR + self.model + axis
-        return pickle.load(open(filename, 'rb'))
+    def exportModel(self, modelName):
+        '''
+        Parameters of the models of each axis (plain numbers: support
+        vectors, dual coefficients, intercept and RBF gamma, see
+        OneClassSVM.decision_function) and their version (newest mtime);
+        None when the equipment has no model
+        '''
+        version = _modelCache.version(modelName)
+        loaded  = _modelCache.get(modelName)
+        if version is None or loaded is None:
+            return None
+        models  = dict()
+        for (axis, model) in loaded.items():
+            models[axis] = {'kernel':           'rbf',
+                            'gamma':            float(model._gamma),
+                            'supportVectors':   model.support_vectors_.tolist(),
+                            'dualCoef':         model.dual_coef_[0].tolist(),
+                            'intercept':        float(model.intercept_[0])}
+        return (str(max(version) // 1000000), models)
+
+
+    def getModel(self, axis, modelName=None):
+        # loaded model in specific axis (ModelCache)
+        return _modelCache.get(modelName or self.model)[axis]
         
 
-    def train(self, modelName):
+    def train(self, modelName, features):
         self.model = modelName
         try:
-            raw = pd.read_csv("query.csv")
-
-            # ONE MODEL FOR EACH AXIS eg. MT01x, MT01y, MT01z
-            for axis in ('x','y','z'):
-                features = [f'{axis}rms', f'{axis}cf']
-                bestnus     = []
-                bestgammas  = []
-
-                for n in range(5):  
-                    # split 80/20
-                    (trainX, crossX) = splitDataSet(raw,features,0.8)
-
-                    # BROAD AREA SEARCH
-                    # Initial hyperparams (nu cannot be 0)
-                    nuParams    = [0.01, 0.1, 0.3, 0.5, 0.7, 0.9]
-                    gammaParams = [1, 5, 10, 50, 100]
-
-                    # Results saves Training and CV errors for each pair of hyperparams
-                    results     = fit_predict(trainX, crossX, nuParams, gammaParams)
-                    bestParams  = selectBestParams(results)
-
-                    # INTENSIVE AREA SEARCH
-                    (nuParams, gammaParams) = createNewParams(bestParams)
-                    results     = fit_predict(trainX, crossX, nuParams, gammaParams)
-                    bestParams  = selectBestParams(results)
-
-                    # Random choice of one the best pair of params
-                    i = randrange(len(bestParams[0]))
-                    bestnus.append(round(float(bestParams[0][i]), 3))
-                    bestgammas.append(round(float(bestParams[1][i]), 3))
-                    print(".", end='')
-
-                ###########################################################
-                # TRAINING WITH 5 BEST HYPERPARAMS
-                ###########################################################                        
-                nu      = mean(bestnus)
-                gamma   = mean(bestgammas)
-                (trainX, crossX)    = splitDataSet(raw,features,0.8)
-                model = OneClassSVM(kernel='rbf',nu=nu,gamma=gamma)
-                model.fit(trainX)
-
-                filename = f"{modelName}" + axis
-                print(filename)
-                pickle.dump(model, open(DIR + filename, 'wb'))
-            
+            self.saveModels(modelName, self.fit(features))
         except Exception as e: print(e)
 
 
+    def fit(self, features, workers=FIT_WORKERS, seed=FIT_SEED):
+        '''
+        Fit the models of each axis on an (N,6) dataset (FEATURES order,
+        see db.queryTrainingData).
+        The searches of every axis and repeat run on workers processes;
+        the models are the same for a given seed.
+        Returns {axis: model}
+        '''
+        raw = pd.DataFrame(features, columns=FEATURES).dropna()
+        if raw.empty:
+            raise ValueError("Empty training dataset")
+        rng = np.random.default_rng(seed)
+
+        # ONE MODEL FOR EACH AXIS eg. MT01x, MT01y, MT01z
+        axes     = ('x','y','z')
+        features = {axis: [f'{axis}rms', f'{axis}cf'] for axis in axes}
+        searches = [(axis, n) for axis in axes for n in range(FIT_REPEATS)]
+
+        with fitMapper(workers) as mapper:
+            # split 80/20 (one split per axis and repeat)
+            splits = [splitDataSet(raw, features[axis], 0.8, int(rng.integers(2**32)))
+                      for (axis, n) in searches]
+
+            # BROAD AREA SEARCH
+            # Initial hyperparams (nu cannot be 0)
+            nuParams    = [0.01, 0.1, 0.3, 0.5, 0.7, 0.9]
+            gammaParams = [1, 5, 10, 50, 100]
+
+            # Results saves Training and CV errors for each pair of hyperparams
+            results     = fit_predict_many(splits, [(nuParams, gammaParams)] * len(splits), mapper)
+            bestParams  = [selectBestParams(r) for r in results]
+
+            # INTENSIVE AREA SEARCH
+            grids       = [createNewParams(b) for b in bestParams]
+            results     = fit_predict_many(splits, grids, mapper)
+            bestParams  = [selectBestParams(r) for r in results]
+
+            # Random choice of one the best pair of params
+            bestnus     = {axis: [] for axis in axes}
+            bestgammas  = {axis: [] for axis in axes}
+            for ((axis, n), best) in zip(searches, bestParams):
+                i = int(rng.integers(len(best[0])))
+                bestnus[axis].append(round(float(best[0][i]), 3))
+                bestgammas[axis].append(round(float(best[1][i]), 3))
+
+            ###########################################################
+            # TRAINING WITH 5 BEST HYPERPARAMS
+            ###########################################################                        
+            trainXs = [splitDataSet(raw, features[axis], 0.8, int(rng.integers(2**32)))[0]
+                       for axis in axes]
+            models  = mapper(fitModel, trainXs,
+                             [mean(bestnus[axis]) for axis in axes],
+                             [mean(bestgammas[axis]) for axis in axes])
+            models  = dict(zip(axes, models))
+        return models
+
+
+    def saveModels(self, modelName, models):
+        '''
+        Write the models of an equipment and swap them into the cache
+        '''
+        # write each file under a unique name and rename it: readers
+        # (and other workers) never see a partial file, then swap the
+        # cached models at once
+        for axis in ('x','y','z'):
+            filename = DIR + f"{modelName}" + axis
+            (fd, tmpFile) = tempfile.mkstemp(dir=DIR, prefix=f".{modelName}{axis}.")
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(models[axis], f)
+                os.replace(tmpFile, filename)
+            except Exception:
+                os.remove(tmpFile)
+                raise
+        _modelCache.set(modelName, _modelCache.version(modelName), models)
+
+
     def predict(self, values):
         # xrms xcf | yrms ycf | zrms zcf
-        outlierDetected = False
-        dictData = {'x': pd.DataFrame(values[3:5]).transpose(),
-                    'y': pd.DataFrame(values[7:9]).transpose(),
-                    'z': pd.DataFrame(values[11:13]).transpose()}
-
-        for axis in ['x','y','z']:
-            model = self.getModel(axis)
-            healthyAxis = model.predict(dictData[axis])[0]
-            # System is considered healthy if at least one axis prediction is normal (1)
-            outlierDetected = False if healthyAxis == True else True
-        return outlierDetected
-       
\ No newline at end of file
+        anomaly = self.predictBatch(self.model, featureMatrix([values]))[0]
+        return bool(anomaly[0])
+
+
+    def predictBatch(self, modelName, features):
+        '''
+        Score an (N,6) feature matrix (FEATURES order) at once.
+        Returns (anomaly (N,), healthy (N,3), scores (N,3)): per-axis
+        decisions and OCSVM decision values (negative: outlier); None when
+        the equipment has no model
+        '''
+        # one version of the models for every axis, even if reloaded meanwhile
+        models = _modelCache.get(modelName)
+        if models is None:
+            return None
+        features = np.asarray(features, dtype=float).reshape(-1, len(FEATURES))
+        scores   = np.empty((features.shape[0], 3))
+
+        for (i, axis) in enumerate(['x','y','z']):
+            model = models[axis]
+            data  = pd.DataFrame(features[:, 2*i:2*i+2], columns=FEATURES[2*i:2*i+2])
+            scores[:, i] = model.decision_function(data)
+
+        healthy = scores > 0
+        # System is considered healthy if at least one axis prediction is normal (1)
+        anomaly = ~healthy.any(axis=1)
+        return (anomaly, healthy, scores)
@@ -0,0 +1,138 @@
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from database import db
+from ML import ML
+from ML import online
+
+
+TRAINING_WORKERS    = ML.TRAINING_WORKERS
+TRAINING_RETRY      = int(os.environ.get('VIBRANIUM_TRAINING_RETRY', 600))     # seconds before a failed training is claimed again
+TRAINING_STALE      = int(os.environ.get('VIBRANIUM_TRAINING_STALE', 3600))    # seconds without news before a job is presumed dead
+ACTIVE              = ('queued', 'running')    # statuses of a job that can be cancelled
+
+
+def trainJob(jobID, equipID, size, start=None, end=None, modelType=None):
+    '''
+    Runs in a worker process: load the last size acquisitions of the
+    equipment (optionally between start and end) and fit the models of
+    each axis. Returns {axis: model}, or an OnlineModel (modelType online),
+    None when the job was cancelled before it started
+    '''
+    if not db.queryTrainingJob(jobID, 'running', ('queued',)):
+        return None
+    features = db.queryTrainingData("equipID", equipID, ML.FEATURES, size, start, end)
+    if modelType == online.MODEL_TYPE:
+        return online.OnlineModel().fit(features)
+    return ML.ModelHandler().fit(features)
+
+
+####################################################################
+# TRAINING JOBS
+####################################################################
+class TrainingJobs():
+    '''
+    Queue of training jobs executed by a pool of worker processes, out of
+    the HTTP requests. The training_state table is the state of the jobs:
+    any webservice worker reports or cancels a job, whichever worker runs
+    it. Models are saved and the equipment leaves training
+    (InTraining = False) only when its job succeeds; a cancelled job
+    discards its models.
+    '''
+    def __init__(self, workers=TRAINING_WORKERS):
+        '''
+        @workers: equipments trained at the same time
+        '''
+        self.workers    = workers
+        self.executor   = None
+        self.futures    = dict()            # jobID -> Future of the jobs run by this process
+        self.lock       = threading.Lock()
+
+
+    def getExecutor(self):
+        if self.executor is None:
+            # spawned workers: no database connection inherited from the webservice
+            self.executor = ProcessPoolExecutor(max_workers = self.workers,
+                                                mp_context = multiprocessing.get_context('spawn'))
+        return self.executor
+
+
+    def submit(self, equipID, size, start=None, end=None, modelType=None):
+        '''
+        Queue the training of an equipment whose training was claimed (see
+        db.queryCountTraining). Returns the jobID
+        @size: acquisitions of the dataset (None: all of the window)
+        @start, end: optional time window of the dataset
+        @modelType: equipment.modelType (online: first version of its online model)
+        '''
+        jobID = uuid.uuid4().hex
+        # queued before the worker process reads it
+        db.queryTrainingState(equipID, jobID, 'queued')
+        with self.lock:
+            future = self.getExecutor().submit(trainJob, jobID, equipID, size, start, end, modelType)
+            self.futures[jobID] = future
+        future.add_done_callback(lambda f: self.finish(jobID, equipID, f))
+        return jobID
+
+
+    def finish(self, jobID, equipID, future):
+        '''
+        Job completed (executor thread): save the models on success, unless
+        the job was cancelled meanwhile
+        '''
+        with self.lock:
+            self.futures.pop(jobID, None)
+
+        (status, error) = ('cancelled', None)
+        try:
+            if future.cancelled() or future.result() is None:
+                pass
+            # running -> saving: a cancel arriving now is too late
+            elif db.queryTrainingJob(jobID, 'saving', ('running',)):
+                models = future.result()
+                if isinstance(models, online.OnlineModel):
+                    online.saveCheckpoint(f"{equipID}", models)
+                else:
+                    ML.ModelHandler().saveModels(f"{equipID}", models)
+                # After trained: InTraining is false
+                if not db.queryUpdate("equipment", "InTraining", False, "equipID", equipID):
+                    raise RuntimeError("InTraining could not be updated")
+                status = 'done'
+
+        except Exception as e:
+            print(e)
+            (status, error) = ('failed', str(e)[:255])
+
+        db.queryTrainingJob(jobID, status, error=error)
+
+
+    def status(self, jobID=None):
+        '''
+        Training state of a job (None if unknown), or of every job when
+        jobID is None
+        '''
+        if jobID is None:
+            return db.querySelectJobs()
+        job = db.queryTrainingJob(jobID)
+        return job[0] if job else None
+
+
+    def cancel(self, jobID):
+        '''
+        Cancel a job: a queued one does not start, a running one finishes
+        but its models are discarded. Returns the job, None if unknown
+        '''
+        with self.lock:
+            future = self.futures.get(jobID)
+        if future is not None and future.cancel():
+            return self.status(jobID)   # finish() recorded it
+
+        db.queryTrainingJob(jobID, 'cancelling', ACTIVE)
+        return self.status(jobID)
+
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
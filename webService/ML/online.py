@@ -0,0 +1,343 @@
+import os
+import pickle
+import tempfile
+import threading
+import time
+import uuid
+import numpy as np
+from sklearn.kernel_approximation import RBFSampler
+from sklearn.linear_model import SGDOneClassSVM
+from sklearn.preprocessing import StandardScaler
+from database import db
+from ML import ML
+
+
+MODEL_TYPE          = 'online'  # equipment.modelType of the equipments using these models
+DIR                 = ML.DIR + 'online/'
+ONLINE_NU           = 0.1
+ONLINE_GAMMA        = 0.5   # RBF kernel, on standardized features
+ONLINE_COMPONENTS   = 100   # random Fourier features per axis
+ONLINE_ETA          = 0.01  # constant SGD step: the model keeps following the drift
+ONLINE_EPOCHS       = 5     # passes over the training dataset
+UPDATE_BATCH        = int(os.environ.get('VIBRANIUM_ONLINE_BATCH', 32))   # acquisitions per partial_fit
+UPDATE_INTERVAL     = int(os.environ.get('VIBRANIUM_ONLINE_INTERVAL', 10))    # seconds between two update cycles
+UPDATE_ROWS         = 1000  # acquisitions read per equipment and cycle
+CHECKPOINT_EVERY    = int(os.environ.get('VIBRANIUM_ONLINE_CHECKPOINT', 10))  # updates between checkpoints
+LEASE               = 'online'  # one webservice process updates the models (db.queryLease)
+KEEP_CHECKPOINTS    = 5     # versions kept per equipment
+
+
+####################################################################
+# CHECKPOINTS: DIR/<modelName>.v<version>
+####################################################################
+def checkpointFile(modelName, version):
+    return DIR + f"{modelName}.v{version:06d}"
+
+
+def checkpoints(modelName):
+    '''
+    Saved versions of an equipment model, oldest first
+    '''
+    prefix = f"{modelName}.v"
+    try:
+        names = os.listdir(DIR)
+    except OSError:
+        return []
+    return sorted(int(name[len(prefix):]) for name in names
+                  if name.startswith(prefix) and name[len(prefix):].isdigit())
+
+
+def saveCheckpoint(modelName, model, keep=KEEP_CHECKPOINTS):
+    '''
+    Write a new version of an equipment model (OnlineModel or its pickle)
+    and drop the versions beyond keep. Returns the version
+    '''
+    data = model if isinstance(model, bytes) else pickle.dumps(model)
+    os.makedirs(DIR, exist_ok=True)
+
+    # written under a unique name then linked: a version is never
+    # overwritten, concurrent writers (other workers) take the next one
+    (fd, tmpFile) = tempfile.mkstemp(dir=DIR, prefix=f".{modelName}.")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        version = (checkpoints(modelName) or [0])[-1] + 1
+        while True:
+            try:
+                os.link(tmpFile, checkpointFile(modelName, version))
+                break
+            except FileExistsError:
+                version += 1
+    finally:
+        os.remove(tmpFile)
+
+    for old in checkpoints(modelName)[:-keep]:
+        try:
+            os.remove(checkpointFile(modelName, old))
+        except OSError:
+            pass
+    return version
+
+
+def loadCheckpoint(modelName, version):
+    with open(checkpointFile(modelName, version), 'rb') as f:
+        return pickle.load(f)
+
+
+
+####################################################################
+# ONLINE MODEL
+####################################################################
+class OnlineModel():
+    '''
+    Novelty model of one equipment updated in mini-batches, without
+    retraining. Per axis: features standardized (scaler frozen after the
+    first fit), mapped on random Fourier features of an RBF kernel and
+    scored by a linear one-class SVM trained by SGD (partial_fit)
+    '''
+    def __init__(self, nu=ONLINE_NU, gamma=ONLINE_GAMMA, components=ONLINE_COMPONENTS,
+                 eta=ONLINE_ETA, seed=ML.FIT_SEED):
+        self.nu         = nu
+        self.gamma      = gamma
+        self.components = components
+        self.eta        = eta
+        self.seed       = seed
+        self.axes       = dict()    # axis -> (scaler, sampler, svm)
+        self.updates    = 0         # acquisitions learned
+        self.lastAcqID  = None      # last acquisition read by the OnlineUpdater
+
+
+    def transform(self, axis, features):
+        (scaler, sampler, svm) = self.axes[axis]
+        return sampler.transform(scaler.transform(features))
+
+
+    def fit(self, features, epochs=ONLINE_EPOCHS, batchSize=UPDATE_BATCH):
+        '''
+        First fit on an (N,6) dataset (FEATURES order, see
+        db.queryTrainingData), in mini-batches as the later updates
+        '''
+        features = np.asarray(features, dtype=float).reshape(-1, len(ML.FEATURES))
+        features = features[~np.isnan(features).any(axis=1)]
+        if not len(features):
+            raise ValueError("Empty training dataset")
+        rng = np.random.default_rng(self.seed)
+
+        for (i, axis) in enumerate(['x','y','z']):
+            scaler  = StandardScaler().fit(features[:, 2*i:2*i+2])
+            sampler = RBFSampler(gamma=self.gamma, n_components=self.components,
+                                 random_state=int(rng.integers(2**32)))
+            sampler.fit(scaler.transform(features[:, 2*i:2*i+2]))
+            svm     = SGDOneClassSVM(nu=self.nu, learning_rate='constant', eta0=self.eta,
+                                     random_state=int(rng.integers(2**32)))
+            self.axes[axis] = (scaler, sampler, svm)
+
+        for epoch in range(epochs):
+            order = rng.permutation(len(features))
+            for start in range(0, len(features), batchSize):
+                self.partialFit(features[order[start:start + batchSize]])
+        return self
+
+
+    def partialFit(self, features):
+        '''
+        One SGD update with an (N,6) mini-batch of healthy acquisitions
+        '''
+        for (i, axis) in enumerate(['x','y','z']):
+            self.axes[axis][2].partial_fit(self.transform(axis, features[:, 2*i:2*i+2]))
+        self.updates += len(features)
+
+
+    def decisionFunction(self, features):
+        '''
+        (N,3) decision values of an (N,6) feature matrix (negative: outlier)
+        '''
+        scores = np.empty((features.shape[0], 3))
+        for (i, axis) in enumerate(['x','y','z']):
+            scores[:, i] = self.axes[axis][2].decision_function(self.transform(axis, features[:, 2*i:2*i+2]))
+        return scores
+
+
+
+####################################################################
+# ONLINE HANDLER
+####################################################################
+class OnlineHandler():
+    '''
+    Online models of the equipments, with the ModelHandler scoring
+    interface. Read only: the models are updated by the OnlineUpdater,
+    a newer version saved by any process (training job, updater)
+    replaces the model in memory
+    '''
+    def __init__(self, checkInterval=ML.MODEL_CHECK):
+        self.checkInterval      = checkInterval
+        self.entries            = dict()    # modelName -> {checked, version, model}
+        self.lock               = threading.Lock()
+
+
+    def get(self, modelName):
+        '''
+        Entry of an equipment (latest version loaded), None when it has no model
+        '''
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(modelName)
+            if entry is not None and now - entry['checked'] < self.checkInterval:
+                return entry if entry['model'] is not None else None
+
+            versions = checkpoints(modelName)
+            version  = versions[-1] if versions else None
+            if entry is None or version != entry['version']:
+                model = None
+                if version is not None:
+                    try:
+                        model = loadCheckpoint(modelName, version)
+                    except (OSError, pickle.UnpicklingError, EOFError) as e:
+                        print(e)
+                        version = None
+                entry = {'version': version, 'model': model}
+                self.entries[modelName] = entry
+            entry['checked'] = now
+            return entry if entry['model'] is not None else None
+
+
+    def lookFor(self, modelName):
+        return self.get(modelName) is not None
+
+
+    def predictBatch(self, modelName, features):
+        '''
+        Score an (N,6) feature matrix (FEATURES order) at once.
+        Returns (anomaly (N,), healthy (N,3), scores (N,3)), as
+        ModelHandler.predictBatch; None when the equipment has no model
+        '''
+        features = np.asarray(features, dtype=float).reshape(-1, len(ML.FEATURES))
+        entry    = self.get(modelName)
+        if entry is None:
+            return None
+        scores   = entry['model'].decisionFunction(features)
+
+        healthy = scores > 0
+        # System is considered healthy if at least one axis prediction is normal (1)
+        anomaly = ~healthy.any(axis=1)
+        return (anomaly, healthy, scores)
+
+
+
+####################################################################
+# ONLINE UPDATER
+####################################################################
+class OnlineUpdater(threading.Thread):
+    '''
+    This thread updates the online models with the acquisitions predicted
+    healthy, read back from the database. Every webservice process runs
+    one; only the holder of the online lease updates, so no update is lost
+    between workers. Acquisitions are learned batchSize at a time; every
+    checkpointEvery updates a new version is saved, unless another version
+    was saved meanwhile (training job): that one is loaded instead
+    '''
+    def __init__(self, batchSize=UPDATE_BATCH, checkpointEvery=CHECKPOINT_EVERY,
+                 interval=UPDATE_INTERVAL, maxRows=UPDATE_ROWS):
+        '''
+        @batchSize: acquisitions per partial_fit
+        @checkpointEvery: updates between checkpoints
+        @interval: seconds between two update cycles
+        @maxRows: acquisitions read per equipment and cycle
+        '''
+        super().__init__(daemon=True)
+        self.batchSize          = batchSize
+        self.checkpointEvery    = checkpointEvery
+        self.interval           = interval
+        self.maxRows            = maxRows
+        self.owner              = uuid.uuid4().hex
+        self.entries            = dict()    # modelName -> {version, model, pending, updates}
+        self.stopped            = threading.Event()
+
+
+    def lease(self):
+        return db.queryLease(LEASE, self.owner, 3 * self.interval)
+
+
+    def load(self, modelName):
+        '''
+        Entry of an equipment with its latest version, None when it has no model
+        '''
+        versions = checkpoints(modelName)
+        version  = versions[-1] if versions else None
+        entry    = self.entries.get(modelName)
+        if entry is not None and entry['version'] == version:
+            return entry
+
+        self.entries.pop(modelName, None)
+        if version is None:
+            return None
+        try:
+            model = loadCheckpoint(modelName, version)
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            print(e)
+            return None
+        entry = {'version': version, 'model': model, 'pending': [], 'updates': 0}
+        self.entries[modelName] = entry
+        return entry
+
+
+    def update(self, equipID):
+        '''
+        Learn the new healthy acquisitions of an equipment (up to maxRows):
+        full batches are fitted now, the rest waits for the next cycle.
+        Returns the version checkpointed, None if none was
+        '''
+        modelName = f"{equipID}"
+        entry     = self.load(modelName)
+        if entry is None:
+            return None
+        model = entry['model']
+
+        if getattr(model, 'lastAcqID', None) is None:
+            # first version: trained on the acquisitions stored so far
+            model.lastAcqID = db.querySelectLastEquipAcq(equipID)
+            return None
+
+        rows = db.querySelectEquipAcq(equipID, ["anomaly"] + ML.FEATURES, model.lastAcqID, self.maxRows)
+        if not rows:
+            return None
+        model.lastAcqID = rows[-1][0]
+
+        features = np.array([row[2:] for row in rows if row[1] is not None and not row[1]],
+                            dtype=float).reshape(-1, len(ML.FEATURES))
+        pending  = entry['pending']
+        pending.extend(features[ML.scorable(features)])
+        while len(pending) >= self.batchSize:
+            model.partialFit(np.array(pending[:self.batchSize]))
+            del pending[:self.batchSize]
+            entry['updates'] += 1
+
+        if entry['updates'] < self.checkpointEvery:
+            return None
+        entry['updates'] = 0
+        if (checkpoints(modelName) or [None])[-1] != entry['version']:
+            # newer version saved meanwhile: ours is dropped, that one loaded
+            self.entries.pop(modelName, None)
+            return None
+        entry['version'] = saveCheckpoint(modelName, model)
+        return entry['version']
+
+
+    def run(self):
+        while not self.stopped.is_set():
+            if self.lease():
+                for equip in db.querySelectAllFrom("equipment", "modelType", MODEL_TYPE):
+                    if equip['InTraining'] == True:
+                        continue
+                    try:
+                        self.update(equip['equipID'])
+                    except Exception as e:
+                        print(f"Online update of {equip['equipID']}: {e}")
+            else:
+                # another process updates: models reloaded if the lease comes back
+                self.entries.clear()
+            self.stopped.wait(self.interval)
+
+
+    def stop(self):
+        self.stopped.set()
@@ -7,12 +7,64 @@ Machine Learning para detecao de vibracao anomala de motores eletricos.
 
 from flask import Flask, request, abort, jsonify, make_response
 from flask_cors import CORS
+from datetime import datetime, timedelta
+import atexit
+import math
+import numpy as np
+import os
 from database import db
+from database.writer import WriteBehind
+from database.schema import ROLLUP_LEVELS, ROLLUP_FEATURES
+from database.retention import Retention
 from ML import ML
+from ML import online
+from ML.jobs import TrainingJobs, TRAINING_RETRY, TRAINING_STALE
 
 MH = ML.ModelHandler()
+OH = online.OnlineHandler()
+jobs = TrainingJobs()
+RESCORE_CHUNK = 5000    # acquisitions scored/updated at a time
+MAX_POINTS    = 5000    # buckets of a range query
+RANGE_PAGE    = 1000    # buckets per page of a range query
+RETRY_AFTER   = 1       # seconds, when the write-behind buffer is full or the database fails
+TRAINING_SIZE = 400     # acquisitions of a training dataset - CHANGE DATASETSIZE HERE !!!!
 app = Flask(__name__)
 CORS(app)
+writer    = None    # WriteBehind, see createApp
+retention = None    # Retention, see createApp
+updater   = None    # online.OnlineUpdater, see createApp
+
+
+def createApp():
+    '''
+    Wire the webservice (database, background threads) and return the
+    Flask app: gunicorn "app:createApp()" or python app.py.
+    Importing this module has no side effects: the spawned training
+    processes import it again
+    '''
+    global writer, retention, updater
+    if app.config.get('VIBRANIUM_READY'):
+        return app
+    app.config['VIBRANIUM_READY'] = True
+
+    db.bootstrap()
+
+    # WRITE-BEHIND MODE: acquisitions inserted by a background writer in groups
+    if os.environ.get('VIBRANIUM_WRITE_BEHIND') == '1':
+        writer = WriteBehind("acquisition")
+        writer.start()
+        atexit.register(writer.stop)
+
+    # RETENTION: raw rows and fine rollups older than their horizon compacted
+    retention = Retention()
+    if retention.horizons:
+        retention.start()
+
+    # ONLINE MODELS: updated by one webservice process at a time
+    updater = online.OnlineUpdater()
+    updater.start()
+    atexit.register(updater.stop)
+    return app
 
 
 #######################################################################
@@ -51,6 +103,73 @@ def handleEQP(ID):
     ##################################################################
 
 
+# MODELS OF AN EQUIPMENT - PULLED BY GATEWAYS FOR EDGE SCORING
+@app.route("/v1/equipments/<ID>/model", methods=["GET"])
+def handleModel(ID):
+
+    # online models are scored here only
+    equip = db.querySelectAllFrom("equipment", "equipID", ID)
+    if not equip or _handler(equip[0]) is not MH or not MH.lookFor(f"{ID}"):
+        abort(404)
+
+    exported = MH.exportModel(f"{ID}")
+    if exported is None:
+        abort(404)
+    (version, models) = exported
+    if request.if_none_match.contains(version):
+        return make_response("", 304)
+
+    response = jsonify({"version": version, "models": models})
+    response.set_etag(version)
+    return response
+
+
+# RESCORE STORED ACQUISITIONS WITH THE CURRENT MODEL (AFTER RETRAINING)
+@app.route("/v1/equipments/<ID>/rescore", methods=["POST"])
+def handleRescore(ID):
+
+    equip = db.querySelectAllFrom("equipment", "equipID", ID)
+    if not equip:
+        abort(404)
+    handler = _handler(equip[0])
+    if not handler.lookFor(f"{ID}"):
+        abort(404)
+
+    (rescored, anomalies, skipped, lastID) = (0, 0, 0, 0)
+    while True:
+        rows = db.querySelectEquipAcq(ID, ["endpointID", "timeStamp", "anomaly"] + ML.FEATURES,
+                                      lastID, RESCORE_CHUNK)
+        if not rows:
+            break
+        lastID = rows[-1][0]
+
+        # acquisitions with missing features keep their anomaly
+        features = np.array([row[4:] for row in rows], dtype=float).reshape(-1, len(ML.FEATURES))
+        valid    = ML.scorable(features)
+        skipped += int((~valid).sum())
+        if not valid.any():
+            continue
+
+        rows    = [row for (row, ok) in zip(rows, valid) if ok]
+        scored  = handler.predictBatch(f"{ID}", features[valid])
+        if scored is None:
+            # model removed meanwhile
+            db.invalidateLast()
+            abort(404)
+        anomaly = scored[0]
+        # anomaly counts of the rollups adjusted with the new labels
+        OKstatus = db.queryUpdateAnomalies([row[:4] + (bool(a),) for (row, a) in zip(rows, anomaly)])
+        if not OKstatus:
+            db.invalidateLast()
+            abort(500)
+
+        rescored   += len(rows)
+        anomalies  += int(anomaly.sum())
+
+    db.invalidateLast()
+    return jsonify({"rescored": rescored, "anomalies": anomalies, "skipped": skipped})
+
+
 #######################################################################
 # STATIONS
 #######################################################################
@@ -110,7 +229,7 @@ def handleEND(ID):
 @app.route("/v1/endpoints/<ID>/acquisition", methods = ["GET", "POST"])
 def handleACQ(ID):
 
-    results = db.querySelectAllFrom("endpoint", "macID", ID)
+    results = db.cachedSelectAllFrom("endpoint", "macID", ID)
     if not results:
         abort(404)
     
@@ -119,54 +238,341 @@ def handleACQ(ID):
         if not request.json:
             abort(400)
 
-        (acqFields, acqValues) = db.extractJsonAcq(request.json)
-        equipID = request.json['equipID']
+        try:
+            (acqFields, acqValues) = db.extractJsonAcq(request.json)
+            equipID = request.json['equipID']
+        except (KeyError, TypeError, ValueError):
+            abort(400)
+        if not _validVerdict(request.json):
+            abort(400)
+        # training flags read from the database: other workers change them
         equip = db.querySelectAllFrom("equipment", "equipID", equipID)
+        if not equip:
+            abort(404)
         print(acqValues)
 
         ##################################################################
         # CREATING A DATASET - EQUIPMENT IN TRAINING
         ##################################################################
         if (equip[0]['InTraining'] == True):
-            db.queryInsertInto("acquisition", acqFields, acqValues)
-            MH.incrementDataSetSize()
-
-            if(MH.dataSetSize == 400):            #CHANGE DATASETSIZE HERE !!!!
-                # create a csvfile to train the model
-                db.makeCSVfile("acquisition", "endpointID", ID, MH.dataSetSize)
-                MH.train(f"{equipID}")
-                MH.clearDataSetSize()
-
-                # After trained: InTraining is false
-                db.queryUpdate("equipment", "InTraining", False, "equipID", equipID)
+            # written now: training datasets are loaded from the database
+            _insertAcq(ID, acqFields, acqValues, sync=True)
+            _countTrainingAcq(equip[0])
             return {"OK": 200}
 
         else:
-            equipModeled = MH.lookFor(f"{equipID}")
+            equipModeled = _handler(equip[0]).lookFor(f"{equipID}")
+            ##################################################################
+            # ANOMALY ALREADY SCORED AT THE GATEWAY (EDGE MODEL)
+            ##################################################################
+            if (request.json.get('anomaly') is not None):
+                acqValues[1] = request.json['anomaly']
+                _insertAcq(ID, acqFields, acqValues)
+                return {"OK": 200}
+
             ##################################################################
             # PREDICT ANOMALY
             ##################################################################
-            if(equipModeled):
-                prediction = MH.predict(acqValues)
+            elif(equipModeled):
+                prediction = _predict(equip[0], [acqValues])[0]
 
                 # SET ANOMALY prediction
                 acqValues[1] = prediction
                 print(prediction)
-                db.queryInsertInto("acquisition", acqFields, acqValues)
+                _insertAcq(ID, acqFields, acqValues)
                 return {"OK": 200}  
 
             ##################################################################
             # IF THE TRAINING WAS NEVER ACTIVATED - MONITORING ONLY
             ##################################################################
             else:
-                db.queryInsertInto("acquisition", acqFields, acqValues)
+                _insertAcq(ID, acqFields, acqValues)
                 return {"OK": 200} 
                  
     # GET REQUEST
     else:
-        # return the last acquisition from an endpoint
-        lastAcq = db.querySelectLastFrom("acquisition", "acqID", "endpointID", ID)
-        return jsonify(lastAcq)
+        # return the last acquisition from an endpoint (latest cache)
+        lastAcq = db.cachedSelectLast(ID)
+        if not lastAcq:
+            return jsonify(lastAcq)
+
+        # a rescore changes the anomaly of the same acquisition
+        version = f"{lastAcq[0]['acqID']}-{lastAcq[0]['anomaly']}"
+        if request.if_none_match.contains(version):
+            return make_response("", 304)
+        response = jsonify(lastAcq)
+        response.set_etag(version)
+        return response
+
+
+def _insertAcq(ID, acqFields, acqValues, sync=False):
+    '''
+    Insert an acquisition and make it the last one of the endpoint
+    (queued instead in write-behind mode, unless sync)
+    '''
+    if writer and not sync:
+        if not writer.put(acqFields, [(ID, acqValues)]):
+            abort(_busy())
+        return
+
+    acqID = db.queryInsertInto("acquisition", acqFields, acqValues)
+    if acqID is None:
+        abort(_busy())
+    db.setLast(ID, acqID, acqFields, acqValues)
+
+
+# TIME RANGE OF AN ENDPOINT: BUCKETED MIN/AVG/MAX SERIES (DASHBOARDS)
+# ?from=2021-06-01 00:00:00&to=2021-07-01 00:00:00&fields=xrms,yrms&maxPoints=500&after=<next>
+@app.route("/v1/endpoints/<ID>/acquisitions", methods = ["GET"])
+def handleRange(ID):
+
+    results = db.cachedSelectAllFrom("endpoint", "macID", ID)
+    if not results:
+        abort(404)
+
+    try:
+        start     = _parseTime(request.args['from'])
+        end       = _parseTime(request.args['to'])
+        fields    = request.args.get('fields', 'xrms,yrms,zrms').split(',')
+        maxPoints = min(int(request.args.get('maxPoints', 1000)), MAX_POINTS)
+        after     = request.args.get('after', type=int)
+    except (KeyError, ValueError):
+        abort(400)
+
+    # fields are column names: only the acquisition features are accepted
+    if end <= start or maxPoints < 1 or not set(fields) <= set(db.getColumns("acquisition")[4:]):
+        abort(400)
+
+    width   = max(1, math.ceil((end - start).total_seconds() / maxPoints))
+
+    # wide buckets are read from the coarsest rollup that fits (aligned on it)
+    level = None
+    if set(fields) <= set(ROLLUP_FEATURES):
+        for (name, seconds) in sorted(ROLLUP_LEVELS.items(), key=lambda l: l[1]):
+            if width >= seconds:
+                level = (name, seconds)
+
+    if level:
+        (name, seconds) = level
+        width   = math.ceil(width / seconds) * seconds
+        start   = db.floorTime(start, seconds)
+        buckets = db.querySelectRollups(ID, fields, name, start, end, width, after, RANGE_PAGE)
+    else:
+        buckets = db.querySelectBuckets(ID, fields, start, end, width, after, RANGE_PAGE)
+
+    points = []
+    for row in buckets:
+        point = {"time": str(start + timedelta(seconds=row['bucket'] * width)),
+                 "count": row['count']}
+        for f in fields:
+            point[f] = {"min": row[f'{f}_min'], "avg": row[f'{f}_avg'], "max": row[f'{f}_max']}
+        points.append(point)
+
+    nextPage = buckets[-1]['bucket'] if len(buckets) == RANGE_PAGE else None
+    return jsonify({"from": str(start), "to": str(end), "bucket": width,
+                    "points": points, "next": nextPage})
+
+
+def _validVerdict(acq):
+    '''
+    Gateway verdict (edge model) of an acquisition: absent, null or a boolean
+    '''
+    anomaly = acq.get('anomaly')
+    return anomaly is None or isinstance(anomaly, bool)
+
+
+def _busy():
+    '''
+    503 response: retry later (write-behind buffer full, database failing)
+    '''
+    response = make_response({"Service Unavailable": 503}, 503)
+    response.headers['Retry-After'] = str(RETRY_AFTER)
+    return response
+
+
+def _parseTime(value):
+    '''
+    'YYYY-MM-DD HH:MM:SS' (as sent by the gateways) or unix seconds.
+    Raises ValueError
+    '''
+    try:
+        seconds = float(value)
+    except ValueError:
+        return datetime.fromisoformat(value)
+    try:
+        return datetime.fromtimestamp(seconds)
+    except (OverflowError, OSError, ValueError):
+        # inf, nan or out of the platform range
+        raise ValueError(f"Invalid time: {value}")
+
+
+#######################################################################
+# ACQUISITIONS - BULK INGEST (SEVERAL ENDPOINTS)
+#######################################################################
+@app.route("/v1/acquisitions", methods = ["POST"])
+def handleBulkACQ():
+    '''
+    Body: array of acquisitions (same JSON as handleACQ, endpointID in each).
+    All valid acquisitions are inserted in one transaction.
+    Returns the status of each item, in order
+    '''
+    acquisitions = request.get_json(silent=True)
+    if not isinstance(acquisitions, list):
+        abort(400)
+
+    status  = [200] * len(acquisitions)
+    rows    = []        # (index, endpointID, equipID, acqValues)
+    fields  = None
+    equips  = dict()    # equipID -> equipment row, read once (not cached: training flags)
+
+    ##################################################################
+    # VALIDATION - ONE PASS
+    ##################################################################
+    for (i, acq) in enumerate(acquisitions):
+        try:
+            endpoint = db.cachedSelectAllFrom("endpoint", "macID", acq['endpointID'])
+            if acq['equipID'] not in equips:
+                equips[acq['equipID']] = db.querySelectAllFrom("equipment", "equipID", acq['equipID'])
+            if not endpoint or not equips[acq['equipID']]:
+                status[i] = 404
+                continue
+            (fields, acqValues) = db.extractJsonAcq(acq)
+            if not _validVerdict(acq):
+                status[i] = 400
+                continue
+            rows.append((i, acq['endpointID'], acq['equipID'], acqValues))
+        except (KeyError, TypeError, ValueError):
+            status[i] = 400
+
+    ##################################################################
+    # SET ANOMALY: GATEWAY VERDICT OR ONE PREDICTION PER EQUIPMENT
+    ##################################################################
+    toPredict = dict()  # equipID -> rows
+    for row in rows:
+        (i, endpointID, equipID, acqValues) = row
+        if equips[equipID][0]['InTraining'] == True:
+            continue
+        if acquisitions[i].get('anomaly') is not None:
+            acqValues[1] = acquisitions[i]['anomaly']
+        elif _handler(equips[equipID][0]).lookFor(f"{equipID}"):
+            toPredict.setdefault(equipID, []).append(acqValues)
+
+    for (equipID, values) in toPredict.items():
+        for (acqValues, prediction) in zip(values, _predict(equips[equipID][0], values)):
+            acqValues[1] = prediction
+
+    ##################################################################
+    # WRITE-BEHIND: MONITORING ROWS QUEUED, ALL OR NONE
+    ##################################################################
+    queued = [row for row in rows if equips[row[2]][0]['InTraining'] != True] if writer else []
+    if queued:
+        # fields set by the valid rows
+        if not writer.put(fields, [(row[1], row[3]) for row in queued]):
+            for row in queued:
+                status[row[0]] = 503
+        rows = [row for row in rows if row not in queued]
+
+    ##################################################################
+    # INSERT - ONE TRANSACTION
+    ##################################################################
+    if rows and not db.queryInsertMany("acquisition", fields, [row[3] for row in rows]):
+        for row in rows:
+            status[row[0]] = 503
+        rows = []
+
+    # nothing stored: the whole request is retried (gateway outbox), else
+    # the gateway retries the items with a 503 status
+    if 503 in status and 200 not in status:
+        abort(_busy())
+
+    # last acquisitions reloaded on the next GET
+    for endpointID in {row[1] for row in rows}:
+        db.invalidateLast(endpointID)
+
+    # equipments in training count the new acquisitions
+    training = dict()   # equipID -> count
+    for (i, endpointID, equipID, acqValues) in rows:
+        if equips[equipID][0]['InTraining'] == True:
+            training[equipID] = training.get(equipID, 0) + 1
+    for (equipID, count) in training.items():
+        _countTrainingAcq(equips[equipID][0], count)
+
+    return jsonify({"status": status})
+
+
+def _countTrainingAcq(equip, count=1):
+    '''
+    Count new acquisitions of an equipment (row) in training; the
+    webservice worker that completes the dataset (or retries a failed
+    training) queues the training of its models
+    '''
+    equipID = equip['equipID']
+    if db.queryCountTraining(equipID, count, TRAINING_SIZE, TRAINING_RETRY, TRAINING_STALE):
+        # trained by a worker process on the acquisitions of every endpoint:
+        # InTraining is false when it succeeds
+        jobs.submit(equipID, TRAINING_SIZE, modelType=equip.get('modelType'))
+
+
+def _handler(equip):
+    '''
+    Model handler of an equipment (row): OnlineHandler when its modelType
+    is online, ModelHandler (OCSVM) otherwise
+    '''
+    if equip.get('modelType') == online.MODEL_TYPE:
+        return OH
+    return MH
+
+
+def _predict(equip, rows):
+    '''
+    Anomaly of acquisition values lists (extractJsonAcq) of one equipment
+    (row), None for the ones with missing features or without a model.
+    Online models learn the healthy ones later (see online.OnlineUpdater)
+    '''
+    equipID    = equip['equipID']
+    features   = ML.featureMatrix(rows)
+    valid      = ML.scorable(features)
+    prediction = [None] * len(rows)
+    if not valid.any():
+        return prediction
+
+    scored = _handler(equip).predictBatch(f"{equipID}", features[valid])
+    if scored is None:
+        return prediction
+    for (i, a) in zip(np.flatnonzero(valid), scored[0].tolist()):
+        prediction[i] = a
+    return prediction
+
+
+#######################################################################
+# TRAINING JOBS
+#######################################################################
+@app.route("/v1/jobs", methods=["GET"])
+def handleJobs():
+    return jsonify(jobs.status())
+
+
+# TRAINING PROGRESS OF AN EQUIPMENT (SHARED BY EVERY WORKER)
+@app.route("/v1/equipments/<ID>/training", methods=["GET"])
+def handleTraining(ID):
+
+    results = db.queryTrainingState(ID)
+    if not results:
+        abort(404)
+    return jsonify(results)
+
+
+@app.route("/v1/jobs/<jobID>", methods=["GET", "DELETE"])
+def handleJob(jobID):
+
+    if request.method == "GET":
+        job = jobs.status(jobID)
+    else:
+        job = jobs.cancel(jobID)
+
+    if job is None:
+        abort(404)
+    return jsonify(job)
 
 
 #######################################################################
@@ -188,4 +594,4 @@ def _corsify(response):
 
 
 if __name__ == "__main__":
-    app.run()
+    createApp().run()
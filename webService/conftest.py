@@ -0,0 +1,67 @@
+'''
+Tests of the webservice: each test gets its own SQLite database file
+(the storage engine is swapped, see database.engines)
+'''
+import os
+os.environ['VIBRANIUM_DB_ENGINE'] = 'sqlite'
+
+import pytest
+from database import db
+from database.engines import SQLiteEngine
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, '_engine', SQLiteEngine(str(tmp_path / 'vibranium.db')))
+    for cache in (db._rowCache, db._colCache, db._latestCache):
+        cache.invalidate()
+    db.bootstrap()
+    yield db
+    for cache in (db._rowCache, db._colCache, db._latestCache):
+        cache.invalidate()
+
+
+@pytest.fixture
+def equipment(database):
+    '''
+    Station GW01, equipment MT01 (monitoring) and its endpoint EP01
+    '''
+    with db.session() as (cnx, cursor):
+        cursor.execute("INSERT INTO station VALUES ('GW01')")
+        cursor.execute("INSERT INTO equipment (equipID, InTraining) VALUES ('MT01', FALSE)")
+        cursor.execute("INSERT INTO endpoint VALUES ('EP01', 'MT01', 'GW01')")
+        cnx.commit()
+    return 'MT01'
+
+
+@pytest.fixture
+def client(database):
+    import app
+    return app.app.test_client()
+
+
+@pytest.fixture
+def acquisition():
+    '''
+    acquisition(**fields): acquisition JSON as posted by the gateways
+    '''
+    def make(endpointID='EP01', equipID='MT01', timeStamp='2021-08-10 12:00:00', rms=0.35, cf=1.41):
+        data = {'endpointID': endpointID, 'equipID': equipID, 'timeStamp': timeStamp}
+        for axis in ('x','y','z'):
+            data[axis] = {'rms': rms, 'cf': cf, 'freq': 60.0, 'amp': 0.1}
+        return data
+    return make
+
+
+@pytest.fixture
+def models(tmp_path, monkeypatch):
+    '''
+    Model files written under a temporary directory
+    '''
+    from ML import ML
+    directory = tmp_path / 'models'
+    directory.mkdir()
+    monkeypatch.setattr(ML, 'DIR', str(directory) + '/')
+    ML._modelCache.invalidate()
+    yield ML
+    ML._modelCache.invalidate()
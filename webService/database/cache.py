@@ -0,0 +1,54 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache():
+    '''
+    In-process cache: entries expire after ttl seconds and the least
+    recently used ones are evicted beyond maxSize
+    '''
+    def __init__(self, ttl=60, maxSize=1024):
+        self.ttl        = ttl
+        self.maxSize    = maxSize
+        self.entries    = OrderedDict()     # key -> (expires, value)
+        self.lock       = threading.Lock()
+
+
+    def get(self, key, loader=None):
+        '''
+        Cached value of key; when missing or expired it is loaded with
+        loader() (not cached if the loader returns an empty result)
+        '''
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                return entry[1]
+
+        if loader is None:
+            return None
+        value = loader()
+        if value:
+            self.set(key, value)
+        return value
+
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+
+
+    def invalidate(self, key=None):
+        '''
+        Drop one key, or everything when key is None
+        '''
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
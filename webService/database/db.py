@@ -1,20 +1,67 @@
-import mysql.connector
-import csv
+import numpy as np
+import os
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from database import schema
+from database.cache import TTLCache
+from database.engines import MySQLEngine, SQLiteEngine
 
 
-def connect():
-    cnx = mysql.connector.connect(
-        host = "localhost",
-        user =  'tccuser',
-        password = 'wPk4!364',
-        database = 'vibraniumDB')
-    cursor = cnx.cursor()
-    return(cnx, cursor)
+DB_ENGINE = os.environ.get('VIBRANIUM_DB_ENGINE', 'mysql')     # 'mysql' | 'sqlite'
+DB_CONFIG = {
+    'host':     os.environ.get('VIBRANIUM_DB_HOST', "localhost"),
+    'user':     os.environ.get('VIBRANIUM_DB_USER', 'tccuser'),
+    'password': os.environ.get('VIBRANIUM_DB_PASSWORD', 'wPk4!364'),
+    'database': os.environ.get('VIBRANIUM_DB_NAME', 'vibraniumDB')}
+DB_PATH      = os.environ.get('VIBRANIUM_DB_PATH', 'vibranium.db')   # SQLite file
+POOL_SIZE    = int(os.environ.get('VIBRANIUM_DB_POOL_SIZE', 5))
+POOL_TIMEOUT = 10   # seconds waiting for a free connection
+CACHE_TTL    = int(os.environ.get('VIBRANIUM_CACHE_TTL', 60))
+TRAINING_CHUNK = 1000   # rows fetched at a time when loading training data
+LATEST_TTL   = int(os.environ.get('VIBRANIUM_LATEST_TTL', 2))      # other workers' inserts and rescores show up after this
+
+if DB_ENGINE == 'sqlite':
+    _engine = SQLiteEngine(DB_PATH)
+else:
+    _engine = MySQLEngine(DB_CONFIG, POOL_SIZE, POOL_TIMEOUT)
+Error = _engine.Error
+
+EPOCH       = datetime(1970, 1, 1)
+
+_rowCache   = TTLCache(CACHE_TTL)           # (table, column, value) -> rows
+_colCache   = TTLCache(CACHE_TTL * 60)      # table -> column names
+_latestCache = TTLCache(LATEST_TTL, 100000)   # endpointID -> [last acquisition]
+
+
+def connect(query=None):
+    '''
+    Connection and cursor of the storage engine (prepared cursor of this
+    query shape on MySQL)
+    '''
+    return _engine.connect(query)
 
 
 def disconnect(cnx, cursor):
-    cursor.close()
-    cnx.close()
+    _engine.disconnect(cnx, cursor)
+
+
+@contextmanager
+def session(query=None):
+    '''
+    with session(query) as (cnx, cursor): connection returned to the pool
+    on exit, uncommitted work rolled back on errors
+    '''
+    cnx, cursor = connect(query)
+    try:
+        yield (cnx, cursor)
+    except Exception:
+        try:
+            cnx.rollback()
+        except Error:
+            pass
+        raise
+    finally:
+        disconnect(cnx, cursor)
     
 
 def fetchAll(cursor):
@@ -30,62 +77,353 @@ def querySelectAllFrom(table, column, value):
     query = f"SELECT * FROM {table} WHERE {column}=(%s)"
     values = [value]
     try:
-        cnx, cursor = connect()
-        cursor.execute(query, values)
-        results = fetchAll(cursor)
-        disconnect(cnx, cursor)
-        return results
+        with session(query) as (cnx, cursor):
+            cursor.execute(query, values)
+            return fetchAll(cursor)
 
-    except mysql.connector.Error as e:
+    except Error as e:
         print(e)
         return []
 
 
+def cachedSelectAllFrom(table, column, value):
+    '''
+    querySelectAllFrom through the row cache (endpoint, station). Rows
+    changed by other workers show up after CACHE_TTL: the equipment
+    training flags are read uncached
+    '''
+    return _rowCache.get((table, column, value),
+                         lambda: querySelectAllFrom(table, column, value))
+
+
+def invalidate(table, column, value):
+    '''
+    Drop a cached row after it changed
+    '''
+    _rowCache.invalidate((table, column, value))
+
+
+def getColumns(table):
+    '''
+    Column names of a table (cached: the schema rarely changes)
+    '''
+    def load():
+        with session() as (cnx, cursor):
+            cursor.execute(f"SELECT * FROM {table} LIMIT 0")
+            cursor.fetchall()
+            return list(map(lambda x:x[0], cursor.description))
+    return list(_colCache.get(table, load))
+
+
+def bootstrap():
+    '''
+    Create the missing tables, columns and indexes (database.schema):
+    tables created by an older version get the columns added since
+    '''
+    try:
+        with session() as (cnx, cursor):
+            for statement in schema.statements(_engine):
+                cursor.execute(statement)
+            for table in schema.TABLES:
+                cursor.execute(f"SELECT * FROM {table} LIMIT 0")
+                cursor.fetchall()
+                existing = {d[0].lower() for d in cursor.description}
+                for (name, kind, options) in schema.TABLES[table]:
+                    if name.lower() not in existing:
+                        cursor.execute(schema.addColumn(_engine, table, name))
+                _colCache.invalidate(table)
+            for (name, table, columns) in schema.INDEXES:
+                _engine.createIndex(cursor, name, table, columns)
+            cnx.commit()
+        return True
+
+    except Error as e:
+        print(e)
+        return False
+
+
 def querySelectLastFrom(table, pKey, column, value):
     '''
-    Query:  SELECT * FROM table WHERE pKey IN (
-                SELECT MAX(pKey)
-                FROM table
-                WHERE column = value
-                )
-    '''    
-    query = f"SELECT * FROM {table} WHERE {pKey} IN (   \
-            SELECT MAX({pKey})                          \
-            FROM {table}                                \
-            WHERE {column}=(%s))"
+    Query:  SELECT * FROM table WHERE column = value
+            ORDER BY pKey DESC LIMIT 1
+    One index seek with an index on (column, pKey)
+    '''
+    query = f"SELECT * FROM {table} WHERE {column} = (%s) ORDER BY {pKey} DESC LIMIT 1"
     value = [value]
     try:
-        cnx, cursor = connect()
-        cursor.execute(query, value)
-        results = fetchAll(cursor)
-        disconnect(cnx, cursor)
-        return results
+        with session(query) as (cnx, cursor):
+            cursor.execute(query, value)
+            return fetchAll(cursor)
 
-    except mysql.connector.Error as e:
+    except Error as e:
         print(e)
         return []
 
 
-def queryInsertInto(table, columns, values):
+def insertQuery(table, columns):
     '''
-    Query: INSERT INTO table (columnA, ...) VALUES (%s, ...)
+    Query string: INSERT INTO table (columnA, ...) VALUES (%s, ...)
     '''
     columns = tuple(columns)
-    values  = tuple(values)
 
     query = f"INSERT INTO {table} {columns} VALUES ("
     for i in columns:
         query += "%s,"
     query = query[:-1] + ")"
     query = query.replace("'","")
+    return query
 
+
+def querySelectBuckets(endpointID, fields, start, end, width, after=None, limit=1000):
+    '''
+    Query:  SELECT bucket, COUNT(*), MIN(field), AVG(field), MAX(field), ...
+            FROM acquisition WHERE endpointID = endpointID
+            AND timeStamp >= start AND timeStamp < end
+            GROUP BY bucket (width seconds from start)
+    Keyset pages: buckets after the bucket number after, up to limit
+    '''
+    aggregates = ", ".join(f"MIN({f}) AS {f}_min, AVG({f}) AS {f}_avg, MAX({f}) AS {f}_max"
+                           for f in fields)
+    query = f"SELECT {_engine.timeBucket('timeStamp')} AS bucket,          \
+                     COUNT(*) AS count, {aggregates}                         \
+              FROM acquisition                                              \
+              WHERE endpointID = %s AND timeStamp >= %s AND timeStamp < %s   \
+              GROUP BY bucket ORDER BY bucket LIMIT {int(limit)}"
+    first  = start if after is None else start + timedelta(seconds=(after + 1) * width)
+    values = [start, width, endpointID, first, end]
     try:
-        cnx, cursor = connect()
-        cursor.execute(query, values)
+        with session(query) as (cnx, cursor):
+            cursor.execute(query, values)
+            return fetchAll(cursor)
+
+    except Error as e:
+        print(e)
+        return []
+
+
+def queryInsertInto(table, columns, values):
+    '''
+    Query: INSERT INTO table (columnA, ...) VALUES (%s, ...)
+    Returns the id of the new row (None on errors)
+    '''
+    values  = tuple(values)
+    query   = insertQuery(table, columns)
+
+    try:
+        with session(query) as (cnx, cursor):
+            cursor.execute(query, values)
+            acqID = cursor.lastrowid
+            if table == "acquisition":
+                updateRollups(cnx, columns, [values])
+            cnx.commit()
+            return acqID
+    # a malformed timeStamp fails the rollups: rolled back by the session
+    except (Error, ValueError, TypeError) as e:
+        print(e)
+        return None
+
+
+def insertMany(table, columns, rows):
+    '''
+    INSERT INTO table (columnA, ...) VALUES (%s, ...) for every row, sent
+    with one executemany (multi-row INSERT) in one transaction.
+    Raises the engine errors (see transient): nothing is committed then
+    '''
+    query = insertQuery(table, columns)
+    rows  = [tuple(values) for values in rows]
+    if not rows:
+        return
+
+    # plain cursor: the connector batches executemany INSERTs, a
+    # prepared cursor would run one statement per row
+    with session() as (cnx, cursor):
+        cursor.executemany(query, rows)
+        if table == "acquisition":
+            updateRollups(cnx, columns, rows)
         cnx.commit()
-        disconnect(cnx, cursor)
-    except mysql.connector.Error as e:
+
+
+def queryInsertMany(table, columns, rows):
+    '''
+    Query: INSERT INTO table (columnA, ...) VALUES (%s, ...) for every row,
+    in one transaction (see insertMany).
+    Returns True when all rows were committed, False when none were
+    '''
+    try:
+        insertMany(table, columns, rows)
+        return True
+
+    # a malformed timeStamp fails the rollups: rolled back by the session
+    except (Error, ValueError, TypeError) as e:
+        print(e)
+        return False
+
+
+def transient(error):
+    '''
+    True when a failed query may succeed if retried (see the engines)
+    '''
+    return _engine.transient(error)
+
+
+def floorTime(timeStamp, seconds):
+    '''
+    Start of the seconds-long bucket of a time (buckets aligned on the epoch)
+    '''
+    if isinstance(timeStamp, str):
+        timeStamp = datetime.fromisoformat(timeStamp)
+    offset = (timeStamp - EPOCH).total_seconds()
+    return EPOCH + timedelta(seconds=offset - offset % seconds)
+
+
+def rollupRows(fields, rows):
+    '''
+    Aggregate acquisition rows (values in fields order) per rollup level
+    and (endpointID, bucket): {level: {key: [count, anomalies, min, sum, max, count, ...]}}
+    '''
+    index    = {field: i for (i, field) in enumerate(fields)}
+    features = [index[f] for f in schema.ROLLUP_FEATURES]
+    rollups  = {level: dict() for level in schema.ROLLUP_LEVELS}
+
+    for values in rows:
+        anomaly = 1 if values[index['anomaly']] else 0
+        for (level, seconds) in schema.ROLLUP_LEVELS.items():
+            key = (values[index['endpointID']], floorTime(values[index['timeStamp']], seconds))
+            agg = rollups[level].get(key)
+            if agg is None:
+                agg = rollups[level][key] = emptyRollup()
+            agg[0] += 1
+            agg[1] += anomaly
+            for (j, i) in enumerate(features):
+                value = values[i]
+                if value is None:
+                    continue
+                k = 2 + len(schema.ROLLUP_AGGS) * j
+                agg[k]      = value if agg[k] is None else min(agg[k], value)
+                agg[k + 1] += value
+                agg[k + 2]  = value if agg[k + 2] is None else max(agg[k + 2], value)
+                agg[k + 3] += 1
+    return rollups
+
+
+def emptyRollup():
+    '''
+    Aggregates of a bucket without acquisitions (merged as a no-op)
+    '''
+    return [0, 0] + [None, 0.0, None, 0] * len(schema.ROLLUP_FEATURES)
+
+
+def upsertRollups(cnx, rollups):
+    '''
+    Merge aggregated rows into the rollup tables. Rows are locked in one
+    order (level, endpointID, bucket) by every transaction: concurrent
+    writers wait for each other instead of deadlocking
+    '''
+    columns = ["endpointID", "bucket", "count", "anomalies"] + \
+              [f"{f}_{agg}" for f in schema.ROLLUP_FEATURES for agg in schema.ROLLUP_AGGS]
+    updates = {c: ('add' if c.rsplit('_', 1)[-1] in ('sum', 'count') or c == 'anomalies'
+                   else c.rsplit('_', 1)[1])
+               for c in columns[2:]}
+
+    cursor = _engine.cursor(cnx)
+    try:
+        for level in schema.ROLLUP_LEVELS:
+            groups = rollups.get(level)
+            if groups:
+                query = _engine.upsert(f"acquisition_{level}", ("endpointID", "bucket"), columns, updates)
+                cursor.executemany(query, [key + tuple(agg) for (key, agg) in sorted(groups.items())])
+    finally:
+        cursor.close()
+
+
+def updateRollups(cnx, fields, rows):
+    '''
+    Incremental rollups of new acquisitions (same transaction as the insert)
+    '''
+    upsertRollups(cnx, rollupRows(list(fields), rows))
+
+
+def querySelectRollups(endpointID, fields, level, start, end, width, after=None, limit=1000):
+    '''
+    querySelectBuckets from the rollup table of a level (width and start
+    must be multiples of the level)
+    '''
+    # NULL values count in neither sum: the average of AVG() over the raw rows
+    aggregates = ", ".join(f"MIN({f}_min) AS {f}_min, SUM({f}_sum) / NULLIF(SUM({f}_count), 0) AS {f}_avg, "
+                           f"MAX({f}_max) AS {f}_max" for f in fields)
+    query = f"SELECT {_engine.timeBucket('bucket')} AS bucket,             \
+                     SUM(count) AS count, {aggregates}                      \
+              FROM acquisition_{level}                                      \
+              WHERE endpointID = %s AND bucket >= %s AND bucket < %s        \
+              GROUP BY 1 ORDER BY 1 LIMIT {int(limit)}"
+    first  = start if after is None else start + timedelta(seconds=(after + 1) * width)
+    values = [start, width, endpointID, first, end]
+    try:
+        with session(query) as (cnx, cursor):
+            cursor.execute(query, values)
+            return fetchAll(cursor)
+
+    except Error as e:
+        print(e)
+        return []
+
+
+def queryUpdateAnomalies(rows):
+    '''
+    Set the anomaly of acquisitions and adjust the anomaly counts of the
+    rollups, in one transaction.
+    rows: (acqID, endpointID, timeStamp, old anomaly, new anomaly)
+    '''
+    changed = [row for row in rows if bool(row[3]) != bool(row[4]) or row[3] is None]
+    if not changed:
+        return True
+
+    rollups = {level: dict() for level in schema.ROLLUP_LEVELS}
+    for (acqID, endpointID, timeStamp, old, new) in changed:
+        for (level, seconds) in schema.ROLLUP_LEVELS.items():
+            key = (endpointID, floorTime(timeStamp, seconds))
+            agg = rollups[level].setdefault(key, emptyRollup())
+            agg[1] += (1 if new else 0) - (1 if old else 0)
+
+    try:
+        with session() as (cnx, cursor):
+            for anomaly in (True, False):
+                acqIDs = [row[0] for row in changed if bool(row[4]) == anomaly]
+                for i in range(0, len(acqIDs), 1000):
+                    chunk = acqIDs[i:i + 1000]
+                    cursor.execute(f"UPDATE acquisition SET anomaly = %s WHERE acqID IN \
+                                     ({', '.join(['%s'] * len(chunk))})", [anomaly] + chunk)
+            upsertRollups(cnx, rollups)
+            cnx.commit()
+        return True
+
+    except Error as e:
         print(e)
+        return False
+
+
+def queryCompact(table, column, horizon, batch=1000):
+    '''
+    Delete up to batch rows of table where column < horizon, oldest first.
+    Returns the number of deleted rows (None on errors)
+    '''
+    key = "acqID" if table == "acquisition" else "endpointID, bucket"
+    try:
+        with session() as (cnx, cursor):
+            cursor.execute(f"SELECT {key} FROM {table} WHERE {column} < %s \
+                             ORDER BY {column} LIMIT {int(batch)}", [horizon])
+            keys = cursor.fetchall()
+            if keys and table == "acquisition":
+                cursor.execute(f"DELETE FROM acquisition WHERE acqID IN \
+                                 ({', '.join(['%s'] * len(keys))})", [k[0] for k in keys])
+            elif keys:
+                cursor.executemany(f"DELETE FROM {table} WHERE endpointID = %s AND bucket = %s", keys)
+            cnx.commit()
+        return len(keys)
+
+    except Error as e:
+        print(e)
+        return None
 
 
 def queryUpdate(table, column, newValue, pKey, pValue):
@@ -96,67 +434,311 @@ def queryUpdate(table, column, newValue, pKey, pValue):
     values = (newValue, pValue)
 
     try:
-        cnx, cursor = connect()
-        cursor.execute(query, values)
-        cnx.commit()
-        disconnect(cnx, cursor)
+        with session(query) as (cnx, cursor):
+            cursor.execute(query, values)
+            cnx.commit()
+        invalidate(table, pKey, pValue)
         return True
 
-    except mysql.connector.Error as e:
+    except Error as e:
         print(e)
         return False
 
 
-def extractJsonAcq(jsonData):
+def cachedSelectLast(endpointID):
     '''
-    Extract JSON data and return acquisition Fields and Values\n
-    Important: anomaly value returned as NULL by default
+    Last acquisition of an endpoint through the latest cache
+    '''
+    return _latestCache.get(endpointID,
+                            lambda: querySelectLastFrom("acquisition", "acqID", "endpointID", endpointID))
+
+
+def setLast(endpointID, acqID, fields, values):
+    '''
+    New last acquisition of an endpoint (just inserted), with the types
+    the database returns
+    '''
+    row = dict(zip(fields, values))
+    row['acqID'] = acqID
+    if isinstance(row.get('timeStamp'), str):
+        row['timeStamp'] = datetime.fromisoformat(row['timeStamp'])
+    if isinstance(row.get('anomaly'), bool):
+        row['anomaly'] = int(row['anomaly'])
+    _latestCache.set(endpointID, [{f: row.get(f) for f in getColumns("acquisition")}])
+
+
+def invalidateLast(endpointID=None):
+    _latestCache.invalidate(endpointID)
+
+
+def querySelectAfter(table, pKey, afterID, size):
     '''
-    query = "SHOW COLUMNS FROM acquisition"
+    Query: SELECT * FROM table WHERE pKey > afterID ORDER BY pKey LIMIT size
+    Keyset pages of a table: list of tuples
+    '''
+    query = f"SELECT * FROM {table} WHERE {pKey} > (%s) ORDER BY {pKey} LIMIT {int(size)}"
     try:
-        cnx, cursor = connect()
-        cursor.execute(query)
+        with session(query) as (cnx, cursor):
+            cursor.execute(query, [afterID])
+            return cursor.fetchall()
 
-        # Return only field names
-        fields = list(map(lambda x:x[0], cursor.fetchall()))
-        disconnect(cnx, cursor)
+    except Error as e:
+        print(e)
+        return []
 
-        # Remove 'AcqID' because it's AUTO INCREMENTED
-        fields.pop(0)
 
-        endpointID  = jsonData['endpointID']
-        timeStamp   = jsonData['timeStamp']
-        values      = [endpointID, None, timeStamp]
+def querySelectEquipAcq(equipID, columns, afterID, size):
+    '''
+    Query:  SELECT acqID, columnA, ... FROM acquisition
+            WHERE endpointID IN (SELECT macID FROM endpoint WHERE equipID = equipID)
+            AND acqID > afterID ORDER BY acqID LIMIT size
+    Keyset pages of the acquisitions of an equipment: list of tuples
+    '''
+    query = f"SELECT acqID, {', '.join(columns)} FROM acquisition    \
+            WHERE endpointID IN (                                   \
+                SELECT macID FROM endpoint WHERE equipID = (%s))    \
+            AND acqID > (%s) ORDER BY acqID LIMIT {int(size)}"
+    values = [equipID, afterID]
+    try:
+        with session(query) as (cnx, cursor):
+            cursor.execute(query, values)
+            return cursor.fetchall()
 
-        for axis in ('x','y','z'):
-            axisrms     = jsonData[axis]['rms']
-            axiscf      = jsonData[axis]['cf']
-            axisfreq    = jsonData[axis]['freq']
-            axisamp     = jsonData[axis]['amp']
-            values.extend([axisrms, axiscf, axisfreq, axisamp])
+    except Error as e:
+        print(e)
+        return []
 
-        return (fields, values)
 
-    except mysql.connector.Error as e:
+def querySelectLastEquipAcq(equipID):
+    '''
+    Query:  SELECT MAX(acqID) FROM acquisition
+            WHERE endpointID IN (SELECT macID FROM endpoint WHERE equipID = equipID)
+    Last acquisition of an equipment (0 without acquisitions, None on errors)
+    '''
+    query = "SELECT MAX(acqID) FROM acquisition WHERE endpointID IN (   \
+                SELECT macID FROM endpoint WHERE equipID = (%s))"
+    try:
+        with session(query) as (cnx, cursor):
+            cursor.execute(query, [equipID])
+            return cursor.fetchall()[0][0] or 0
+
+    except Error as e:
         print(e)
-        return ((),())
+        return None
 
 
-def makeCSVfile(table, column, value, size):
+def queryCountTraining(equipID, count, size, retry, stale):
     '''
-    Make a csv file from a query with specific size
-    '''    
-    query = f"(SELECT * FROM {table} WHERE {column} = (%s) \
-             ORDER BY acqID DESC LIMIT {size}) ORDER BY acqID"
+    Add count acquisitions to the training progress of an equipment (shared
+    by every webservice worker) and claim its training when size is reached
+    and no job holds it: never trained, done or cancelled, failed more than
+    retry seconds ago, or a job silent for stale seconds (its process died).
+    Returns True only for the caller that claimed it
+    '''
+    now = datetime.now()
+    try:
+        with session() as (cnx, cursor):
+            # the row stays locked until commit: one claim per dataset
+            cursor.execute(_engine.upsert("training_state", ("equipID",), ("equipID", "count"), {"count": "add"}),
+                           (equipID, count))
+            cursor.execute("UPDATE training_state SET jobID = NULL, status = 'claimed', error = NULL, updated = %s \
+                            WHERE equipID = %s AND count >= %s AND (                            \
+                                status IS NULL OR status IN ('done', 'cancelled')              \
+                                OR (status = 'failed' AND updated < %s)                         \
+                                OR (status IN ('claimed', 'queued', 'running', 'cancelling', 'saving') \
+                                    AND updated < %s))",
+                           (now, equipID, size, now - timedelta(seconds=retry), now - timedelta(seconds=stale)))
+            claimed = cursor.rowcount == 1
+            cnx.commit()
+        return claimed
+
+    except Error as e:
+        print(e)
+        return False
+
+
+def queryLease(name, owner, seconds):
+    '''
+    Take or renew the lease of a background task for seconds: True when
+    owner holds it (free, expired or already its own), False when another
+    process does. Hosts must keep their clocks in sync
+    '''
+    now = datetime.now()
+    try:
+        with session() as (cnx, cursor):
+            cursor.execute("UPDATE lease SET owner = %s, expires = %s \
+                            WHERE name = %s AND (owner = %s OR expires < %s)",
+                           (owner, now + timedelta(seconds=seconds), name, owner, now))
+            held = cursor.rowcount == 1
+            if not held:
+                cursor.execute("SELECT owner FROM lease WHERE name = %s", (name,))
+                if not cursor.fetchall():
+                    # two first takers: the primary key keeps one
+                    cursor.execute("INSERT INTO lease (name, owner, expires) VALUES (%s, %s, %s)",
+                                   (name, owner, now + timedelta(seconds=seconds)))
+                    held = True
+            cnx.commit()
+        return held
+
+    except Error as e:
+        print(e)
+        return False
+
+
+def queryTrainingState(equipID, jobID=None, status=None):
+    '''
+    Set the training job and status of an equipment (with jobID), or
+    return its training progress
+    '''
+    try:
+        with session() as (cnx, cursor):
+            if jobID is not None:
+                cursor.execute("UPDATE training_state SET jobID = %s, status = %s, updated = %s \
+                                WHERE equipID = %s", (jobID, status, datetime.now(), equipID))
+                cnx.commit()
+                return True
+            cursor.execute("SELECT * FROM training_state WHERE equipID = %s", (equipID,))
+            return fetchAll(cursor)
+
+    except Error as e:
+        print(e)
+        return False if jobID is not None else []
+
+
+def queryTrainingJob(jobID, status=None, current=None, error=None):
+    '''
+    Training state of the equipment trained by a job ([] if unknown), or,
+    with status, set the status of the job when it is one of current
+    (any status when None). A done or cancelled job resets the training
+    progress. Returns True when the job was updated
+    '''
+    try:
+        with session() as (cnx, cursor):
+            if status is None:
+                cursor.execute("SELECT * FROM training_state WHERE jobID = %s", (jobID,))
+                return fetchAll(cursor)
+
+            query  = "UPDATE training_state SET status = %s, error = %s, updated = %s"
+            values = [status, error, datetime.now()]
+            if status in ('done', 'cancelled'):
+                query += ", count = 0"
+            query += " WHERE jobID = %s"
+            values.append(jobID)
+            if current is not None:
+                query += f" AND status IN ({', '.join(['%s'] * len(current))})"
+                values.extend(current)
+            cursor.execute(query, values)
+            updated = cursor.rowcount == 1
+            cnx.commit()
+        return updated
+
+    except Error as e:
+        print(e)
+        return False if status is not None else []
+
+
+def querySelectJobs():
+    '''
+    Training state of the equipments with a training job
+    '''
+    try:
+        with session() as (cnx, cursor):
+            cursor.execute("SELECT * FROM training_state WHERE jobID IS NOT NULL ORDER BY updated")
+            return fetchAll(cursor)
+
+    except Error as e:
+        print(e)
+        return []
+
+
+def extractJsonAcq(jsonData):
+    '''
+    Extract JSON data and return acquisition Fields and Values\n
+    Important: anomaly value returned as NULL by default.
+    Raises KeyError (missing field), ValueError or TypeError (malformed
+    timeStamp or feature): nothing invalid reaches the database
+    '''
+    # Return only field names
+    fields = getColumns("acquisition")
+
+    # Remove 'AcqID' because it's AUTO INCREMENTED
+    fields.pop(0)
+
+    endpointID  = jsonData['endpointID']
+    timeStamp   = parseTimeStamp(jsonData['timeStamp'])
+    values      = [endpointID, None, timeStamp]
+
+    for axis in ('x','y','z'):
+        for feature in ('rms', 'cf', 'freq', 'amp'):
+            values.append(parseFeature(jsonData[axis][feature]))
+
+    return (fields, values)
+
+
+def parseTimeStamp(value):
+    '''
+    Acquisition time sent by the gateways: 'YYYY-MM-DD HH:MM:SS' (local,
+    no time zone). Raises ValueError or TypeError
+    '''
+    timeStamp = datetime.fromisoformat(value)
+    if timeStamp.tzinfo is not None:
+        raise ValueError(f"Time zone not supported: {value}")
+    return timeStamp
+
+
+def parseFeature(value):
+    '''
+    Feature value: a finite number, or None (not measured). Raises ValueError
+    '''
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not np.isfinite(value):
+        raise ValueError(f"Invalid feature value: {value!r}")
+    return float(value)
+
+
+def queryTrainingData(column, value, features, size=None, start=None, end=None, chunk=TRAINING_CHUNK):
+    '''
+    Training dataset: the features columns of the last size acquisitions
+    where column = value, of an equipment for column equipID (optionally timeStamp in [start, end)), streamed
+    from the cursor in chunks into a preallocated (N, len(features))
+    float array
+    '''
+    if column == "equipID":
+        # acquisitions of every endpoint of the equipment
+        where = "endpointID IN (SELECT macID FROM endpoint WHERE equipID = (%s))"
+    else:
+        where = f"{column} = (%s)"
     values = [value]
+    if start is not None:
+        where += " AND timeStamp >= (%s)"
+        values.append(start)
+    if end is not None:
+        where += " AND timeStamp < (%s)"
+        values.append(end)
+    limit = f"LIMIT {int(size)}" if size else ""
+
     try:
-        cnx, cursor = connect()
-        cursor.execute(query, values)
-        with open("query.csv", "w", newline='') as csv_file:
-	        writer = csv.writer(csv_file)
-	        writer.writerow([i[0] for i in cursor.description])
-	        writer.writerows(cursor)
-        disconnect(cnx, cursor)
+        # one transaction: the count and the rows come from the same snapshot
+        with session() as (cnx, cursor):
+            cursor.execute(f"SELECT COUNT(*) FROM acquisition WHERE {where}", values)
+            rows = cursor.fetchall()[0][0]
+            rows = min(rows, int(size)) if size else rows
+            data = np.empty((rows, len(features)), dtype=np.float64)
+
+            cursor.execute(f"SELECT {', '.join(features)} FROM acquisition WHERE {where} \
+                             ORDER BY acqID DESC {limit}", values)
+            n = 0
+            while True:
+                batch = cursor.fetchmany(chunk)
+                if not batch:
+                    break
+                batch = batch[:rows - n]
+                data[n:n + len(batch)] = np.array(batch, dtype=np.float64)
+                n += len(batch)
+            cnx.rollback()
+        return data[:n]
 
-    except mysql.connector.Error as e:
-        print(e)
\ No newline at end of file
+    except Error as e:
+        print(e)
+        return np.empty((0, len(features)), dtype=np.float64)
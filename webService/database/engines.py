@@ -0,0 +1,276 @@
+import sqlite3
+import threading
+import weakref
+from datetime import datetime
+
+try:
+    import mysql.connector
+    from mysql.connector import pooling
+except ImportError:     # SQLite only installs
+    mysql = None
+
+
+#####################################################################
+# MYSQL
+#####################################################################
+class PreparedCursor():
+    '''
+    Prepared cursor of one query shape. The connector prepares again
+    whenever it gets another string object than the one it last ran (even
+    an equal one), so the query kept here is the one always executed
+    '''
+    def __init__(self, cursor, query):
+        self.cursor = cursor
+        self.query  = query
+
+    def execute(self, query, values=()):
+        return self.cursor.execute(self.query if query == self.query else query, values)
+
+    def __getattr__(self, name):
+        # fetchone, fetchall, description, rowcount, lastrowid, close...
+        return getattr(self.cursor, name)
+
+
+class MySQLEngine():
+    '''
+    MySQL server through a mysql.connector pool. Queries that are run
+    with a fixed shape get a prepared cursor, reused while the connection
+    lives
+    '''
+    Error   = mysql.connector.Error if mysql else Exception
+    TYPES   = {'id':    'INT NOT NULL AUTO_INCREMENT PRIMARY KEY',
+               'key':   'VARCHAR(32)',
+               'bool':  'BOOLEAN',
+               'int':   'INT',
+               'float': 'DOUBLE',
+               'time':  'DATETIME',
+               'text':  'VARCHAR(32)',
+               'message': 'VARCHAR(255)'}
+
+    def __init__(self, config, poolSize=5, poolTimeout=10):
+        '''
+        @config: mysql.connector connection arguments
+        @poolSize: connections in the pool
+        @poolTimeout: seconds waiting for a free connection
+        '''
+        if mysql is None:
+            raise ImportError("mysql-connector-python is required by the MySQL engine")
+        self.config         = config
+        self.poolSize       = poolSize
+        self.poolTimeout    = poolTimeout
+        self.pool           = None
+        self.poolLock       = threading.Lock()
+        self.poolSlots      = threading.BoundedSemaphore(poolSize)
+        self.statements     = weakref.WeakKeyDictionary()  # connection -> (connection id, {query: PreparedCursor})
+
+
+    def getPool(self):
+        with self.poolLock:
+            if self.pool is None:
+                # sessions are not reset when returned: prepared statements survive
+                self.pool = pooling.MySQLConnectionPool(pool_name = "vibranium",
+                                                        pool_size = self.poolSize,
+                                                        pool_reset_session = False,
+                                                        **self.config)
+        return self.pool
+
+
+    def connect(self, query=None):
+        '''
+        Borrow a connection from the pool (the pool reconnects dropped ones).
+        With query: returns the prepared cursor of this query shape
+        '''
+        if not self.poolSlots.acquire(timeout=self.poolTimeout):
+            raise pooling.PoolError("No connection available in the pool")
+        try:
+            cnx = self.getPool().get_connection()
+            if query is None:
+                return (cnx, cnx.cursor())
+
+            # prepared statements live in the server session: a connection
+            # reconnected by the pool (new connection id) lost them
+            real = getattr(cnx, '_cnx', cnx)
+            (connectionID, statements) = self.statements.get(real, (None, None))
+            if statements is None or connectionID != real.connection_id:
+                statements = dict()
+                self.statements[real] = (real.connection_id, statements)
+            if query not in statements:
+                statements[query] = PreparedCursor(cnx.cursor(prepared = True), query)
+            return (cnx, statements[query])
+
+        except Exception:
+            self.poolSlots.release()
+            raise
+
+
+    def disconnect(self, cnx, cursor):
+        try:
+            if not isinstance(cursor, PreparedCursor):
+                cursor.close()
+            # autocommit is off and sessions are not reset: end the
+            # transaction of read-only helpers, or the next borrower
+            # reads this REPEATABLE READ snapshot
+            try:
+                cnx.rollback()
+            except mysql.connector.Error:
+                pass
+            cnx.close()     # pooled connection: back to the pool
+        finally:
+            self.poolSlots.release()
+
+
+    def transient(self, error):
+        '''
+        True when a query may succeed if retried: server unreachable, pool
+        exhausted, lock wait timeout (1205) or deadlock (1213)
+        '''
+        return (isinstance(error, (mysql.connector.errors.OperationalError,
+                                   mysql.connector.errors.InterfaceError,
+                                   pooling.PoolError))
+                or getattr(error, 'errno', None) in (1205, 1213))
+
+
+    #################################################################
+    # DIALECT
+    #################################################################
+    def createIndex(self, cursor, name, table, columns):
+        try:
+            cursor.execute(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})")
+        except mysql.connector.Error as e:
+            if e.errno != 1061:     # ER_DUP_KEYNAME: already there
+                raise
+
+
+    def timeBucket(self, column):
+        '''
+        SQL: bucket number of a time column, parameters (start, width in
+        seconds)
+        '''
+        return f"TIMESTAMPDIFF(SECOND, %s, {column}) DIV %s"
+
+
+    def upsert(self, table, keys, columns, updates):
+        '''
+        SQL: insert a row, or merge it into the existing row with the same
+        keys. updates: {column: 'add' | 'min' | 'max'}
+        '''
+        merge = {'add': "{c} = {c} + VALUES({c})",
+                 'min': "{c} = LEAST(COALESCE({c}, VALUES({c})), COALESCE(VALUES({c}), {c}))",
+                 'max': "{c} = GREATEST(COALESCE({c}, VALUES({c})), COALESCE(VALUES({c}), {c}))"}
+        updates = ", ".join(merge[op].format(c=c) for (c, op) in updates.items())
+        return (f"INSERT INTO {table} ({', '.join(columns)}) "
+                f"VALUES ({', '.join(['%s'] * len(columns))}) "
+                f"ON DUPLICATE KEY UPDATE {updates}")
+
+
+    def cursor(self, cnx):
+        '''
+        Plain cursor of a borrowed connection
+        '''
+        return cnx.cursor()
+
+
+
+#####################################################################
+# SQLITE
+#####################################################################
+class SQLiteCursor():
+    '''
+    sqlite3 cursor accepting the %s placeholders of the MySQL queries
+    '''
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, query, values=()):
+        self.cursor.execute(query.replace('%s', '?'), tuple(values))
+        return self
+
+    def executemany(self, query, rows):
+        self.cursor.executemany(query.replace('%s', '?'), rows)
+        return self
+
+    def __getattr__(self, name):
+        # fetchone, fetchmany, fetchall, description, rowcount, lastrowid...
+        return getattr(self.cursor, name)
+
+
+class SQLiteEngine():
+    '''
+    Embedded SQLite database file (WAL journal): one connection per
+    thread, sqlite3 caches the compiled statements
+    '''
+    Error   = sqlite3.Error
+    TYPES   = {'id':    'INTEGER PRIMARY KEY AUTOINCREMENT',
+               'key':   'VARCHAR(32)',
+               'bool':  'BOOLEAN',
+               'int':   'INTEGER',
+               'float': 'DOUBLE',
+               'time':  'TIMESTAMP',
+               'text':  'VARCHAR(32)',
+               'message': 'TEXT'}
+
+    def __init__(self, path, timeout=10):
+        '''
+        @path: database file
+        @timeout: seconds waiting for a lock held by another writer
+        '''
+        self.path       = path
+        self.timeout    = timeout
+        self.local      = threading.local()
+
+        # times stored as 'YYYY-MM-DD HH:MM:SS' text, read back as datetime
+        sqlite3.register_adapter(datetime, lambda t: t.isoformat(' '))
+        sqlite3.register_converter('TIMESTAMP', lambda t: datetime.fromisoformat(t.decode()))
+
+
+    def connect(self, query=None):
+        cnx = getattr(self.local, 'cnx', None)
+        if cnx is None:
+            cnx = sqlite3.connect(self.path, timeout = self.timeout,
+                                  detect_types = sqlite3.PARSE_DECLTYPES,
+                                  cached_statements = 256)
+            cnx.execute("PRAGMA journal_mode = WAL")
+            cnx.execute("PRAGMA synchronous = NORMAL")
+            self.local.cnx = cnx
+        return (cnx, SQLiteCursor(cnx.cursor()))
+
+
+    def disconnect(self, cnx, cursor):
+        cursor.close()      # the connection stays open for this thread
+        if cnx.in_transaction:
+            cnx.rollback()  # uncommitted work never outlives its session
+
+
+    def transient(self, error):
+        '''
+        True when a query may succeed if retried: database locked or busy
+        (no such table, syntax errors... are OperationalError too)
+        '''
+        message = str(error).lower()
+        return (isinstance(error, sqlite3.OperationalError)
+                and ('locked' in message or 'busy' in message))
+
+
+    #################################################################
+    # DIALECT
+    #################################################################
+    def createIndex(self, cursor, name, table, columns):
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+
+
+    def timeBucket(self, column):
+        return f"CAST((julianday({column}) - julianday(%s)) * 86400 + 0.5 AS INTEGER) / %s"
+
+
+    def upsert(self, table, keys, columns, updates):
+        merge = {'add': "{c} = {c} + excluded.{c}",
+                 'min': "{c} = MIN(COALESCE({c}, excluded.{c}), COALESCE(excluded.{c}, {c}))",
+                 'max': "{c} = MAX(COALESCE({c}, excluded.{c}), COALESCE(excluded.{c}, {c}))"}
+        updates = ", ".join(merge[op].format(c=c) for (c, op) in updates.items())
+        return (f"INSERT INTO {table} ({', '.join(columns)}) "
+                f"VALUES ({', '.join(['%s'] * len(columns))}) "
+                f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates}")
+
+
+    def cursor(self, cnx):
+        return SQLiteCursor(cnx.cursor())
@@ -0,0 +1,110 @@
+import os
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from database import db
+
+
+# days kept per table (unset: kept forever)
+RETENTION = {'acquisition':         os.environ.get('VIBRANIUM_RAW_DAYS'),
+             'acquisition_minute':  os.environ.get('VIBRANIUM_MINUTE_DAYS'),
+             'acquisition_hour':    os.environ.get('VIBRANIUM_HOUR_DAYS')}
+TIME_COLUMN = {'acquisition': 'timeStamp'}  # rollups: bucket
+LEASE       = 'retention'   # one webservice process compacts (db.queryLease)
+
+
+class Retention(threading.Thread):
+    '''
+    This thread compacts the tables with a retention horizon: rows older
+    than it are deleted in batches of batchSize, pausing between batches
+    so compaction never holds the database for long. Every webservice
+    process runs one; only the holder of the retention lease compacts,
+    another takes over when it stops renewing it
+    '''
+    def __init__(self, horizons=None, batchSize=1000, pause=0.1, interval=3600):
+        '''
+        @horizons: {table: days} (default RETENTION)
+        @batchSize: rows deleted per transaction
+        @pause: seconds between two batches
+        @interval: seconds between two compactions
+        '''
+        super().__init__(daemon=True)
+        if horizons is None:
+            horizons = {table: int(days) for (table, days) in RETENTION.items() if days}
+        self.horizons   = horizons
+        self.batchSize  = batchSize
+        self.pause      = pause
+        self.interval   = interval
+        self.owner      = uuid.uuid4().hex
+        self.stopped    = threading.Event()
+
+
+    def lease(self):
+        '''
+        Take or renew the retention lease: held until the next compaction
+        '''
+        return db.queryLease(LEASE, self.owner, 2 * self.interval)
+
+
+    def compact(self, lease=True):
+        '''
+        Delete the expired rows of every table, returns {table: rows}
+        (nothing while another process holds the lease)
+        @lease: False to compact without the lease (manual compaction)
+        '''
+        deleted = dict()
+        for (table, days) in self.horizons.items():
+            horizon = datetime.now() - timedelta(days=days)
+            column  = TIME_COLUMN.get(table, 'bucket')
+            deleted[table] = 0
+            # renewed between batches: a long compaction keeps it
+            while not self.stopped.is_set() and (not lease or self.lease()):
+                count = db.queryCompact(table, column, horizon, self.batchSize)
+                if not count:
+                    break
+                deleted[table] += count
+                time.sleep(self.pause)
+        return deleted
+
+
+    def run(self):
+        while not self.stopped.is_set():
+            if self.lease():
+                print(f"Retention: {self.compact()}")
+            self.stopped.wait(self.interval)
+
+
+    def stop(self):
+        self.stopped.set()
+
+
+
+def backfill(batchSize=5000):
+    '''
+    Build the rollups of acquisitions stored before they existed (run
+    once, on empty rollup tables)
+    '''
+    fields = db.getColumns("acquisition")
+    (lastID, count) = (0, 0)
+    while True:
+        rows = db.querySelectAfter("acquisition", "acqID", lastID, batchSize)
+        if not rows:
+            break
+        with db.session() as (cnx, cursor):
+            db.updateRollups(cnx, fields, rows)
+            cnx.commit()
+        lastID = rows[-1][0]
+        count += len(rows)
+    print(f"Backfill: {count} acquisitions rolled up")
+
+
+# python -m database.retention backfill | compact
+if __name__ == "__main__":
+    if sys.argv[1:] == ['backfill']:
+        backfill()
+    elif sys.argv[1:] == ['compact']:
+        print(Retention().compact(lease=False))
+    else:
+        print("usage: python -m database.retention backfill | compact")
@@ -0,0 +1,87 @@
+'''
+Tables of the webservice, shared by every storage engine: column types
+are engine independent names (see the TYPES of each engine)
+'''
+
+ROLLUP_LEVELS   = {'minute': 60, 'hour': 3600, 'day': 86400}    # acquisition_<level>: seconds per bucket
+ROLLUP_FEATURES = ['xrms', 'xcf', 'yrms', 'ycf', 'zrms', 'zcf']
+ROLLUP_AGGS     = ('min', 'sum', 'max', 'count')    # per feature: count of its non-NULL values
+
+
+TABLES = {
+    'station':      [('macStationID',   'key',      'NOT NULL PRIMARY KEY')],
+
+    'equipment':    [('equipID',        'key',      'NOT NULL PRIMARY KEY'),
+                     ('InTraining',     'bool',     'NOT NULL DEFAULT FALSE'),
+                     ('modelType',      'text',     'NULL')],    # NULL: OCSVM, 'online': ML.online
+
+    'endpoint':     [('macID',          'key',      'NOT NULL PRIMARY KEY'),
+                     ('equipID',        'key',      'NULL'),
+                     ('macStationID',   'key',      'NULL')],
+
+    # column order matters: see db.extractJsonAcq and ML.FEATURE_INDEX
+    'acquisition':  [('acqID',          'id',       ''),
+                     ('endpointID',     'key',      'NOT NULL'),
+                     ('anomaly',        'bool',     'NULL'),
+                     ('timeStamp',      'time',     'NOT NULL')] +
+                    [(f'{axis}{feature}', 'float',  'NULL')
+                     for axis in ('x','y','z') for feature in ('rms', 'cf', 'freq', 'amp')],
+
+    'training_state': [('equipID',      'key',      'NOT NULL PRIMARY KEY'),
+                       ('count',        'int',      'NOT NULL DEFAULT 0'),
+                       ('jobID',        'text',     'NULL'),
+                       ('status',       'text',     'NULL'),
+                       ('error',        'message',  'NULL'),
+                       ('updated',      'time',     'NULL')],
+
+    # background tasks run by one process at a time (see db.queryLease)
+    'lease':        [('name',           'key',      'NOT NULL PRIMARY KEY'),
+                     ('owner',          'key',      'NOT NULL'),
+                     ('expires',        'time',     'NOT NULL')],
+}
+
+# ROLLUPS: per endpoint and bucket, avg = <feature>_sum / <feature>_count
+for level in ROLLUP_LEVELS:
+    TABLES[f'acquisition_{level}'] = [('endpointID', 'key',    'NOT NULL'),
+                                      ('bucket',     'time',   'NOT NULL'),
+                                      ('count',      'int',    'NOT NULL DEFAULT 0'),
+                                      ('anomalies',  'int',    'NOT NULL DEFAULT 0')] + \
+                                     [(f'{feature}_{agg}', 'int', 'NOT NULL DEFAULT 0') if agg == 'count' else
+                                      (f'{feature}_{agg}', 'float', 'NULL')
+                                      for feature in ROLLUP_FEATURES for agg in ROLLUP_AGGS]
+
+# composite primary keys
+KEYS = {f'acquisition_{level}': ('endpointID', 'bucket') for level in ROLLUP_LEVELS}
+
+INDEXES = [
+    # range queries of an endpoint (dashboards, training windows)
+    ('acqEndpointTime',     'acquisition',  ('endpointID', 'timeStamp')),
+    # last acquisition of an endpoint (db.querySelectLastFrom)
+    ('acqEndpointID',       'acquisition',  ('endpointID', 'acqID')),
+    ('endpointEquipment',   'endpoint',     ('equipID',)),
+    # retention: oldest rows first (database.retention)
+    ('acqTime',             'acquisition',  ('timeStamp',)),
+] + [(f'{level}Bucket', f'acquisition_{level}', ('bucket',)) for level in ROLLUP_LEVELS]
+
+
+def statements(engine):
+    '''
+    CREATE TABLE IF NOT EXISTS statements of every table for an engine
+    '''
+    for (table, columns) in TABLES.items():
+        definitions = ", ".join(f"{name} {engine.TYPES[kind]} {options}".strip()
+                                for (name, kind, options) in columns)
+        if table in KEYS:
+            definitions += f", PRIMARY KEY ({', '.join(KEYS[table])})"
+        yield f"CREATE TABLE IF NOT EXISTS {table} ({definitions})"
+
+
+def addColumn(engine, table, column):
+    '''
+    ALTER TABLE statement adding a column of TABLES to an existing table
+    (created before the column was)
+    '''
+    for (name, kind, options) in TABLES[table]:
+        if name == column:
+            return f"ALTER TABLE {table} ADD COLUMN {name} {engine.TYPES[kind]} {options}".strip()
+    raise KeyError(column)
@@ -0,0 +1,148 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from database import db
+
+
+DEAD_LETTER = os.environ.get('VIBRANIUM_DEAD_LETTER', 'deadletter.jsonl')  # rows the database refused
+
+
+class WriteBehind(threading.Thread):
+    '''
+    Write-behind buffer: validated rows are queued in memory and inserted
+    by this thread in grouped multi-row transactions (db.insertMany),
+    when batchSize rows are waiting or every interval seconds.
+    put() refuses rows when maxSize rows are already waiting or being
+    written (backpressure). Transient database errors are retried; a
+    batch failing otherwise is split until the rows the database refuses
+    are isolated, and those are appended to the deadLetter file (JSON lines)
+    '''
+    def __init__(self, table, maxSize=10000, batchSize=500, interval=0.5, retry=1.0,
+                 deadLetter=DEAD_LETTER):
+        '''
+        @table: table the rows are inserted into
+        @maxSize: rows waiting in memory at most
+        @batchSize: rows per transaction
+        @interval: seconds a row may wait for its batch
+        @retry: seconds between attempts when the database fails
+        @deadLetter: file of the rows that could not be inserted
+        '''
+        super().__init__(daemon=True)
+        self.table      = table
+        self.maxSize    = maxSize
+        self.batchSize  = batchSize
+        self.interval   = interval
+        self.retry      = retry
+        self.deadLetter = deadLetter
+        self.pending    = deque()   # (endpointID, fields, values)
+        self.inflight   = 0         # rows taken from pending, not written yet
+        self.cond       = threading.Condition()
+        self.stopping   = False
+
+
+    def put(self, fields, rows):
+        '''
+        Queue rows: list of (endpointID, values), all or none.
+        Returns False when the buffer is full
+        '''
+        fields = tuple(fields)
+        with self.cond:
+            if self.stopping or len(self.pending) + self.inflight + len(rows) > self.maxSize:
+                return False
+            self.pending.extend((endpointID, fields, tuple(values)) for (endpointID, values) in rows)
+            if len(self.pending) >= self.batchSize:
+                self.cond.notify()
+        return True
+
+
+    def run(self):
+        while True:
+            with self.cond:
+                if not self.pending and self.stopping:
+                    break
+                if len(self.pending) < self.batchSize and not self.stopping:
+                    self.cond.wait(self.interval)
+                count = min(self.batchSize, len(self.pending))
+                batch = [self.pending.popleft() for i in range(count)]
+                self.inflight = count
+            try:
+                if batch:
+                    self.write(batch)
+            except Exception as e:
+                # the thread outlives any batch
+                print(f"Write-behind: {e}")
+                self.reject(batch, e)
+            finally:
+                with self.cond:
+                    self.inflight = 0
+
+
+    def write(self, batch):
+        '''
+        Insert a batch: one transaction per set of columns
+        '''
+        groups = dict()
+        for item in batch:
+            groups.setdefault(item[1], []).append(item)
+
+        for (fields, items) in groups.items():
+            self.insert(fields, items)
+
+        # last acquisitions reloaded on the next GET
+        for endpointID in {item[0] for item in batch}:
+            db.invalidateLast(endpointID)
+
+
+    def insert(self, fields, items):
+        '''
+        Insert items (endpointID, fields, values) in one transaction:
+        retried while the error is transient and the writer runs, split in
+        halves otherwise; a single refused row is dead-lettered
+        '''
+        while True:
+            try:
+                db.insertMany(self.table, fields, [item[2] for item in items])
+                return
+            except Exception as e:
+                if isinstance(e, db.Error) and db.transient(e) and not self.stopping:
+                    # the full buffer pushes back on clients meanwhile
+                    print(f"Write-behind: {e}")
+                    time.sleep(self.retry)
+                    continue
+                error = e
+                break
+
+        if len(items) == 1 or (isinstance(error, db.Error) and db.transient(error)):
+            print(f"Write-behind: {len(items)} rows dead-lettered: {error}")
+            self.reject(items, error)
+            return
+        half = len(items) // 2
+        self.insert(fields, items[:half])
+        self.insert(fields, items[half:])
+
+
+    def reject(self, items, error):
+        '''
+        Append items (endpointID, fields, values) to the dead-letter file
+        '''
+        try:
+            with open(self.deadLetter, 'a') as f:
+                for (endpointID, fields, values) in items:
+                    f.write(json.dumps({'table': self.table, 'endpointID': endpointID,
+                                        'fields': fields, 'values': values,
+                                        'error': str(error)}, default=str) + "\n")
+        except OSError as e:
+            print(f"Write-behind: {len(items)} rows dropped: {e}")
+
+
+    def stop(self, timeout=None):
+        '''
+        Flush the waiting rows and stop
+        '''
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+        if self.is_alive():
+            self.join(timeout)
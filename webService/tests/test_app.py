@@ -0,0 +1,87 @@
+import os
+import subprocess
+import sys
+
+
+WEBSERVICE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(code, dbPath):
+    env = dict(os.environ, VIBRANIUM_DB_ENGINE='sqlite', VIBRANIUM_DB_PATH=str(dbPath))
+    subprocess.run([sys.executable, '-c', code], cwd=WEBSERVICE, env=env, check=True, timeout=60)
+
+
+def test_import_has_no_side_effects(tmp_path):
+    # spawned training processes import the app module again
+    run("import app", tmp_path / 'vibranium.db')
+    assert not (tmp_path / 'vibranium.db').exists()
+
+
+def test_create_app_bootstraps_the_database(tmp_path):
+    run("import app; app.createApp(); app.createApp()", tmp_path / 'vibranium.db')
+    assert (tmp_path / 'vibranium.db').exists()
+
+
+def test_acquisition_post_and_get(client, equipment, acquisition):
+    assert client.post('/v1/endpoints/EP01/acquisition', json=acquisition()).status_code == 200
+    response = client.get('/v1/endpoints/EP01/acquisition')
+    assert response.status_code == 200
+    assert response.json[0]['xrms'] == 0.35
+
+
+def test_training_flag_set_by_another_worker(client, equipment, acquisition, database):
+    assert client.post('/v1/endpoints/EP01/acquisition', json=acquisition()).status_code == 200
+
+    # another worker puts the equipment in training: nothing invalidated here
+    with database.session() as (cnx, cursor):
+        cursor.execute("UPDATE equipment SET InTraining = TRUE WHERE equipID = 'MT01'")
+        cnx.commit()
+
+    assert client.post('/v1/endpoints/EP01/acquisition', json=acquisition()).status_code == 200
+    assert client.post('/v1/acquisitions', json=[acquisition()]).json['status'] == [200]
+    assert database.queryTrainingState('MT01')[0]['count'] == 2
+
+
+def test_unknown_equipment(client, equipment, acquisition):
+    assert client.post('/v1/endpoints/EP01/acquisition', json=acquisition(equipID='MT99')).status_code == 404
+    assert client.post('/v1/acquisitions', json=[acquisition(equipID='MT99')]).json['status'] == [404]
+
+
+def test_last_acquisition_etag_follows_rescore(client, equipment, acquisition, database):
+    client.post('/v1/endpoints/EP01/acquisition', json=acquisition())
+    etag = client.get('/v1/endpoints/EP01/acquisition').headers['ETag']
+    assert client.get('/v1/endpoints/EP01/acquisition', headers={'If-None-Match': etag}).status_code == 304
+
+    with database.session() as (cnx, cursor):
+        cursor.execute("UPDATE acquisition SET anomaly = TRUE")
+        cnx.commit()
+    database.invalidateLast()
+    response = client.get('/v1/endpoints/EP01/acquisition', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.json[0]['anomaly'] == 1
+
+
+def test_malformed_acquisition_rejected(client, equipment, acquisition):
+    for bad in (acquisition(timeStamp='10/08/2021 12:00'), acquisition(timeStamp=1628596800),
+                acquisition(timeStamp='2021-08-10T12:00:00+00:00'), acquisition(rms='0.35'),
+                acquisition(cf=True)):
+        assert client.post('/v1/endpoints/EP01/acquisition', json=bad).status_code == 400
+
+    response = client.post('/v1/acquisitions', json=[acquisition(timeStamp='yesterday'), acquisition()])
+    assert response.status_code == 200
+    assert response.json['status'] == [400, 200]
+    assert client.get('/v1/endpoints/EP01/acquisition').json[0]['timeStamp'] is not None
+
+
+def test_last_acquisition_is_one_index_seek(client, equipment, acquisition, database):
+    for rms in (0.1, 0.2, 0.3):
+        client.post('/v1/endpoints/EP01/acquisition', json=acquisition(rms=rms))
+    database.invalidateLast()
+    assert database.cachedSelectLast('EP01')[0]['xrms'] == 0.3
+
+    with database.session() as (cnx, cursor):
+        cursor.execute("EXPLAIN QUERY PLAN SELECT * FROM acquisition WHERE endpointID = ? "
+                       "ORDER BY acqID DESC LIMIT 1", ['EP01'])
+        plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+    assert 'acqEndpointID' in plan
+    assert 'TEMP B-TREE' not in plan
@@ -0,0 +1,79 @@
+import os
+import sys
+import pytest
+
+# the gateway uploader posting to this webservice
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'gateway'))
+from gateway.Cloud import Uploader
+
+
+class ClientResponse():
+    def __init__(self, response):
+        self.status     = response.status_code
+        self.reason     = response.status
+        self.headers    = response.headers
+
+    def getheader(self, name):
+        return self.headers.get(name)
+
+
+class ClientCloud():
+    '''
+    gateway Cloud posting through the Flask test client
+    '''
+    def __init__(self, client):
+        self.client = client
+
+    def postJSON(self, cURL, data):
+        response = self.client.post(cURL, json=data)
+        return (ClientResponse(response), response.data)
+
+    def post(self, cURL, data):
+        return self.postJSON(cURL, data)[0]
+
+
+def count(database):
+    with database.session() as (cnx, cursor):
+        cursor.execute("SELECT COUNT(*) FROM acquisition")
+        return cursor.fetchall()[0][0]
+
+
+def test_failed_transaction_is_retried(client, equipment, acquisition, database, monkeypatch):
+    monkeypatch.setattr(database, 'queryInsertMany', lambda *args: False)
+    response = client.post('/v1/acquisitions', json=[acquisition(), acquisition()])
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+
+def test_single_insert_failure_is_retried(client, equipment, acquisition, database, monkeypatch):
+    monkeypatch.setattr(database, 'queryInsertInto', lambda *args: None)
+    response = client.post('/v1/endpoints/EP01/acquisition', json=acquisition())
+    assert response.status_code == 503
+
+
+def test_gateway_keeps_records_after_failed_insert(tmp_path, client, equipment, acquisition, database, monkeypatch):
+    uploader = Uploader(ClientCloud(client), str(tmp_path / 'outbox'), batchURL='/v1/acquisitions')
+    uploader.append([('/v1/endpoints/EP01/acquisition', acquisition()) for i in range(3)])
+
+    with monkeypatch.context() as m:
+        m.setattr(database, 'queryInsertMany', lambda *args: False)
+        assert not uploader.drain()
+    assert len(uploader.pending()) == 3
+    assert uploader.retryAfter == 1
+    assert count(database) == 0
+
+    assert uploader.drain()
+    assert uploader.pending() == []
+    assert count(database) == 3
+
+
+def test_write_behind_without_valid_rows(tmp_path, client, equipment, acquisition, monkeypatch):
+    import app
+    from database.writer import WriteBehind
+    writer = WriteBehind('acquisition', deadLetter=str(tmp_path / 'dead.jsonl'))
+    monkeypatch.setattr(app, 'writer', writer)
+
+    assert client.post('/v1/acquisitions', json=[]).json['status'] == []
+    assert client.post('/v1/acquisitions', json=[acquisition(equipID='MT99')]).json['status'] == [404]
+    assert client.post('/v1/acquisitions', json=[acquisition()]).json['status'] == [200]
+    assert len(writer.pending) == 1
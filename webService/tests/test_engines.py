@@ -0,0 +1,116 @@
+import sqlite3
+import pytest
+from database import engines
+
+
+class FakePrepared():
+    '''
+    As mysql.connector MySQLCursorPrepared: prepares again whenever the
+    operation is not the very object it last executed
+    '''
+    def __init__(self, real):
+        self.real       = real
+        self.executed   = None
+
+    def execute(self, operation, params=None):
+        if operation is not self.executed:
+            self.real.prepares += 1
+            self.executed = operation
+
+    def close(self):
+        pass
+
+
+class FakeConnection():
+    def __init__(self):
+        self.connection_id  = 1
+        self.prepares       = 0
+        self.rollbacks      = 0
+
+    def cursor(self, prepared=False):
+        return FakePrepared(self)
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class FakePooled():
+    def __init__(self, real):
+        self._cnx = real
+
+    def __getattr__(self, name):
+        return getattr(self._cnx, name)
+
+    def cursor(self, prepared=False):
+        return self._cnx.cursor(prepared)
+
+    def close(self):
+        pass
+
+
+class FakePool():
+    def __init__(self):
+        self.real = FakeConnection()
+
+    def get_connection(self):
+        return FakePooled(self.real)
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    engine = engines.MySQLEngine({}, poolSize=1)
+    pool   = FakePool()
+    monkeypatch.setattr(engine, 'getPool', lambda: pool)
+    return engine
+
+
+def select(engine, table):
+    # as the db helpers: a new query string on every call
+    query = f"SELECT * FROM {table} WHERE equipID = (%s)"
+    (cnx, cursor) = engine.connect(query)
+    try:
+        cursor.execute(query, ('MT01',))
+    finally:
+        engine.disconnect(cnx, cursor)
+    return cnx._cnx
+
+
+def test_statement_prepared_once(engine):
+    for i in range(3):
+        real = select(engine, 'equipment')
+    assert real.prepares == 1
+
+
+def test_reconnected_connection_prepares_again(engine):
+    real = select(engine, 'equipment')
+    real.connection_id = 2      # reconnected by the pool: statements gone
+    select(engine, 'equipment')
+    select(engine, 'equipment')
+    assert real.prepares == 2
+
+
+def test_read_snapshot_ended_before_returning_the_connection(engine):
+    real = select(engine, 'equipment')
+    assert real.rollbacks == 1
+
+
+def test_sqlite_uncommitted_work_rolled_back(tmp_path):
+    engine = engines.SQLiteEngine(str(tmp_path / 'vibranium.db'))
+    (cnx, cursor) = engine.connect()
+    cursor.execute("CREATE TABLE t (a INTEGER)")
+    cursor.execute("INSERT INTO t VALUES (%s)", (1,))
+    engine.disconnect(cnx, cursor)
+    assert not cnx.in_transaction
+
+    (cnx, cursor) = engine.connect()
+    assert cursor.execute("SELECT COUNT(*) FROM t").fetchall() == [(0,)]
+    engine.disconnect(cnx, cursor)
+
+
+def test_sqlite_transient_errors(tmp_path):
+    engine = engines.SQLiteEngine(str(tmp_path / "vibranium.db"))
+    assert engine.transient(sqlite3.OperationalError("database is locked"))
+    assert engine.transient(sqlite3.OperationalError("database table is locked: acquisition"))
+    assert not engine.transient(sqlite3.OperationalError("no such table: acquisition"))
+    assert not engine.transient(sqlite3.OperationalError('near "SELEC": syntax error'))
+    assert not engine.transient(sqlite3.IntegrityError("UNIQUE constraint failed"))
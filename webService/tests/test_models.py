@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+from sklearn.svm import OneClassSVM
+
+
+def train(ML, equipID='MT01'):
+    rng    = np.random.default_rng(0)
+    models = dict()
+    for axis in ('x','y','z'):
+        data = pd.DataFrame(rng.normal([0.35, 1.41], 0.05, (200, 2)), columns=[f'{axis}rms', f'{axis}cf'])
+        models[axis] = ML.fitModel(data, 0.1, 5.0)
+    ML.ModelHandler().saveModels(equipID, models)
+    return models
+
+
+def test_model_exported_as_parameters(client, equipment, models):
+    trained  = train(models)
+    response = client.get('/v1/equipments/MT01/model')
+    assert response.status_code == 200
+
+    params = response.json['models']['x']
+    values = np.random.default_rng(1).normal([0.35, 1.41], 0.2, (20, 2))
+    dist   = ((values[:, None, :] - np.array(params['supportVectors'])[None]) ** 2).sum(axis=2)
+    scores = np.exp(-params['gamma'] * dist) @ np.array(params['dualCoef']) + params['intercept']
+    assert np.allclose(scores, trained['x'].decision_function(pd.DataFrame(values, columns=['xrms', 'xcf'])))
+
+    etag = response.headers['ETag']
+    assert client.get('/v1/equipments/MT01/model', headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_no_model(client, equipment, models):
+    assert client.get('/v1/equipments/MT01/model').status_code == 404
+
+
+def test_gateway_verdict_must_be_boolean(client, equipment, acquisition):
+    assert client.post('/v1/endpoints/EP01/acquisition', json=dict(acquisition(), anomaly='yes')).status_code == 400
+    assert client.post('/v1/endpoints/EP01/acquisition', json=dict(acquisition(), anomaly=None)).status_code == 200
+    assert client.post('/v1/endpoints/EP01/acquisition', json=dict(acquisition(), anomaly=True)).status_code == 200
+
+    response = client.post('/v1/acquisitions', json=[dict(acquisition(), anomaly=1), dict(acquisition(), anomaly=False)])
+    assert response.json['status'] == [400, 200]
+
+
+def test_rescore_skips_missing_features(client, equipment, acquisition, models, database):
+    train(models)
+    assert client.post('/v1/endpoints/EP01/acquisition', json=acquisition()).status_code == 200
+    assert client.post('/v1/endpoints/EP01/acquisition', json=acquisition(rms=None)).status_code == 200
+
+    response = client.post('/v1/equipments/MT01/rescore')
+    assert response.status_code == 200
+    assert response.json['rescored'] == 1
+    assert response.json['skipped'] == 1
+
+    with database.session() as (cnx, cursor):
+        cursor.execute("SELECT anomaly FROM acquisition ORDER BY acqID")
+        assert [row[0] for row in cursor.fetchall()] == [0, None]
+
+
+def test_one_model_version_per_batch(client, equipment, models, monkeypatch):
+    train(models)
+    handler = models.ModelHandler()
+    loads   = []
+    get     = models._modelCache.get
+    monkeypatch.setattr(models._modelCache, 'get', lambda name: loads.append(name) or get(name))
+
+    result = handler.predictBatch('MT01', np.tile([0.35, 1.41], (4, 3)))
+    assert loads == ['MT01']
+    assert not result[0].any()
+
+    # removed: no model, not a TypeError
+    monkeypatch.setattr(models._modelCache, 'get', lambda name: None)
+    assert handler.predictBatch('MT01', np.zeros((1, 6))) is None
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from ML import online
+
+
+@pytest.fixture
+def onlineEquipment(database, equipment, models, monkeypatch):
+    monkeypatch.setattr(online, 'DIR', models.DIR + 'online/')
+    database.queryUpdate('equipment', 'modelType', online.MODEL_TYPE, 'equipID', 'MT01')
+    return 'MT01'
+
+
+def fitted():
+    data = np.random.default_rng(0).normal([0.35, 1.41] * 3, 0.05, (200, 6))
+    return online.OnlineModel(seed=0).fit(data, epochs=1)
+
+
+def store(database, acquisition, anomalies):
+    (fields, values) = database.extractJsonAcq(acquisition())
+    rows = []
+    for anomaly in anomalies:
+        values[1] = anomaly
+        rows.append(list(values))
+    assert database.queryInsertMany('acquisition', fields, rows)
+
+
+def test_no_model(onlineEquipment):
+    assert online.OnlineHandler().predictBatch('MT01', np.zeros((1, 6))) is None
+    assert online.OnlineUpdater().update('MT01') is None
+
+
+def test_updates_saved_by_the_updater(onlineEquipment, database, acquisition):
+    online.saveCheckpoint('MT01', fitted())
+    store(database, acquisition, [False])
+    updater = online.OnlineUpdater(batchSize=4, checkpointEvery=1)
+
+    # first version: acquisitions stored so far were its dataset
+    assert updater.update('MT01') is None
+    store(database, acquisition, [False] * 8 + [True, None])
+    assert updater.update('MT01') == 2
+
+    model = online.loadCheckpoint('MT01', 2)
+    assert model.updates == fitted().updates + 8
+    assert model.lastAcqID == 11
+
+
+def test_newer_version_wins(onlineEquipment, database, acquisition, monkeypatch):
+    online.saveCheckpoint('MT01', fitted())
+    updater = online.OnlineUpdater(batchSize=4, checkpointEvery=1)
+    updater.update('MT01')
+    store(database, acquisition, [False] * 4)
+
+    # retrained while the updater learns: that version is kept
+    select = database.querySelectEquipAcq
+    def retrained(*args):
+        online.saveCheckpoint('MT01', fitted())
+        return select(*args)
+    monkeypatch.setattr(database, 'querySelectEquipAcq', retrained)
+    assert updater.update('MT01') is None
+    assert online.checkpoints('MT01') == [1, 2]
+    assert online.loadCheckpoint('MT01', 2).lastAcqID is None
+
+
+def test_one_process_updates(onlineEquipment):
+    (first, second) = (online.OnlineUpdater(), online.OnlineUpdater())
+    assert first.lease()
+    assert not second.lease()
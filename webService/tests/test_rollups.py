@@ -0,0 +1,69 @@
+import pytest
+from database.retention import Retention
+
+
+def points(client, maxPoints):
+    response = client.get('/v1/endpoints/EP01/acquisitions', query_string={
+        'from': '2021-08-10 00:00:00', 'to': '2021-08-11 00:00:00', 'fields': 'xrms,ycf',
+        'maxPoints': maxPoints})
+    assert response.status_code == 200
+    return response.json['points']
+
+
+def test_rollups_match_raw_rows(client, equipment, acquisition):
+    # one minute, one acquisition without its rms
+    for (second, rms) in ((0, 0.2), (20, None), (40, 0.4)):
+        acq = acquisition(timeStamp=f'2021-08-10 12:00:{second:02d}', rms=rms, cf=1.0 + second / 100)
+        assert client.post('/v1/endpoints/EP01/acquisition', json=acq).status_code == 200
+    acq = acquisition(timeStamp='2021-08-10 13:30:00', rms=0.6, cf=2.0)
+    assert client.post('/v1/endpoints/EP01/acquisition', json=acq).status_code == 200
+
+    raw = points(client, 5000)      # 18 s buckets: raw rows
+    day = points(client, 1)         # one bucket: day rollup
+    assert len(day) == 1
+    assert day[0]['count'] == 4 == sum(p['count'] for p in raw)
+
+    values = {'xrms': [0.2, 0.4, 0.6], 'ycf': [1.0, 1.2, 1.4, 2.0]}
+    for (f, v) in values.items():
+        assert day[0][f]['avg'] == pytest.approx(sum(v) / len(v))
+        assert day[0][f]['min'] == min(v)
+        assert day[0][f]['max'] == max(v)
+
+    # hour rollups: same averages as the raw buckets they cover
+    hours = points(client, 24)
+    assert [p['count'] for p in hours] == [3, 1]
+    assert hours[0]['xrms']['avg'] == pytest.approx(0.3)
+
+
+def test_lease(database):
+    assert database.queryLease('retention', 'a', 60)
+    assert not database.queryLease('retention', 'b', 60)
+    assert database.queryLease('retention', 'a', -1)     # renewed, then expired
+    assert database.queryLease('retention', 'b', 60)
+    assert not database.queryLease('retention', 'a', 60)
+
+
+def test_one_process_compacts(client, equipment, acquisition, database):
+    assert client.post('/v1/endpoints/EP01/acquisition', json=acquisition()).status_code == 200
+    (first, second) = (Retention({'acquisition': 1}), Retention({'acquisition': 1}))
+
+    assert second.lease()
+    assert first.compact() == {'acquisition': 0}
+    assert second.compact() == {'acquisition': 1}
+
+
+@pytest.mark.parametrize('table, column', [('acquisition', 'timeStamp'), ('acquisition_minute', 'bucket')])
+def test_compaction_reads_an_index(database, table, column):
+    with database.session() as (cnx, cursor):
+        # the batch query of db.queryCompact
+        cursor.execute(f"EXPLAIN QUERY PLAN SELECT * FROM {table} WHERE {column} < ? "
+                       f"ORDER BY {column} LIMIT 1000", ['2021-08-10'])
+        plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+    assert plan.startswith(f'SEARCH {table} USING')
+    assert 'TEMP B-TREE' not in plan
+
+
+@pytest.mark.parametrize('start', ['inf', 'nan', '1e20', '-1e20', 'yesterday'])
+def test_invalid_range(client, equipment, start):
+    response = client.get('/v1/endpoints/EP01/acquisitions', query_string={'from': start, 'to': '2021-08-11'})
+    assert response.status_code == 400
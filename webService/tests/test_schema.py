@@ -0,0 +1,23 @@
+from database import db
+from database.engines import SQLiteEngine
+
+
+def test_bootstrap_adds_new_columns(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, '_engine', SQLiteEngine(str(tmp_path / 'old.db')))
+    db._colCache.invalidate()
+    # tables of an older version
+    with db.session() as (cnx, cursor):
+        cursor.execute("CREATE TABLE equipment (equipID VARCHAR(32) NOT NULL PRIMARY KEY, \
+                        InTraining BOOLEAN NOT NULL DEFAULT FALSE)")
+        cursor.execute("INSERT INTO equipment VALUES ('MT01', FALSE)")
+        cursor.execute("CREATE TABLE training_state (equipID VARCHAR(32) NOT NULL PRIMARY KEY, \
+                        count INTEGER NOT NULL DEFAULT 0, jobID VARCHAR(32) NULL, \
+                        status VARCHAR(32) NULL, updated TIMESTAMP NULL)")
+        cnx.commit()
+    assert 'modelType' not in db.getColumns('equipment')
+
+    assert db.bootstrap()
+    assert db.bootstrap()   # nothing left to add
+    assert db.querySelectAllFrom('equipment', 'equipID', 'MT01')[0]['modelType'] is None
+    assert 'error' in db.getColumns('training_state')
+    db._colCache.invalidate()
@@ -0,0 +1,86 @@
+from concurrent.futures import Future
+from ML import ML
+from ML import jobs
+
+
+def state(database):
+    return database.queryTrainingState('MT01')[0]
+
+
+def test_one_claim_per_dataset(database, equipment):
+    assert not database.queryCountTraining('MT01', 399, 400, 600, 3600)
+    assert database.queryCountTraining('MT01', 1, 400, 600, 3600)
+    # claimed by this worker: the others keep counting
+    assert not database.queryCountTraining('MT01', 1, 400, 600, 3600)
+    assert state(database)['status'] == 'claimed'
+
+
+def test_failed_training_is_claimed_again(database, equipment):
+    assert database.queryCountTraining('MT01', 400, 400, 600, 3600)
+    database.queryTrainingState('MT01', 'job1', 'queued')
+    assert database.queryTrainingJob('job1', 'failed', error='boom')
+
+    # the dataset is kept: no 400 new acquisitions needed, only the retry delay
+    assert not database.queryCountTraining('MT01', 1, 400, 600, 3600)
+    assert database.queryCountTraining('MT01', 1, 400, 0, 3600)
+
+
+def test_dead_job_is_claimed_again(database, equipment):
+    assert database.queryCountTraining('MT01', 400, 400, 600, 3600)
+    database.queryTrainingState('MT01', 'job1', 'running')
+    assert not database.queryCountTraining('MT01', 1, 400, 600, 3600)
+    assert database.queryCountTraining('MT01', 1, 400, 600, 0)
+
+
+def test_cancel_from_another_worker(database, equipment, monkeypatch):
+    database.queryCountTraining('MT01', 400, 400, 600, 3600)
+    database.queryTrainingState('MT01', 'job1', 'queued')
+
+    # not run by this process: cancelled through the database
+    assert jobs.TrainingJobs().cancel('job1')['status'] == 'cancelling'
+    assert jobs.trainJob('job1', 'MT01', 400) is None
+
+    future = Future()
+    future.set_result(None)
+    jobs.TrainingJobs().finish('job1', 'MT01', future)
+    assert state(database)['status'] == 'cancelled'
+    assert state(database)['count'] == 0
+
+
+def test_models_of_cancelled_running_job_discarded(database, equipment, monkeypatch):
+    saved = []
+    monkeypatch.setattr(ML.ModelHandler, 'saveModels', lambda self, *args: saved.append(args))
+    database.queryCountTraining('MT01', 400, 400, 600, 3600)
+    database.queryTrainingState('MT01', 'job1', 'running')
+    database.queryTrainingJob('job1', 'cancelling')
+
+    future = Future()
+    future.set_result({'x': None, 'y': None, 'z': None})
+    jobs.TrainingJobs().finish('job1', 'MT01', future)
+    assert saved == []
+    assert jobs.TrainingJobs().status('job1')['status'] == 'cancelled'
+
+
+def test_job_saves_models(database, equipment, monkeypatch):
+    saved = []
+    monkeypatch.setattr(ML.ModelHandler, 'saveModels', lambda self, *args: saved.append(args))
+    database.queryCountTraining('MT01', 400, 400, 600, 3600)
+    database.queryTrainingState('MT01', 'job1', 'running')
+
+    future = Future()
+    future.set_result({'x': None, 'y': None, 'z': None})
+    jobs.TrainingJobs().finish('job1', 'MT01', future)
+    assert len(saved) == 1
+    assert state(database)['status'] == 'done'
+    assert database.querySelectAllFrom('equipment', 'equipID', 'MT01')[0]['InTraining'] == False
+
+
+def test_dataset_of_every_endpoint(database, equipment, client, acquisition):
+    with database.session() as (cnx, cursor):
+        cursor.execute("INSERT INTO endpoint VALUES ('EP02', 'MT01', 'GW01')")
+        cnx.commit()
+    client.post('/v1/endpoints/EP01/acquisition', json=acquisition(rms=0.1))
+    client.post('/v1/endpoints/EP02/acquisition', json=acquisition(endpointID='EP02', rms=0.2))
+
+    data = database.queryTrainingData('equipID', 'MT01', ML.FEATURES, 400)
+    assert sorted(data[:, 0]) == [0.1, 0.2]
@@ -0,0 +1,79 @@
+import json
+import sqlite3
+import threading
+import time
+from database.writer import WriteBehind
+
+
+def rows(database, acquisition, count, **poison):
+    (fields, values) = database.extractJsonAcq(acquisition())
+    batch = [('EP01', list(values)) for i in range(count)]
+    for (i, (column, value)) in enumerate(poison.items()):
+        batch[1][1][fields.index(column)] = value
+    return (fields, batch)
+
+
+def stored(database):
+    with database.session() as (cnx, cursor):
+        cursor.execute("SELECT COUNT(*) FROM acquisition")
+        return cursor.fetchall()[0][0]
+
+
+def test_poison_row_dead_lettered(tmp_path, database, equipment, acquisition):
+    deadLetter = tmp_path / 'dead.jsonl'
+    writer = WriteBehind('acquisition', batchSize=4, interval=0.01, deadLetter=str(deadLetter))
+    writer.start()
+    (fields, batch) = rows(database, acquisition, 4, xfreq={'not': 'a number'})
+    assert writer.put(fields, batch)
+    writer.stop(10)
+
+    assert stored(database) == 3
+    lines = [json.loads(line) for line in deadLetter.read_text().splitlines()]
+    assert len(lines) == 1
+    assert lines[0]['endpointID'] == 'EP01'
+
+
+def test_database_outage_retried(tmp_path, database, equipment, acquisition, monkeypatch):
+    deadLetter = tmp_path / 'dead.jsonl'
+    insertMany = database.insertMany
+    failures   = [sqlite3.OperationalError("database is locked")] * 3
+
+    def flaky(*args):
+        if failures:
+            raise failures.pop()
+        insertMany(*args)
+    monkeypatch.setattr(database, 'insertMany', flaky)
+
+    writer = WriteBehind('acquisition', batchSize=4, interval=0.01, retry=0.01, deadLetter=str(deadLetter))
+    writer.start()
+    (fields, batch) = rows(database, acquisition, 4)
+    assert writer.put(fields, batch)
+    deadline = time.monotonic() + 10
+    while stored(database) < 4 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    writer.stop(10)
+
+    assert not failures
+    assert stored(database) == 4
+    assert not deadLetter.exists()
+
+
+def test_rows_in_flight_count_toward_max_size(tmp_path, database, equipment, acquisition, monkeypatch):
+    (started, release) = (threading.Event(), threading.Event())
+
+    def blocked(*args):
+        started.set()
+        release.wait(10)
+    monkeypatch.setattr(database, 'insertMany', blocked)
+
+    writer = WriteBehind('acquisition', maxSize=4, batchSize=4, interval=0.01, deadLetter=str(tmp_path / 'dead.jsonl'))
+    writer.start()
+    (fields, batch) = rows(database, acquisition, 4)
+    assert writer.put(fields, batch)
+    assert started.wait(10)
+    assert not writer.put(fields, batch[:1])
+
+    release.set()
+    writer.stop(10)
+    assert writer.put(fields, batch[:1]) is False   # stopped
+    assert not writer.is_alive()